@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from mock_deepseek import start_mock_deepseek
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_agent(name, url):
+    """Import local/agent3.py or remote/agent3.py pointed at the mock server, with throwaway state files."""
+    state_dir = tempfile.mkdtemp(prefix="bench-deepseek-")
+    os.environ["DEEPSEEK_API_URL"] = url
+    os.environ["DEEPSEEK_API_KEY"] = "sk-benchmark-mock-key"
+    os.environ["SUGGESTION_CACHE_DB"] = os.path.join(state_dir, "suggestion_cache.db")
+    os.environ["JOBS_DB"] = os.path.join(state_dir, "jobs.db")
+    sys.path.insert(0, os.path.join(ROOT, name))
+    import agent3
+    return agent3
+
+def report(label, latencies, server_stats):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{label:<28} calls={len(latencies):<5} mean={statistics.mean(latencies) * 1000:7.2f}ms "
+          f"p50={p50:7.2f}ms p99={p99:7.2f}ms server_connections={server_stats['connections']}")
+
+def bench_local(agent3, server, calls):
+    for shared in (False, True):
+        server.stats.update(connections=0, requests=0)
+        latencies = []
+        for _ in range(calls):
+            if not shared:
+                # Baseline: a fresh session per call, as before pooling
+                agent3._deepseek_session = None
+            start = time.perf_counter()
+            assert agent3.call_deepseek("bench") is not None
+            latencies.append(time.perf_counter() - start)
+        report("local per-call session" if not shared else "local shared session", latencies, server.stats)
+    print(f"agent stats: {agent3.deepseek_connection_stats()}")
+
+def bench_remote(agent3, server, calls, concurrency):
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                assert await agent3.call_deepseek("bench") is not None
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one() for _ in range(calls)))
+        await agent3.get_deepseek_client().aclose()
+        return latencies
+
+    server.stats.update(connections=0, requests=0)
+    latencies = asyncio.run(run())
+    report(f"remote shared client x{concurrency}", latencies, server.stats)
+    print(f"agent stats: {agent3.deepseek_connection_stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure DeepSeek call latency and connection reuse against a local mock")
+    parser.add_argument("agent", choices=["local", "remote"])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10, help="parallel calls for the remote agent")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock server think time in seconds")
+    args = parser.parse_args()
+
+    server, url = start_mock_deepseek(latency=args.latency)
+    agent3 = load_agent(args.agent, url)
+    if args.agent == "local":
+        bench_local(agent3, server, args.calls)
+    else:
+        bench_remote(agent3, server, args.calls, args.concurrency)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
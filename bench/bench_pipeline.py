@@ -0,0 +1,257 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_nuclei import install, load_recorded_findings, write_templates
+from mock_deepseek import start_mock_deepseek
+from target_server import start_target_servers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {
+    "local-agent": "local",    # agent3.handle_request -> process_request, in-process
+    "remote-sse": "remote",    # POST /scan on the FastAPI agent, read as SSE
+    "local-ui": "local",       # app_ui.send_request through the agent3.py process pool, then save_history
+    "remote-ui": "remote"      # app_ui.send_request through the agent's job queue, then save_history
+}
+
+def prepare(args):
+    """Throwaway state files, the fake nuclei on PATH, templates for the recorded findings and the mock DeepSeek.
+
+    Returns the recorded template directories, which the scans ask for.
+    """
+    state_dir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    findings = load_recorded_findings(args.findings)
+    if not findings:
+        sys.exit("No recorded findings to replay")
+    templates_dir = os.path.join(state_dir, "nuclei-templates")
+    directories = sorted({os.path.dirname(path) + "/" for path in write_templates(findings, templates_dir)})
+    bin_dir = os.path.join(state_dir, "bin")
+    install(bin_dir)
+    _, deepseek_url = start_mock_deepseek(latency=args.deepseek_latency, templates=directories)
+    os.environ.update({
+        "PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+        "NUCLEI_TEMPLATES_DIR": templates_dir,
+        "DEEPSEEK_API_URL": deepseek_url,
+        "DEEPSEEK_API_KEY": "sk-benchmark-mock-key",
+        "FAKE_NUCLEI_RATE": str(args.rate),
+        "FAKE_NUCLEI_REPEAT": str(args.repeat),
+        "FAKE_NUCLEI_PAD": str(args.pad),
+        "FAKE_NUCLEI_PROBE": "1" if args.probe else "0"
+    })
+    if args.findings:
+        os.environ["FAKE_NUCLEI_FINDINGS"] = os.pathsep.join(os.path.abspath(path) for path in args.findings)
+    # Every state file (template index, caches, jobs, history) is created relative to the working directory
+    os.chdir(state_dir)
+    sys.path.insert(0, os.path.join(ROOT, MODES[args.mode]))
+    logging.disable(logging.INFO)
+    print(f"{len(findings)} recorded findings under {', '.join(directories)}; state in {state_dir}")
+    return directories
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_agent_server():
+    """Serve remote/agent3.py with uvicorn on a free port in a background thread and return its URL."""
+    import uvicorn
+    import agent3
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(agent3.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+def start_agent_processes(count):
+    """Run count remote/agent3.py servers as uvicorn processes, each in its own state directory; return (processes, urls)."""
+    import subprocess
+    import requests
+    processes, urls = [], []
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, "remote"))
+    for index in range(count):
+        port = free_port()
+        state_dir = os.path.join(os.getcwd(), f"agent-{index + 1}")
+        os.makedirs(state_dir, exist_ok=True)
+        processes.append(subprocess.Popen([sys.executable, "-m", "uvicorn", "agent3:app", "--host", "127.0.0.1",
+                                           "--port", str(port), "--log-level", "warning"], cwd=state_dir, env=env))
+        urls.append(f"http://127.0.0.1:{port}")
+    for url in urls:
+        for _ in range(200):
+            try:
+                requests.get(f"{url}/status", timeout=1).raise_for_status()
+                break
+            except requests.RequestException:
+                time.sleep(0.1)
+        else:
+            sys.exit(f"Agent at {url} did not start")
+    return processes, urls
+
+def make_runner(mode, args):
+    """Return (scan, close): scan(request) runs one scan through the mode's path and returns (findings, status)."""
+    if mode == "local-agent":
+        import agent3
+
+        def scan(request):
+            response = agent3.handle_request(request)
+            results = response.get("results") or []
+            count = len(results)
+            if hasattr(results, "close"):
+                results.close()
+            return count, response.get("status")
+        return scan, lambda: None
+
+    if mode == "remote-sse":
+        import requests
+        from sseclient import SSEClient
+        server, url = start_agent_server()
+        session = threading.local()
+
+        def scan(request):
+            if not hasattr(session, "http"):
+                session.http = requests.Session()
+            response = session.http.post(f"{url}/scan", json=request, stream=True)
+            response.raise_for_status()
+            findings = 0
+            for event in SSEClient(response).events():
+                if event.event == "finding":
+                    findings += 1
+                elif event.event == "summary":
+                    return findings, json.loads(event.data).get("status")
+            return findings, "error"
+        return scan, lambda: setattr(server, "should_exit", True)
+
+    import app_ui
+    if mode == "local-ui":
+        from agent_pool import AgentPool
+        app_ui.agent_pool = AgentPool([sys.executable, os.path.join(ROOT, "local", "agent3.py")], size=args.agents)
+        close = app_ui.agent_pool.close
+    elif args.agents > 1:
+        # Several agent processes behind the UI's router, to measure the scale-out
+        from agent_router import AgentRouter
+        processes, urls = start_agent_processes(args.agents)
+        app_ui.agent_router = AgentRouter(urls, health_interval=1)
+
+        def close():
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+    else:
+        from agent_router import AgentRouter
+        server, url = start_agent_server()
+        app_ui.agent_router = AgentRouter([url])
+        close = lambda: setattr(server, "should_exit", True)
+
+    def scan(request):
+        response = app_ui.send_request(request)
+        app_ui.save_history({
+            "scan_id": str(time.time_ns()),
+            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "request": request,
+            "response": response
+        })
+        return len(response.get("results") or []), response.get("status")
+    return scan, close
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+def compare(record, path):
+    """Print the change against the last run recorded in path with the same settings, then append this run."""
+    previous = None
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["settings"] == record["settings"]:
+                    previous = entry
+    if previous:
+        changes = []
+        for key in ("scans_per_s", "findings_per_s", "p50_ms", "p99_ms", "peak_rss_mb"):
+            if previous[key]:
+                changes.append(f"{key}={(record[key] - previous[key]) / previous[key] * 100:+.1f}%")
+        print(f"vs {previous['timestamp']}: {' '.join(changes)}")
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure scans end to end against local targets, a fake nuclei and a mock DeepSeek")
+    parser.add_argument("mode", choices=sorted(MODES))
+    parser.add_argument("--scans", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4, help="scans submitted in parallel")
+    parser.add_argument("--warmup", type=int, default=1, help="scans run first and left out of the results")
+    parser.add_argument("--targets", type=int, default=4, help="local target servers; scans go round-robin")
+    parser.add_argument("--findings", action="append", help="JSONL or scan history file to replay (repeatable; default: both scan_history.json)")
+    parser.add_argument("--rate", type=float, default=0, help="findings per second printed by the fake nuclei, 0 for no limit")
+    parser.add_argument("--repeat", type=int, default=1, help="times the fake nuclei replays the findings per target")
+    parser.add_argument("--pad", type=int, default=0, help="bytes added to each finding's response")
+    parser.add_argument("--probe", action="store_true", help="fake nuclei sends one request to the target per finding")
+    parser.add_argument("--deepseek", action="store_true", help="ask the mock DeepSeek for templates instead of naming them")
+    parser.add_argument("--deepseek-latency", type=float, default=0.0)
+    parser.add_argument("--agents", type=int, default=2, help="agent3.py processes in the local-ui pool, or remote agent processes behind remote-ui (1 runs it in-process)")
+    parser.add_argument("--request", default="{}", help="extra scan request fields as JSON, e.g. '{\"fingerprint\": true}'")
+    parser.add_argument("--record", help="JSONL file to append the results to, compared against the last matching run")
+    args = parser.parse_args()
+
+    record_path = os.path.abspath(args.record) if args.record else None
+    directories = prepare(args)
+    servers, targets = start_target_servers(args.targets)
+    scan, close = make_runner(args.mode, args)
+    base_request = {"type": "scan_request", "rate_limit": 50, "use_deepseek": args.deepseek,
+                    "templates": [] if args.deepseek else directories, "vulnerability_type": "http",
+                    **json.loads(args.request)}
+
+    def timed(index):
+        start = time.perf_counter()
+        findings, status = scan(dict(base_request, target=targets[index % len(targets)]))
+        return time.perf_counter() - start, findings, status
+
+    for index in range(args.warmup):
+        timed(index)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        runs = list(executor.map(timed, range(args.scans)))
+    wall = time.perf_counter() - start
+    close()
+    for server in servers:
+        server.shutdown()
+
+    latencies = sorted(latency for latency, _, _ in runs)
+    findings = sum(count for _, count, _ in runs)
+    errors = sum(1 for _, _, status in runs if status != "success")
+    record = {
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": {k: v for k, v in vars(args).items() if k != "record"},
+        "wall_s": round(wall, 3),
+        "scans_per_s": round(args.scans / wall, 3),
+        "findings_per_s": round(findings / wall, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "children_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "findings": findings,
+        "errors": errors
+    }
+    print(f"{args.mode:<12} scans={args.scans:<5} concurrency={args.concurrency:<3} wall={wall:8.2f}s "
+          f"throughput={record['scans_per_s']:7.2f} scans/s {record['findings_per_s']:9.1f} findings/s "
+          f"p50={record['p50_ms']:8.1f}ms p99={record['p99_ms']:8.1f}ms peak_rss={record['peak_rss_mb']:.1f}MB "
+          f"children_peak_rss={record['children_peak_rss_mb']:.1f}MB errors={errors}")
+    if record_path:
+        compare(record, record_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from target_server import start_target_servers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_agent():
+    """Import remote/agent3.py with throwaway state files."""
+    state_dir = tempfile.mkdtemp(prefix="bench-shards-")
+    # Every state file (template index, caches, jobs, learned rates, scan state, checkpoints) is
+    # created relative to the working directory, so no run reuses another's learned rates
+    os.chdir(state_dir)
+    sys.path.insert(0, os.path.join(ROOT, "remote"))
+    import agent3
+    return agent3
+
+async def scan(agent3, targets, templates, rate_limit, shards):
+    start = time.perf_counter()
+    summary = None
+    async for kind, payload in agent3.stream_nuclei(targets[0], templates, rate_limit, targets, shards):
+        if kind == "summary":
+            summary = payload
+    return time.perf_counter() - start, summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare wall-clock time of sharded Nuclei scans against local targets")
+    parser.add_argument("--targets", type=int, default=16, help="local target servers, one port each")
+    parser.add_argument("--templates", default="http/technologies/,http/exposures/,http/misconfiguration/")
+    parser.add_argument("--shards", default="1,2,4,8")
+    parser.add_argument("--rate-limit", type=int, default=800, help="global requests/s budget split between shards")
+    parser.add_argument("--latency", type=float, default=0.0, help="target server think time in seconds")
+    args = parser.parse_args()
+
+    servers, targets = start_target_servers(args.targets, latency=args.latency)
+    templates = [t.strip() for t in args.templates.split(",") if t.strip()]
+    agent3 = load_agent()
+    baseline = None
+    for shards in (int(n) for n in args.shards.split(",")):
+        for server in servers:
+            server.stats["requests"] = 0
+        elapsed, summary = asyncio.run(scan(agent3, targets, templates, args.rate_limit, shards))
+        baseline = baseline or elapsed
+        requests = sum(server.stats["requests"] for server in servers)
+        print(f"shards={shards:<3} processes={summary.get('shards', 1):<3} wall={elapsed:8.2f}s "
+              f"speedup={baseline / elapsed:5.2f}x findings={summary['findings']:<5} "
+              f"duplicates={summary.get('duplicates', 0):<4} target_requests={requests} errors={len(summary['errors'])}")
+    for server in servers:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Stand-in for the nuclei binary that replays recorded findings instead of scanning; see README.md."""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RECORDINGS = [os.path.join(ROOT, "local", "scan_history.json"), os.path.join(ROOT, "remote", "scan_history.json")]
+
+def template_path(finding):
+    """The recorded template path relative to the templates directory, with forward slashes."""
+    path = (finding.get("template") or "").replace("\\", "/").lstrip("/")
+    return path or f"{finding.get('template-id', 'unknown')}.yaml"
+
+def load_recorded_findings(paths=None):
+    """Read findings from JSONL files (one finding per line) or scan history JSON files."""
+    findings = []
+    for path in paths or DEFAULT_RECORDINGS:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                findings.extend(json.loads(line) for line in f if line.strip())
+                continue
+            for scan in json.load(f):
+                findings.extend(scan.get("response", {}).get("results") or [])
+    return findings
+
+def write_templates(findings, root):
+    """Write a minimal template file for every recorded template, so the agents' template index finds them."""
+    written = set()
+    for finding in findings:
+        path = template_path(finding)
+        if path in written:
+            continue
+        written.add(path)
+        info = finding.get("info", {})
+        full_path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w", encoding="utf-8") as f:
+            f.write(f"id: {finding.get('template-id', 'unknown')}\n\n"
+                    f"info:\n  name: {info.get('name', 'Recorded template')}\n  author: bench\n"
+                    f"  severity: {info.get('severity', 'info')}\n  tags: {','.join(info.get('tags') or [])}\n\n"
+                    f"http:\n  - method: GET\n    path:\n      - \"{{{{BaseURL}}}}/\"\n")
+    return sorted(written)
+
+def install(bin_dir):
+    """Put an executable named nuclei running this script in bin_dir; prepend bin_dir to PATH to use it."""
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, "nuclei")
+    with open(path, "w") as f:
+        f.write(f"#!/bin/sh\nexec \"{sys.executable}\" \"{os.path.abspath(__file__)}\" \"$@\"\n")
+    os.chmod(path, 0o755)
+    return path
+
+def selected(findings, templates, root):
+    """Keep the findings whose template is one of the -t files or lies under one of the -t directories."""
+    wanted = []
+    for template in templates:
+        if template.endswith(".txt") and os.path.isfile(template):
+            with open(template) as f:
+                wanted.extend(line.strip() for line in f if line.strip())
+        else:
+            wanted.append(template)
+    if not wanted:
+        return findings
+    prefixes = []
+    for template in wanted:
+        if os.path.isabs(template):
+            template = os.path.relpath(template, root)
+        prefixes.append(template.replace(os.sep, "/").rstrip("/"))
+    return [f for f in findings
+            if any(template_path(f) == p or template_path(f).startswith(p + "/") for p in prefixes)]
+
+def retargeted(finding, target, pad):
+    """Copy a finding as if Nuclei had reported it for target."""
+    parts = urlsplit(target if "://" in target else f"http://{target}")
+    path = finding.get("path") or "/"
+    finding = dict(finding, host=parts.hostname or target, url=f"{parts.scheme}://{parts.netloc}",
+                   **{"matched-at": f"{parts.scheme}://{parts.netloc}{path}", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")})
+    if parts.port:
+        finding["port"] = str(parts.port)
+    if pad:
+        finding["response"] = (finding.get("response") or "") + "x" * pad
+    return finding
+
+def main():
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-u")
+    parser.add_argument("-l")
+    parser.add_argument("-t", action="append", default=[])
+    parser.add_argument("-stats", action="store_true")
+    args, _ = parser.parse_known_args()
+
+    root = os.getenv("NUCLEI_TEMPLATES_DIR", os.path.join(os.path.expanduser("~"), "nuclei-templates"))
+    recordings = [p for p in os.getenv("FAKE_NUCLEI_FINDINGS", "").split(os.pathsep) if p]
+    rate = float(os.getenv("FAKE_NUCLEI_RATE", "0"))
+    repeat = int(os.getenv("FAKE_NUCLEI_REPEAT", "1"))
+    pad = int(os.getenv("FAKE_NUCLEI_PAD", "0"))
+    probe = os.getenv("FAKE_NUCLEI_PROBE") == "1"
+    time.sleep(float(os.getenv("FAKE_NUCLEI_STARTUP", "0")))
+
+    targets = [args.u] if args.u else []
+    if args.l:
+        with open(args.l) as f:
+            targets.extend(line.strip() for line in f if line.strip())
+    findings = selected(load_recorded_findings([p for r in recordings for p in glob.glob(r)] or None), args.t, root)
+
+    started = time.time()
+    printed = 0
+    requests = 0
+    errors = 0
+    for target in targets:
+        for _ in range(repeat):
+            for finding in findings:
+                if rate:
+                    delay = started + printed / rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                if probe:
+                    requests += 1
+                    try:
+                        with urllib.request.urlopen(target, timeout=5) as response:
+                            response.read()
+                    except OSError:
+                        errors += 1
+                print(json.dumps(retargeted(finding, target, pad)), flush=True)
+                printed += 1
+    if args.stats:
+        elapsed = max(time.time() - started, 0.001)
+        print(json.dumps({"duration": f"{elapsed:.0f}s", "errors": str(errors), "hosts": str(len(targets)),
+                          "matched": str(printed), "percent": "100", "requests": str(requests or printed),
+                          "rps": str(int((requests or printed) / elapsed)), "templates": str(len(findings)),
+                          "total": str(requests or printed)}), file=sys.stderr, flush=True)
+
+if __name__ == "__main__":
+    main()
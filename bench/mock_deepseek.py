@@ -0,0 +1,89 @@
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_TEMPLATES = ["http/technologies/", "http/exposures/", "http/vulnerabilities/"]
+
+class MockDeepSeekHandler(BaseHTTPRequestHandler):
+    """Answers any POST like the DeepSeek chat completions API, over keep-alive HTTP/1.1."""
+
+    protocol_version = "HTTP/1.1"
+    # Buffer headers and body into one write; separate small writes stall keep-alive clients on delayed ACKs
+    wbufsize = -1
+
+    def setup(self):
+        super().setup()
+        # One handler instance per TCP connection
+        with self.server.stats_lock:
+            self.server.stats["connections"] += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            self._send(503, {"error": {"message": "Service temporarily unavailable"}})
+            return
+        self._send(200, {
+            "id": "mock",
+            "object": "chat.completion",
+            "model": "deepseek-chat",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(self.server.templates)},
+                "finish_reason": "stop"
+            }]
+        })
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def start_mock_deepseek(host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, templates=None):
+    """Start the mock server in a background thread and return (server, chat completions URL)."""
+    server = ThreadingHTTPServer((host, port), MockDeepSeekHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.templates = templates or DEFAULT_TEMPLATES
+    server.stats = {"connections": 0, "requests": 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+    return server, url
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the DeepSeek chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    server, url = start_mock_deepseek(args.host, args.port, args.latency, args.error_rate)
+    logging.info(f"Mock DeepSeek listening on {url} (set DEEPSEEK_API_URL to use it)")
+    try:
+        while True:
+            time.sleep(60)
+            logging.info(f"Mock DeepSeek stats: {server.stats}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
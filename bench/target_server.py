@@ -0,0 +1,77 @@
+import argparse
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PAGE = b"""<!DOCTYPE html>
+<html><head><title>Index of /</title><meta name="generator" content="WordPress 5.8"></head>
+<body><h1>Index of /</h1><a href="/wp-login.php">Log in</a> <a href="/.git/config">.git</a></body></html>
+"""
+
+class TargetHandler(BaseHTTPRequestHandler):
+    """Small keep-alive web app with fingerprintable headers, answering every path with the same page."""
+
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+
+    def do_GET(self):
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Server", "Apache/2.4.41 (Ubuntu)")
+        self.send_header("X-Powered-By", "PHP/7.4.3")
+        self.send_header("Content-Type", "text/html; charset=UTF-8")
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    do_POST = do_GET
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def start_target_server(host="127.0.0.1", port=0, latency=0.0):
+    """Start one target server in a background thread and return (server, base URL)."""
+    server = ThreadingHTTPServer((host, port), TargetHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.stats = {"requests": 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def start_target_servers(count, host="127.0.0.1", latency=0.0):
+    """Start count servers on separate ports, so each one is a distinct host:port for Nuclei."""
+    servers = [start_target_server(host, 0, latency) for _ in range(count)]
+    return [server for server, _ in servers], [url for _, url in servers]
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP targets for offline scan benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--count", type=int, default=1, help="number of servers, one port each")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering")
+    args = parser.parse_args()
+
+    servers, urls = start_target_servers(args.count, args.host, args.latency)
+    for url in urls:
+        logging.info(f"Target listening on {url}")
+    try:
+        while True:
+            time.sleep(60)
+            logging.info(f"Target requests: {sum(server.stats['requests'] for server in servers)}")
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -13,10 +13,13 @@ from urllib3.util.retry import Retry
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # DeepSeek API configuration
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "hehehe")
 DEEPSEEK_MODEL = "deepseek-chat"
 
+# Shared keep-alive session for all DeepSeek calls, created on first use
+_deepseek_session = None
+
 def clean_yaml_content(content):
     """Remove markdown backticks and other unwanted formatting from YAML content."""
     if not content:
@@ -26,13 +29,22 @@ def clean_yaml_content(content):
     # Remove any leading/trailing whitespace
     return content.strip()
 
+def get_deepseek_session():
+    """Return the shared DeepSeek session with retries and connection reuse."""
+    global _deepseek_session
+    if _deepseek_session is None:
+        session = requests.Session()
+        retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(max_retries=retries)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _deepseek_session = session
+    return _deepseek_session
+
 def call_deepseek(prompt):
     """Call DeepSeek API to generate or parse data with retries and timeout."""
-    # Configure session with retries and timeout
-    session = requests.Session()
-    retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-    session.mount("https://", HTTPAdapter(max_retries=retries))
-    
+    session = get_deepseek_session()
+
     headers = {
         "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
         "Content-Type": "application/json"
@@ -191,6 +203,8 @@ def main():
             request = json.loads(line.strip())
             if request.get("type") == "scan_request":
                 response = process_request(request)
+                if "request_id" in request:
+                    response["request_id"] = request["request_id"]
                 print(json.dumps(response, ensure_ascii=False), flush=True)
         except json.JSONDecodeError:
             print(json.dumps({"type": "scan_response", "status": "error", "errors": ["Invalid JSON"]}, ensure_ascii=False), flush=True)
@@ -5,16 +5,91 @@ import requests
 import logging
 import os
 import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from suggestion_cache import SuggestionCache
+from batch_targets import parse_targets, write_targets_file, TargetMatcher
+from template_index import TemplateIndex
+from scan_state import ScanState
+from rate_control import RateController, ScanObservation
+from checkpoints import CheckpointStore, chunk_templates, replayed
+from finding_spool import FindingSpool
+from metrics import Registry, PhaseTimer
+from fingerprint import (FINGERPRINT_TEMPLATES, TARGETED_DIRECTORIES, FALLBACK_DIRECTORIES,
+                         detect_technologies, technology_tags)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # DeepSeek API configuration
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "sk-e0abe1db2f0c4c1ca45a917a99a714f7")
 DEEPSEEK_MODEL = "deepseek-chat"
+DEEPSEEK_POOL_SIZE = int(os.getenv("DEEPSEEK_POOL_SIZE", "10"))
+DEEPSEEK_CONNECT_TIMEOUT = float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", "10"))
+DEEPSEEK_READ_TIMEOUT = float(os.getenv("DEEPSEEK_READ_TIMEOUT", "60"))
+
+# Shared keep-alive session for all DeepSeek calls, created on first use
+_deepseek_session = None
+_deepseek_session_lock = threading.Lock()
+
+# DeepSeek suggestion cache; bump SUGGESTION_PROMPT_VERSION when the prompts change
+SUGGESTION_CACHE_DB = os.getenv("SUGGESTION_CACHE_DB", "suggestion_cache.db")
+SUGGESTION_CACHE_TTL = int(os.getenv("SUGGESTION_CACHE_TTL", str(7 * 24 * 3600)))
+SUGGESTION_PROMPT_VERSION = "1"
+suggestion_cache = SuggestionCache(SUGGESTION_CACHE_DB, ttl=SUGGESTION_CACHE_TTL, version=SUGGESTION_PROMPT_VERSION)
+
+# Index of the templates on disk, persisted between restarts and refreshed by mtime
+NUCLEI_TEMPLATES_DIR = os.getenv("NUCLEI_TEMPLATES_DIR", os.path.join(os.path.expanduser("~"), "nuclei-templates"))
+TEMPLATE_INDEX_PATH = os.getenv("TEMPLATE_INDEX_PATH", "template_index.json")
+TEMPLATE_INDEX_REFRESH = int(os.getenv("TEMPLATE_INDEX_REFRESH", "3600"))
+template_index = TemplateIndex(NUCLEI_TEMPLATES_DIR, TEMPLATE_INDEX_PATH, max_age=TEMPLATE_INDEX_REFRESH)
+
+# Incremental rescans: templates run per target, and how long a run stays fresh
+SCAN_STATE_DB = os.getenv("SCAN_STATE_DB", "scan_state.db")
+INCREMENTAL_STALE_AFTER = int(os.getenv("INCREMENTAL_STALE_AFTER", str(7 * 24 * 3600)))
+scan_state = ScanState(SCAN_STATE_DB, stale_after=INCREMENTAL_STALE_AFTER)
+
+# Adaptive rate control: per-host Nuclei rates learned from earlier scans
+RATE_CONTROL_DB = os.getenv("RATE_CONTROL_DB", "rate_control.db")
+ADAPTIVE_MIN_RATE = int(os.getenv("ADAPTIVE_MIN_RATE", "5"))
+ADAPTIVE_MAX_RATE = int(os.getenv("ADAPTIVE_MAX_RATE", "500"))
+rate_controller = RateController(RATE_CONTROL_DB, min_rate=ADAPTIVE_MIN_RATE, max_rate=ADAPTIVE_MAX_RATE)
+
+# Nuclei is killed after SCAN_TIMEOUT seconds; findings printed before that are kept
+NUCLEI_TIMEOUT = int(os.getenv("SCAN_TIMEOUT", "900"))
+# Findings are parsed as Nuclei prints them and moved to a temporary file past this many bytes
+FINDINGS_SPILL_BYTES = int(os.getenv("FINDINGS_SPILL_BYTES", str(64 * 1024 * 1024)))
+# Last stderr lines reported when Nuclei fails
+STDERR_TAIL_LINES = 50
+# Checkpointed scans: templates run in chunks sharing one SCAN_TIMEOUT budget, finished chunks are kept
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "checkpoints.db")
+CHECKPOINT_CHUNK_SIZE = int(os.getenv("CHECKPOINT_CHUNK_SIZE", "500"))
+CHECKPOINT_TTL = int(os.getenv("CHECKPOINT_TTL", str(7 * 24 * 3600)))
+checkpoints = CheckpointStore(CHECKPOINT_DB, ttl=CHECKPOINT_TTL)
+
+# Metrics of this agent; the UI collects them with a {"type": "metrics"} request and serves them on /metrics
+metrics = Registry()
+scan_phase_seconds = metrics.histogram("nuclei_scan_phase_seconds", "Time spent in each scan phase", ["phase"])
+scans_total = metrics.counter("nuclei_scans_total", "Scans finished, by status", ["status"])
+findings_total = metrics.counter("nuclei_findings_total", "Findings reported by Nuclei, by severity", ["severity"])
+scan_timeouts_total = metrics.counter("nuclei_scan_timeouts_total", "Nuclei runs killed by SCAN_TIMEOUT")
+templates_not_found_total = metrics.counter("nuclei_templates_not_found_total",
+                                            "Requested templates missing from the templates directory")
+scans_in_flight = metrics.gauge("nuclei_scans_in_flight", "Scans currently running")
+deepseek_request_seconds = metrics.histogram("deepseek_request_seconds", "DeepSeek call latency, retries included")
+deepseek_retries_total = metrics.counter("deepseek_retries_total", "DeepSeek requests retried")
+deepseek_failures_total = metrics.counter("deepseek_failures_total", "DeepSeek calls that returned no templates")
+
+# Requests handled concurrently by the stdio loop
+AGENT_MAX_WORKERS = int(os.getenv("AGENT_MAX_WORKERS", "8"))
+output_lock = threading.Lock()
 
 # Default templates if DeepSeek fails and use_deepseek=True
 DEFAULT_TEMPLATES = ["http/technologies/", "http/exposures/", "http/vulnerabilities/"]
@@ -55,16 +130,45 @@ def clean_template_list(content):
             return None
         return templates
 
+def get_deepseek_session():
+    """Return the shared DeepSeek session, with keep-alive connection pooling and retries."""
+    global _deepseek_session
+    with _deepseek_session_lock:
+        if _deepseek_session is None:
+            session = requests.Session()
+            retries = Retry(total=5, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504])
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=DEEPSEEK_POOL_SIZE, max_retries=retries)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _deepseek_session = session
+        return _deepseek_session
+
+def deepseek_connection_stats():
+    """Report DeepSeek requests sent and connections opened; the difference were served by reused connections."""
+    pools = get_deepseek_session().get_adapter(DEEPSEEK_API_URL).poolmanager.pools
+    pools = [pools[key] for key in pools.keys()]
+    requests_sent = sum(pool.num_requests for pool in pools)
+    connections = sum(pool.num_connections for pool in pools)
+    return {
+        "requests": requests_sent,
+        "connections": connections,
+        "reused": max(requests_sent - connections, 0)
+    }
+
 def call_deepseek(prompt):
-    """Call DeepSeek API to suggest Nuclei template directories."""
+    """Call DeepSeek API to suggest Nuclei template directories, recording latency and failures."""
+    with deepseek_request_seconds.time():
+        template_list = _call_deepseek(prompt)
+    if not template_list:
+        deepseek_failures_total.inc()
+    return template_list
+
+def _call_deepseek(prompt):
     if not DEEPSEEK_API_KEY or len(DEEPSEEK_API_KEY) < 10:
         logging.error("Invalid or missing DEEPSEEK_API_KEY")
         return None
 
-    session = requests.Session()
-    retries = Retry(total=5, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504])
-    session.mount("https://", HTTPAdapter(max_retries=retries))
-    
+    session = get_deepseek_session()
     headers = {
         "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
         "Content-Type": "application/json"
@@ -75,7 +179,12 @@ def call_deepseek(prompt):
         "max_tokens": 500
     }
     try:
-        response = session.post(DEEPSEEK_API_URL, headers=headers, json=data, timeout=60)
+        response = session.post(DEEPSEEK_API_URL, headers=headers, json=data,
+                                 timeout=(DEEPSEEK_CONNECT_TIMEOUT, DEEPSEEK_READ_TIMEOUT))
+        # urllib3 keeps the attempts its Retry made before this response
+        retries = getattr(response.raw, "retries", None)
+        if retries is not None and retries.history:
+            deepseek_retries_total.inc(len(retries.history))
         response.raise_for_status()
         raw_content = response.json()["choices"][0]["message"]["content"]
         return clean_template_list(raw_content)
@@ -85,57 +194,414 @@ def call_deepseek(prompt):
             logging.error(f"HTTP status: {e.response.status_code}, response: {e.response.text}")
         return None
 
-def run_nuclei(target, templates=None, rate_limit=50):
-    """Run Nuclei with specified parameters."""
-    cmd = ["nuclei", "-u", target, "-rl", str(rate_limit), "-jsonl", "-silent"]
+def suggest_with_cache(target, vulnerability_type, prompt):
+    """Return cached template suggestions for the target host and type, asking DeepSeek on a miss."""
+    template_list = suggestion_cache.get(target, vulnerability_type)
+    if template_list:
+        return template_list
+    template_list = call_deepseek(prompt)
+    if template_list:
+        suggestion_cache.put(target, vulnerability_type, template_list)
+    return template_list
+
+def run_nuclei(target, templates=None, rate_limit=50, targets=None, concurrency=None, bulk_size=None,
+               observation=None, timeout=None, phases=None, on_finding=None):
+    """Run Nuclei with specified parameters.
+
+    With several targets, one Nuclei process scans them all from a list file (-l)
+    and each finding is tagged with the input "target" it belongs to. Nuclei's final
+    stats and stderr are fed to observation (a rate_control.ScanObservation) if given.
+
+    Findings are parsed line by line as Nuclei prints them into a FindingSpool, which
+    moves to disk past FINDINGS_SPILL_BYTES, and stderr is classified on a reader
+    thread as it arrives. Nuclei is killed after timeout seconds (NUCLEI_TIMEOUT by
+    default); the findings it printed until then, or before failing, are still returned.
+
+    The time spent validating templates, running Nuclei and parsing its output is
+    added to phases (a metrics.PhaseTimer), and observed in the phase histogram.
+    on_finding, if given, is called with each finding as soon as it is parsed.
+    """
+    phases = phases or PhaseTimer(scan_phase_seconds)
+    started = time.perf_counter()
+    matcher = None
+    targets_file = None
+    templates_file = None
+    if targets and len(targets) > 1:
+        matcher = TargetMatcher(targets)
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", prefix="nuclei-targets-", delete=False) as f:
+            targets_file = f.name
+        write_targets_file(targets, targets_file)
+        cmd = ["nuclei", "-l", targets_file, "-rl", str(rate_limit), "-jsonl", "-silent"]
+    else:
+        cmd = ["nuclei", "-u", target, "-rl", str(rate_limit), "-jsonl", "-silent"]
+    if concurrency:
+        cmd.extend(["-c", str(concurrency)])
+    if bulk_size:
+        cmd.extend(["-bs", str(bulk_size)])
+    if observation is not None:
+        cmd.extend(["-stats", "-sj", "-si", "60"])
     
     valid_templates = []
     if templates:
         for template in templates:
             template = template.rstrip("/")
-            template_path = os.path.join(os.path.expanduser("~"), "nuclei-templates", template)
-            if os.path.exists(template_path):
+            if template_index.exists(template):
                 valid_templates.append(template)
             else:
                 logging.warning(f"Template directory not found: {template}")
+                templates_not_found_total.inc()
         
-        if valid_templates:
+        if any(t.endswith((".yaml", ".yml")) for t in valid_templates):
+            # Explicit template files from narrow_templates go to Nuclei as one list file
+            with tempfile.NamedTemporaryFile("w", suffix=".txt", prefix="nuclei-templates-", delete=False) as f:
+                f.write("\n".join(os.path.join(NUCLEI_TEMPLATES_DIR, t) for t in valid_templates) + "\n")
+                templates_file = f.name
+            cmd.extend(["-t", templates_file])
+        elif valid_templates:
             for template in valid_templates:
                 cmd.extend(["-t", template])
         else:
             logging.warning("No valid templates provided, using all available Nuclei templates")
     
+    timeout = timeout or NUCLEI_TIMEOUT
+    results = FindingSpool(FINDINGS_SPILL_BYTES)
+    errors = []
+    phases.add("template_validation", time.perf_counter() - started)
+    started = time.perf_counter()
+    parse_seconds = 0.0
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        results = []
-        for line in result.stdout.splitlines():
-            if line.strip():
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace")
+        timed_out = threading.Event()
+
+        def stop():
+            timed_out.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, stop)
+        stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        reader = threading.Thread(target=read_stderr, args=(proc.stderr, observation, stderr_tail, proc.pid),
+                                  daemon=True)
+        timer.start()
+        reader.start()
+        try:
+            for line in proc.stdout:
+                line = line.strip()
+                if not line:
+                    continue
+                parse_started = time.perf_counter()
                 try:
-                    results.append(json.loads(line))
+                    finding = json.loads(line)
                 except json.JSONDecodeError:
-                    logging.error(f"Failed to parse Nuclei output line: {line}")
+                    logging.error(f"Failed to parse Nuclei output line: {line[:200]}")
+                    continue
+                finally:
+                    parse_seconds += time.perf_counter() - parse_started
+                if matcher:
+                    finding["target"] = matcher.match(finding)
+                findings_total.inc(severity=finding.get("info", {}).get("severity", "unknown"))
+                results.append(finding, size=len(line))
+                if on_finding:
+                    on_finding(finding)
+            proc.wait()
+        finally:
+            timer.cancel()
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            reader.join()
+            phases.add("nuclei", time.perf_counter() - started - parse_seconds)
+            phases.add("parse", parse_seconds)
+
+        if timed_out.is_set():
+            # Nuclei đã bị dừng, các kết quả in ra trước đó vẫn được giữ
+            logging.error(f"Nuclei timed out after {timeout:.0f} seconds")
+            scan_timeouts_total.inc()
+            errors.append("Nuclei scan timed out")
+            if observation is not None:
+                observation.add_line(errors[-1])
+        elif proc.returncode:
+            error = subprocess.CalledProcessError(proc.returncode, cmd)
+            logging.error(f"Nuclei error: {error}, stderr: {list(stderr_tail)}")
+            errors.extend([str(error), "\n".join(stderr_tail)])
         if not results:
             logging.info(f"No vulnerabilities found for target: {target}")
-        return {"results": results, "errors": []}
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Nuclei error: {e}, stderr: {e.stderr}")
-        return {"results": [], "errors": [str(e), e.stderr]}
-
-def process_request(request):
-    """Process MCP scan request."""
-    target = request.get("target")
+        return {"results": results, "errors": errors, "return_code": proc.returncode}
+    finally:
+        for path in (targets_file, templates_file):
+            if path:
+                os.unlink(path)
+
+def classify_stderr_line(line):
+    """Map a Nuclei stderr line to an error message, or None if it is not an error."""
+    if "Skipped" in line and "unresponsive" in line:
+        return f"Target skipped: {line}"
+    if "Could not find template" in line:
+        return f"Template error: {line}"
+    return None
+
+def read_stderr(stream, observation, tail, key=None):
+    """Read Nuclei's stderr as it arrives, keeping its last lines in tail for the failure message.
+
+    JSON stats and warnings go to the rate observation; classified errors are logged.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                stats = json.loads(line)
+            except json.JSONDecodeError:
+                stats = None
+            if isinstance(stats, dict):
+                if observation is not None:
+                    observation.add_stats(stats, key=key)
+                continue
+        tail.append(line)
+        error = classify_stderr_line(line)
+        if error:
+            logging.warning(error)
+            if error.startswith("Template error"):
+                templates_not_found_total.inc()
+        if observation is not None:
+            observation.add_line(line)
+
+def run_incremental(target, templates, rate_limit=50, targets=None, stale_after=None, nuclei_options=None):
+    """Rescan only the templates each target has not run before, that changed, or that ran too long ago.
+
+    Targets due for the same templates share one run_nuclei call. What was run is recorded
+    in scan_state when Nuclei succeeds, and the stored findings of the skipped templates
+    are added back with "carried_over" set. Without templates the scan is a plain full scan.
+    """
+    targets = targets or [target]
+    if not templates:
+        # Không có template: quét toàn bộ như plan_checkpoint, vì liệt kê từng template của kho
+        # sẽ chạy cả các template workflow, code, headless và DAST mà Nuclei mặc định bỏ qua
+        logging.info("Incremental scan without templates runs as a full scan")
+        return run_nuclei(target, templates, rate_limit, targets, **(nuclei_options or {}))
+    entries = template_index.find(under=templates)
+    by_path = {entry["path"]: entry for entry in entries}
+    groups = {}
+    for name in targets:
+        due = scan_state.plan(name, entries, stale_after)
+        groups.setdefault(tuple(entry["path"] for entry in due), []).append(name)
+    rerun_count = sum(len(paths) * len(names) for paths, names in groups.items())
+    logging.info(f"Incremental scan: {rerun_count} of {len(entries) * len(targets)} target/template pairs due")
+
+    results = FindingSpool(FINDINGS_SPILL_BYTES)
+    errors = []
+    rerun = {}
+    for paths, names in groups.items():
+        if not paths:
+            continue
+        run_entries = [by_path[path] for path in paths]
+        run_at = time.time()
+        scan_result = run_nuclei(names[0], list(paths), rate_limit, names, **(nuclei_options or {}))
+        for finding in scan_result["results"]:
+            if len(targets) > 1:
+                finding.setdefault("target", names[0])
+            results.append(finding)
+        errors.extend(scan_result["errors"])
+        template_ids = {entry["id"] for entry in run_entries}
+        for name in names:
+            rerun[name] = template_ids
+            if not scan_result["errors"]:
+                found = (f for f in scan_result["results"] if f.get("target", names[0]) == name)
+                scan_state.record(name, run_entries, found, run_at)
+        scan_result["results"].close()
+
+    carried_over = 0
+    all_ids = {entry["id"] for entry in entries}
+    for name in targets:
+        for finding in scan_state.carried_over(name, all_ids - rerun.get(name, set())):
+            if len(targets) > 1:
+                finding["target"] = name
+            results.append(finding)
+            carried_over += 1
+    return {
+        "results": results,
+        "errors": errors,
+        "templates_rerun": rerun_count,
+        "templates_skipped": len(entries) * len(targets) - rerun_count,
+        "carried_over": carried_over
+    }
+
+def narrow_templates(directories, severity=None, tags=None, exclude_tags=None, technologies=None):
+    """Resolve template directories to the individual templates passing the severity, tag and technology filters.
+
+    Returns (templates, pruned). Without directories the whole template repository is filtered.
+    """
+    under = [d for d in directories if template_index.exists(d)]
+    candidates = template_index.find(under=under)
+    selected = template_index.find(tags=tags, min_severity=severity, under=under,
+                                   exclude_tags=exclude_tags, technologies=technologies)
+    return [entry["path"] for entry in selected], len(candidates) - len(selected)
+
+def run_fingerprint(target, targets, request, nuclei_options=None):
+    """Run the two-phase pipeline: technology detection, then only the templates for what was found.
+
+    Detected technologies are mapped through fingerprint.TECHNOLOGY_TEMPLATES to template
+    tags, which select templates in TARGETED_DIRECTORIES (FALLBACK_DIRECTORIES when
+    nothing was recognised). Both phases go through run_nuclei.
+    """
+    rate_limit = request.get("rate_limit", 50)
+    nuclei_options = nuclei_options or {}
+    first = run_nuclei(target, FINGERPRINT_TEMPLATES, rate_limit, targets, **nuclei_options)
+    technologies = detect_technologies(first["results"])
+    tags = technology_tags(set(technologies) | set(request.get("technologies") or []))
+    directories = TARGETED_DIRECTORIES if tags else FALLBACK_DIRECTORIES
+    templates, templates_pruned = narrow_templates(directories, request.get("severity"), request.get("tags"),
+                                                   request.get("exclude_tags"), tags or None)
+    logging.info(f"Fingerprint found {technologies or 'no technologies'}, "
+                 f"selected {len(templates)} templates under {directories}")
+    response = {
+        "type": "scan_response",
+        "results": first["results"],
+        "errors": first["errors"],
+        "templates_used": list(FINGERPRINT_TEMPLATES),
+        "templates_pruned": templates_pruned,
+        "technologies": technologies
+    }
+    if templates:
+        if request.get("incremental"):
+            second = run_incremental(target, templates, rate_limit, targets, request.get("stale_after"), nuclei_options)
+            response.update({k: v for k, v in second.items() if k not in ("results", "errors")})
+        else:
+            second = run_nuclei(target, templates, rate_limit, targets, **nuclei_options)
+        response["results"].extend(second["results"])
+        second["results"].close()
+        response["errors"] = first["errors"] + second["errors"]
+        response["templates_used"] = FINGERPRINT_TEMPLATES + directories
+        response["templates_selected"] = len(templates)
+    response["status"] = "success" if not response["errors"] else "error"
+    return response
+
+def plan_checkpoint(checkpoint_id, request, templates):
+    """Split a scan's templates into chunks and start a checkpoint for them.
+
+    Returns the new checkpoint, or None when one chunk holds every template and the
+    scan runs as a single Nuclei process. Without templates the scan is not checkpointed:
+    listing the whole repository explicitly would also run the workflow, code, headless
+    and DAST templates that Nuclei's default selection leaves out.
+    """
+    if not templates:
+        return None
+    paths = [entry["path"] for entry in template_index.find(under=templates)]
+    chunks = chunk_templates(paths, CHECKPOINT_CHUNK_SIZE)
+    if len(chunks) <= 1:
+        return None
+    checkpoints.create(checkpoint_id, request, chunks)
+    return checkpoints.get(checkpoint_id)
+
+def run_checkpointed(target, targets, checkpoint, rate_limit=50, nuclei_options=None):
+    """Run a checkpoint's unfinished template chunks one Nuclei run at a time, recording each finished chunk.
+
+    Findings of chunks finished by an earlier run are added back marked as carried over.
+    All chunks share one NUCLEI_TIMEOUT budget; when it runs out, or a chunk fails, the
+    result is marked resumable and a request with resume=<checkpoint id> runs the chunks
+    left. The checkpoint is deleted once every chunk is done.
+    """
+    checkpoint_id = checkpoint["checkpoint_id"]
+    chunks = checkpoint["chunks"]
+    done = set(checkpoint["done"])
+    results = FindingSpool(FINDINGS_SPILL_BYTES)
+    for index in sorted(done):
+        results.extend(replayed(checkpoints.findings(checkpoint_id, index), checkpoint["done"][index]))
+    carried_over = len(results)
+    errors = []
+    deadline = time.monotonic() + NUCLEI_TIMEOUT
+    for index, chunk in enumerate(chunks):
+        if index in done:
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        scan_result = run_nuclei(target, chunk, rate_limit, targets, timeout=remaining, **(nuclei_options or {}))
+        results.extend(scan_result["results"])
+        errors.extend(scan_result["errors"])
+        if scan_result["return_code"] == 0:
+            done.add(index)
+            checkpoints.complete_chunk(checkpoint_id, index, scan_result["results"])
+        scan_result["results"].close()
+
+    left = len(chunks) - len(done)
+    if left:
+        logging.warning(f"Checkpoint {checkpoint_id}: {left} of {len(chunks)} template chunks left to resume")
+        if not errors:
+            errors.append(f"Scan stopped with {left} of {len(chunks)} template chunks left")
+    else:
+        checkpoints.delete(checkpoint_id)
+    return {
+        "results": results,
+        "errors": errors,
+        "carried_over": carried_over,
+        "resumable": bool(left),
+        "checkpoint": {"id": checkpoint_id, "chunks": len(chunks), "chunks_done": len(done), "targets": targets}
+    }
+
+def process_request(request, timer=None, on_finding=None):
+    """Process MCP scan request, adding the time of each phase to timer (a metrics.PhaseTimer).
+
+    on_finding is called with each finding as Nuclei prints it.
+    """
+    timer = timer or PhaseTimer(scan_phase_seconds)
+    checkpoint = checkpoints.get(request.get("resume"))
+    if request.get("resume") and not checkpoint:
+        return {"type": "scan_response", "status": "error", "errors": [f"Checkpoint not found: {request['resume']}"]}
+    if checkpoint:
+        # Tiếp tục lần quét đã dừng với đúng yêu cầu ban đầu
+        request = dict(checkpoint["request"], resume=checkpoint["checkpoint_id"])
+    scan_request = {k: v for k, v in request.items() if k != "request_id"}
+    targets = parse_targets(request.get("target"), request.get("targets"), request.get("targets_file"))
     templates = request.get("templates", None)
     rate_limit = request.get("rate_limit", 50)
     use_deepseek = request.get("use_deepseek", True)
     vulnerability_type = request.get("vulnerability_type", "http")
 
-    if not target:
+    if not targets:
         return {"type": "scan_response", "status": "error", "errors": ["Missing target"]}
+    # A batch shares one template set; the first target stands in for the DeepSeek prompt
+    target = targets[0]
+
+    # Tốc độ quét thích ứng: bắt đầu từ tốc độ đã học của host, rate_limit chỉ là giá trị khởi đầu
+    tuning = {}
+    observation = None
+    if request.get("adaptive", True):
+        tuning = rate_controller.settings(targets, rate_limit or 50, request.get("max_rate"))
+        rate_limit = tuning["rate_limit"]
+        request = dict(request, rate_limit=rate_limit)
+        observation = ScanObservation()
+    nuclei_options = {
+        "concurrency": request.get("concurrency") or tuning.get("concurrency"),
+        "bulk_size": request.get("bulk_size") or tuning.get("bulk_size"),
+        "observation": observation,
+        "phases": timer,
+        "on_finding": on_finding
+    }
+
+    if checkpoint:
+        # Checkpoint đã giữ các phần template, không cần chọn lại template
+        try:
+            scan_result = run_checkpointed(target, targets, checkpoint, rate_limit, nuclei_options)
+        except Exception as e:
+            logging.error(f"Error during scan: {e}")
+            return {"type": "scan_response", "status": "error", "errors": [str(e)]}
+        response = {
+            "type": "scan_response",
+            "status": "success" if not scan_result["errors"] else "error",
+            **scan_result,
+            "templates_used": checkpoint["request"].get("templates") or ["all Nuclei templates"]
+        }
+        return record_rate(response, targets, rate_limit, observation)
+
+    if request.get("fingerprint"):
+        # Quét hai pha: nhận diện công nghệ trước, không cần gọi DeepSeek
+        try:
+            response = run_fingerprint(target, targets, request, nuclei_options)
+        except Exception as e:
+            logging.error(f"Error during scan: {e}")
+            return {"type": "scan_response", "status": "error", "errors": [str(e)]}
+        return record_rate(response, targets, rate_limit, observation)
 
     valid_templates = []
     if templates:
@@ -148,7 +614,8 @@ def process_request(request):
             "Ensure the response is a valid JSON array containing only directory paths ending with '/'. "
             "Do not include explanations or additional text outside the JSON array."
         )
-        template_list = call_deepseek(prompt)
+        with timer.phase("template_selection"):
+            template_list = suggest_with_cache(target, vulnerability_type, prompt)
         if template_list:
             valid_templates.extend(template_list)
             logging.info(f"DeepSeek suggested templates for {vulnerability_type}: {template_list}")
@@ -156,64 +623,181 @@ def process_request(request):
             logging.warning("DeepSeek failed to suggest templates, using all available Nuclei templates")
             # Không thêm DEFAULT_TEMPLATES, để quét toàn bộ kho
 
+    # Thu hẹp thư mục template thành danh sách template cụ thể theo severity, tags và công nghệ
+    directories = valid_templates
+    templates_pruned = 0
+    filters = {k: request.get(k) for k in ("severity", "tags", "exclude_tags", "technologies")}
+    if any(filters.values()):
+        with timer.phase("template_filtering"):
+            valid_templates, templates_pruned = narrow_templates(directories, **filters)
+        logging.info(f"Template filters {filters} kept {len(valid_templates)} templates, pruned {templates_pruned}")
+        if not valid_templates:
+            return {"type": "scan_response", "status": "error", "templates_pruned": templates_pruned,
+                    "errors": ["No templates match the requested filters"]}
+
     # Nếu không có template hợp lệ, quét toàn bộ kho template
     try:
-        scan_result = run_nuclei(target, valid_templates, rate_limit)
+        checkpoint = None
+        if request.get("checkpoint") and not request.get("incremental"):
+            # Các phần chạy lần lượt, nên chỉ chia khi lần quét yêu cầu có thể tiếp tục
+            checkpoint = plan_checkpoint(str(uuid.uuid4()), dict(scan_request, templates=directories), valid_templates)
+        if request.get("incremental"):
+            scan_result = run_incremental(target, valid_templates, rate_limit, targets, request.get("stale_after"),
+                                          nuclei_options)
+        elif checkpoint:
+            scan_result = run_checkpointed(target, targets, checkpoint, rate_limit, nuclei_options)
+        else:
+            scan_result = run_nuclei(target, valid_templates, rate_limit, targets, **nuclei_options)
         response = {
             "type": "scan_response",
             "status": "success" if not scan_result.get("errors") else "error",
             "results": scan_result.get("results", []),
             "errors": scan_result.get("errors", []),
-            "templates_used": valid_templates if valid_templates else ["all Nuclei templates"]
+            "templates_used": directories if directories else ["all Nuclei templates"],
+            "templates_pruned": templates_pruned
         }
-        return response
+        if valid_templates is not directories:
+            response["templates_selected"] = len(valid_templates)
+        for field in ("templates_rerun", "templates_skipped", "carried_over", "resumable", "checkpoint"):
+            if field in scan_result:
+                response[field] = scan_result[field]
+        return record_rate(response, targets, rate_limit, observation)
     except Exception as e:
         logging.error(f"Error during scan: {e}")
         return {"type": "scan_response", "status": "error", "errors": [str(e)]}
 
+def record_rate(response, targets, rate_limit, observation):
+    """Add the rate used to a scan response and, for adaptive scans, update the hosts' learned rates."""
+    response["rate_limit"] = rate_limit
+    if observation is not None:
+        response["rate_control"] = rate_controller.record(targets, rate_limit, observation)
+    return response
+
+def handle_request(request, on_finding=None):
+    """Dispatch one decoded stdio request to its handler."""
+    if request.get("type") == "scan_request":
+        # Thời gian từng pha của lần quét được trả về trong "timings" và ghi vào /metrics
+        timer = PhaseTimer(scan_phase_seconds)
+        with scans_in_flight.track():
+            with timer.phase("template_index"):
+                template_index.refresh_if_stale()
+            response = process_request(request, timer, on_finding)
+        response["timings"] = timer.breakdown()
+        scans_total.inc(status=response.get("status", "error"))
+        return response
+    elif request.get("type") == "suggest_templates":
+        target = request.get("target")
+        vulnerability_type = request.get("vulnerability_type", "http")
+        if not target:
+            return {"type": "suggest_response", "status": "error", "errors": ["Missing target"]}
+        prompt = (
+            f"For the target {target}, provide a JSON array of Nuclei template directories "
+            f"suitable for scanning {vulnerability_type} vulnerabilities. "
+            "Examples include [\"http/technologies/\", \"http/exposures/\", \"http/vulnerabilities/\"]. "
+            "Ensure the response is a valid JSON array containing only directory paths ending with '/'. "
+            "Do not include explanations or additional text outside the JSON array."
+        )
+        template_list = suggest_with_cache(target, vulnerability_type, prompt)
+        if template_list:
+            return {
+                "type": "suggest_response",
+                "status": "success",
+                "templates": template_list
+            }
+        else:
+            return {
+                "type": "suggest_response",
+                "status": "success",
+                "templates": DEFAULT_TEMPLATES
+            }
+    elif request.get("type") == "templates":
+        under = request.get("under")
+        matches = template_index.find(tags=request.get("tags"), min_severity=request.get("severity"),
+                                      protocol=request.get("protocol"), under=under)
+        return {
+            "type": "templates_response",
+            "status": "success",
+            "count": len(matches),
+            "stats": template_index.stats(under=under),
+            "templates": [{k: v for k, v in entry.items() if k != "mtime"} for entry in matches[:request.get("limit", 100)]]
+        }
+    elif request.get("type") == "stats":
+        return {"type": "stats_response", "status": "success", "deepseek": deepseek_connection_stats(),
+                "rates": rate_controller.list_rates()}
+    elif request.get("type") == "metrics":
+        return {"type": "metrics_response", "status": "success", "metrics": metrics.snapshot()}
+    else:
+        return {"type": "response", "status": "error", "errors": ["Invalid request type"]}
+
+def serve_request(line):
+    """Handle one request line and write its response, tagged with the caller's request_id."""
+    request_id = None
+    try:
+        request = json.loads(line.strip())
+        # Echo the caller's correlation ID so pooled clients can match responses
+        request_id = request.get("request_id")
+        on_finding = None
+        if request.get("stream") and request_id is not None:
+            # Gửi từng finding ngay khi Nuclei in ra, trước phản hồi cuối cùng
+            def on_finding(finding):
+                write_event(request_id, "finding", finding)
+        response = handle_request(request, on_finding)
+    except json.JSONDecodeError:
+        response = {"type": "response", "status": "error", "errors": ["Invalid JSON"]}
+    except Exception as e:
+        logging.error(f"Error processing request: {e}")
+        response = {"type": "response", "status": "error", "errors": [str(e)]}
+    if request_id is not None:
+        response["request_id"] = request_id
+    try:
+        with output_lock:
+            write_response(response)
+    finally:
+        if isinstance(response.get("results"), FindingSpool):
+            response["results"].close()
+
+def write_event(request_id, event, data):
+    """Print one intermediate event line of a streamed request; the final response follows it."""
+    line = json.dumps({"type": "scan_event", "request_id": request_id, "event": event, "data": data},
+                      ensure_ascii=False)
+    with output_lock:
+        print(line, flush=True)
+
+def write_response(response):
+    """Print a response as one JSON line, writing spooled results one finding at a time."""
+    results = response.get("results")
+    if not isinstance(results, FindingSpool):
+        print(json.dumps(response, ensure_ascii=False), flush=True)
+        return
+    head = json.dumps({k: v for k, v in response.items() if k != "results"}, ensure_ascii=False)
+    sys.stdout.write(head[:-1] + ', "results": [')
+    for index, finding in enumerate(results):
+        sys.stdout.write((", " if index else "") + json.dumps(finding, ensure_ascii=False))
+    sys.stdout.write("]}\n")
+    sys.stdout.flush()
+
 def main():
-    logging.info("AI Agent started")
-    for line in sys.stdin:
+    """Read requests continuously and answer each one as soon as it completes.
+
+    Responses may come back out of order; run with AGENT_MAX_WORKERS=1 to keep request order.
+    """
+    logging.info(f"AI Agent started ({AGENT_MAX_WORKERS} workers)")
+    template_index.refresh()
+    # Stop reading stdin while the executor is saturated so the pipe applies back-pressure
+    slots = threading.BoundedSemaphore(AGENT_MAX_WORKERS * 2)
+
+    def run(line):
         try:
-            request = json.loads(line.strip())
-            if request.get("type") == "scan_request":
-                response = process_request(request)
-                print(json.dumps(response, ensure_ascii=False), flush=True)
-            elif request.get("type") == "suggest_templates":
-                target = request.get("target")
-                vulnerability_type = request.get("vulnerability_type", "http")
-                if not target:
-                    response = {"type": "suggest_response", "status": "error", "errors": ["Missing target"]}
-                else:
-                    prompt = (
-                        f"For the target {target}, provide a JSON array of Nuclei template directories "
-                        f"suitable for scanning {vulnerability_type} vulnerabilities. "
-                        "Examples include [\"http/technologies/\", \"http/exposures/\", \"http/vulnerabilities/\"]. "
-                        "Ensure the response is a valid JSON array containing only directory paths ending with '/'. "
-                        "Do not include explanations or additional text outside the JSON array."
-                    )
-                    template_list = call_deepseek(prompt)
-                    if template_list:
-                        response = {
-                            "type": "suggest_response",
-                            "status": "success",
-                            "templates": template_list
-                        }
-                    else:
-                        response = {
-                            "type": "suggest_response",
-                            "status": "success",
-                            "templates": DEFAULT_TEMPLATES
-                        }
-                    print(json.dumps(response, ensure_ascii=False), flush=True)
-            else:
-                response = {"type": "response", "status": "error", "errors": ["Invalid request type"]}
-                print(json.dumps(response, ensure_ascii=False), flush=True)
-        except json.JSONDecodeError:
-            print(json.dumps({"type": "response", "status": "error", "errors": ["Invalid JSON"]}, ensure_ascii=False), flush=True)
-        except Exception as e:
-            logging.error(f"Error processing request: {e}")
-            print(json.dumps({"type": "response", "status": "error", "errors": [str(e)]}, ensure_ascii=False), flush=True)
+            serve_request(line)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=AGENT_MAX_WORKERS) as executor:
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            slots.acquire()
+            executor.submit(run, line)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError
+
+from batch_targets import parse_targets
+
+# The agent's Nuclei timeout, which bounds each Nuclei run of a scan
+SCAN_TIMEOUT = int(os.getenv("SCAN_TIMEOUT", "900"))
+# Seconds added to a request's Nuclei runs for DeepSeek, template selection and writing the response
+REQUEST_SLACK = 300
+# Seconds every request waits for its response, overriding request_timeout() when set
+REQUEST_TIMEOUT = int(os.getenv("AGENT_REQUEST_TIMEOUT", "0")) or None
+
+def request_timeout(request):
+    """Return how long to wait for a request's response: SCAN_TIMEOUT per Nuclei run it may make, plus REQUEST_SLACK.
+
+    Fingerprint scans run Nuclei once to detect technologies and once more for what was
+    found; incremental scans run it once per group of targets due for the same templates,
+    so at most once per target. Checkpointed scans share one SCAN_TIMEOUT across their chunks.
+    """
+    if REQUEST_TIMEOUT:
+        return REQUEST_TIMEOUT
+    runs = 1
+    if request.get("type") == "scan_request" and not request.get("resume"):
+        if request.get("incremental"):
+            runs = max(1, len(parse_targets(request.get("target"), request.get("targets"),
+                                            request.get("targets_file"))))
+        if request.get("fingerprint"):
+            runs += 1
+    return runs * SCAN_TIMEOUT + REQUEST_SLACK
+
+class AgentWorker:
+    """One long-lived agent process speaking the stdin/stdout JSON-lines protocol."""
+
+    def __init__(self, command, on_exit, cwd=None):
+        self.command = command
+        self.on_exit = on_exit
+        self.pending = {}
+        self.listeners = {}
+        self.lock = threading.Lock()
+        # Writes to stdin hold their own lock, so the reader thread can keep draining stdout
+        # while a request waits for room in the pipe
+        self.write_lock = threading.Lock()
+        self.closing = False
+        self.dead = False
+        self.started = time.monotonic()
+        self.proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            cwd=cwd
+        )
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+
+    @property
+    def load(self):
+        return len(self.pending)
+
+    def submit(self, request, on_event=None):
+        """Send a request tagged with its request_id and return a Future for the response.
+
+        on_event(event, data) is called, on the reader thread, for each scan_event line the
+        agent prints for this request before its response.
+        """
+        future = Future()
+        with self.lock:
+            if self.dead:
+                future.set_result({"type": "response", "status": "error", "errors": ["Agent worker is restarting"]})
+                return future
+            self.pending[request["request_id"]] = future
+            if on_event:
+                self.listeners[request["request_id"]] = on_event
+        try:
+            with self.write_lock:
+                self.proc.stdin.write(json.dumps(request) + "\n")
+                self.proc.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            with self.lock:
+                # The reader may have failed the request already if the worker exited meanwhile
+                failed = self.pending.pop(request["request_id"], None)
+                self.listeners.pop(request["request_id"], None)
+            if failed:
+                future.set_result({"type": "response", "status": "error", "errors": [f"Agent worker unavailable: {e}"]})
+        return future
+
+    def kill(self):
+        """Kill the process; its pending requests fail and the pool starts a replacement."""
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+
+    def _read_loop(self):
+        """Match each response line to its pending request by request_id, passing events to its listener."""
+        for line in self.proc.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                response = json.loads(line)
+            except json.JSONDecodeError:
+                logging.error(f"Invalid response from agent: {line}")
+                continue
+            if response.get("type") == "scan_event":
+                with self.lock:
+                    listener = self.listeners.get(response.get("request_id"))
+                if listener:
+                    try:
+                        listener(response.get("event"), response.get("data"))
+                    except Exception as e:
+                        logging.error(f"Agent event listener failed: {e}")
+                continue
+            with self.lock:
+                request_id = response.get("request_id")
+                if request_id is None and len(self.pending) == 1:
+                    # Responses to unparseable requests carry no ID
+                    request_id = next(iter(self.pending))
+                future = self.pending.pop(request_id, None)
+                self.listeners.pop(request_id, None)
+            if future:
+                future.set_result(response)
+            else:
+                logging.warning(f"Dropping agent response for unknown request: {request_id}")
+
+        self.proc.wait()
+        with self.lock:
+            self.dead = True
+            pending, self.pending = self.pending, {}
+            self.listeners = {}
+        for future in pending.values():
+            future.set_result({"type": "response", "status": "error",
+                               "errors": [f"Agent worker exited with status {self.proc.returncode}"]})
+        if not self.closing:
+            logging.error(f"Agent worker {self.proc.pid} exited with status {self.proc.returncode}")
+            self.on_exit(self)
+
+    def close(self):
+        self.closing = True
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+class AgentPool:
+    """Pool of long-lived agent processes; requests go to the least-loaded worker and crashed workers are restarted.
+
+    A crashed worker is restarted after restart_delay seconds, doubling up to max_restart_delay
+    while its replacements keep exiting within stable_after seconds of starting. After
+    max_restarts such exits in a row the slot is given up and requests that find no live
+    worker get the error.
+    """
+
+    def __init__(self, command, size=2, cwd=None, max_restarts=5, restart_delay=1, max_restart_delay=60,
+                 stable_after=60):
+        self.command = command
+        self.cwd = cwd
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_after = stable_after
+        self.lock = threading.Lock()
+        self.closed = False
+        self.closing = threading.Event()
+        self.error = None
+        self.failures = [0] * size
+        self.workers = [self._spawn() for _ in range(size)]
+
+    def _spawn(self):
+        worker = AgentWorker(self.command, self._restart, cwd=self.cwd)
+        logging.info(f"Started agent worker {worker.proc.pid}: {' '.join(self.command)}")
+        return worker
+
+    def _restart(self, dead):
+        """Replace a crashed worker, backing off while its replacements keep crashing; runs on its reader thread."""
+        with self.lock:
+            if self.closed or dead not in self.workers:
+                return
+            slot = self.workers.index(dead)
+            if time.monotonic() - dead.started >= self.stable_after:
+                self.failures[slot] = 0
+        while True:
+            with self.lock:
+                self.failures[slot] += 1
+                failures = self.failures[slot]
+                if failures > self.max_restarts:
+                    self.error = (f"Agent worker exited with status {dead.proc.returncode} {failures} times in a row, "
+                                  f"not restarting it")
+                    logging.error(self.error)
+                    return
+            delay = min(self.restart_delay * 2 ** (failures - 1), self.max_restart_delay)
+            logging.warning(f"Restarting agent worker in {delay} seconds (attempt {failures} of {self.max_restarts})")
+            if self.closing.wait(delay):
+                return
+            with self.lock:
+                if self.closed or self.workers[slot] is not dead:
+                    return
+                try:
+                    self.workers[slot] = self._spawn()
+                    return
+                except OSError as e:
+                    logging.error(f"Could not start agent worker: {e}")
+
+    def request(self, request, timeout=None, on_event=None):
+        """Send one request and wait for its response; with on_event, the agent streams events before it.
+
+        A request not answered within timeout seconds (by default request_timeout(request))
+        has outlived the agent's own Nuclei timeouts, so its worker is killed to stop the
+        scan; other requests running on that worker fail with it.
+        """
+        timeout = timeout or request_timeout(request)
+        request = dict(request, request_id=request.get("request_id") or str(uuid.uuid4()))
+        if on_event:
+            request["stream"] = True
+        with self.lock:
+            live = [w for w in self.workers if not w.dead]
+            if not live:
+                return {"type": "response", "status": "error", "errors": [self.error or "Agent workers are restarting"]}
+            worker = min(live, key=lambda w: w.load)
+        try:
+            return worker.submit(request, on_event).result(timeout)
+        except TimeoutError:
+            logging.error(f"Agent worker {worker.proc.pid} did not answer {request.get('type')} within {timeout} "
+                          f"seconds, restarting it")
+            worker.kill()
+            return {"type": "response", "status": "error", "errors": [f"Agent did not answer within {timeout} seconds"]}
+
+    def broadcast(self, request, timeout=None):
+        """Send a request to every worker and return the responses that arrived within timeout seconds."""
+        with self.lock:
+            workers = [w for w in self.workers if not w.dead]
+        futures = [worker.submit(dict(request, request_id=str(uuid.uuid4()))) for worker in workers]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        responses = []
+        for worker, future in zip(workers, futures):
+            try:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                responses.append(future.result(remaining))
+            except TimeoutError:
+                logging.warning(f"Agent worker {worker.proc.pid} did not answer {request.get('type')} in time")
+        return responses
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            workers = list(self.workers)
+        self.closing.set()
+        for worker in workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,136 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+class CheckpointStore:
+    """Progress of scans that run their templates in chunks, so an interrupted scan can resume, backed by SQLite.
+
+    A checkpoint keeps the scan request, its template chunks and, for every chunk Nuclei
+    finished, the findings that chunk reported (one row each, so a chunk is stored and
+    replayed without holding all its findings). Resuming runs only the chunks without a
+    result and replays the stored findings of the others. Checkpoints are deleted once
+    every chunk is done; unfinished ones expire ttl seconds after their last update.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(checkpoint_chunks)")]
+            if "findings" in columns:
+                # Findings used to be one JSON array per chunk; unfinished checkpoints are dropped
+                self.conn.execute("DROP TABLE checkpoint_chunks")
+                self.conn.execute("DELETE FROM checkpoints")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    checkpoint_id TEXT PRIMARY KEY,
+                    request TEXT NOT NULL,
+                    chunks TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoint_chunks (
+                    checkpoint_id TEXT NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    done_at REAL NOT NULL,
+                    PRIMARY KEY (checkpoint_id, chunk)
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoint_findings (
+                    checkpoint_id TEXT NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    finding TEXT NOT NULL
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_checkpoint_findings ON checkpoint_findings (checkpoint_id, chunk)")
+
+    def create(self, checkpoint_id, request, chunks):
+        """Start a checkpoint for a scan split into chunks (lists of template paths), dropping expired ones."""
+        now = time.time()
+        with self.lock, self.conn:
+            expired = [row[0] for row in self.conn.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE updated_at < ?", (now - self.ttl,))]
+            for old_id in expired + [checkpoint_id]:
+                self._delete(old_id)
+            self.conn.execute(
+                "INSERT INTO checkpoints (checkpoint_id, request, chunks, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (checkpoint_id, json.dumps(request), json.dumps(chunks), now, now)
+            )
+        logging.info(f"Checkpoint {checkpoint_id}: {sum(len(c) for c in chunks)} templates in {len(chunks)} chunks")
+
+    def get(self, checkpoint_id):
+        """Return {checkpoint_id, request, chunks, done} or None; done maps finished chunk indexes to their done_at."""
+        if not checkpoint_id:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT request, chunks, created_at FROM checkpoints WHERE checkpoint_id = ?", (checkpoint_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            chunks = self.conn.execute(
+                "SELECT chunk, done_at FROM checkpoint_chunks WHERE checkpoint_id = ? ORDER BY chunk", (checkpoint_id,)
+            ).fetchall()
+        return {
+            "checkpoint_id": checkpoint_id,
+            "request": json.loads(row[0]),
+            "chunks": json.loads(row[1]),
+            "created_at": row[2],
+            "done": dict(chunks)
+        }
+
+    def findings(self, checkpoint_id, chunk, page_size=500):
+        """Yield the stored findings of a finished chunk, reading them page by page."""
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, finding FROM checkpoint_findings WHERE checkpoint_id = ? AND chunk = ? AND rowid > ? "
+                    "ORDER BY rowid LIMIT ?", (checkpoint_id, chunk, last, page_size)
+                ).fetchall()
+            for last, finding in rows:
+                yield json.loads(finding)
+            if len(rows) < page_size:
+                return
+
+    def complete_chunk(self, checkpoint_id, chunk, findings):
+        """Record that a chunk finished, with the findings (any iterable) Nuclei reported for it."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM checkpoint_findings WHERE checkpoint_id = ? AND chunk = ?",
+                              (checkpoint_id, chunk))
+            self.conn.executemany(
+                "INSERT INTO checkpoint_findings (checkpoint_id, chunk, finding) VALUES (?, ?, ?)",
+                ((checkpoint_id, chunk, json.dumps(finding)) for finding in findings)
+            )
+            self.conn.execute("INSERT OR REPLACE INTO checkpoint_chunks (checkpoint_id, chunk, done_at) VALUES (?, ?, ?)",
+                              (checkpoint_id, chunk, now))
+            self.conn.execute("UPDATE checkpoints SET updated_at = ? WHERE checkpoint_id = ?", (now, checkpoint_id))
+
+    def delete(self, checkpoint_id):
+        """Forget a checkpoint, once its scan has run every chunk."""
+        with self.lock, self.conn:
+            self._delete(checkpoint_id)
+
+    def _delete(self, checkpoint_id):
+        for table in ("checkpoint_findings", "checkpoint_chunks", "checkpoints"):
+            self.conn.execute(f"DELETE FROM {table} WHERE checkpoint_id = ?", (checkpoint_id,))
+
+def chunk_templates(paths, size):
+    """Split template paths into consecutive chunks of at most size templates."""
+    size = max(1, size)
+    return [paths[start:start + size] for start in range(0, len(paths), size)]
+
+def replayed(findings, done_at):
+    """Mark a finished chunk's stored findings as carried over from the run that finished it."""
+    carried_over_from = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(done_at))
+    for finding in findings:
+        yield dict(finding, carried_over=True, carried_over_from=carried_over_from)
@@ -0,0 +1,72 @@
+import json
+import logging
+import tempfile
+
+class FindingSpool:
+    """Append-only list of Nuclei findings that moves to a temporary JSONL file past max_bytes.
+
+    Findings are kept in memory until their encoded size passes max_bytes; from then on
+    every finding, the earlier ones included, lives in an anonymous temporary file and
+    is decoded again while iterating, so memory holds one finding at a time however
+    large the scan output is. Iterate it once at a time; the file is removed on close.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.items = []
+        self.size = 0
+        self.count = 0
+        self.file = None
+
+    def append(self, finding, size=None):
+        """Add a finding; size is the length of its JSON line when the caller already has it."""
+        self.count += 1
+        if self.file is not None:
+            self.file.write(json.dumps(finding, ensure_ascii=False) + "\n")
+            return
+        self.items.append(finding)
+        self.size += size if size is not None else len(json.dumps(finding, ensure_ascii=False))
+        if self.size > self.max_bytes:
+            self._spill()
+
+    def extend(self, findings):
+        for finding in findings:
+            self.append(finding)
+
+    def _spill(self):
+        self.file = tempfile.TemporaryFile("w+", encoding="utf-8", prefix="nuclei-findings-")
+        for finding in self.items:
+            self.file.write(json.dumps(finding, ensure_ascii=False) + "\n")
+        logging.info(f"Spilled {self.count} findings ({self.size} bytes) to disk")
+        self.items = []
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __iter__(self):
+        if self.file is None:
+            yield from self.items
+            return
+        self.file.flush()
+        self.file.seek(0)
+        try:
+            for line in self.file:
+                yield json.loads(line)
+        finally:
+            self.file.seek(0, 2)
+
+    def close(self):
+        """Drop the findings and delete the spill file, if any; the spool is empty afterwards."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.items = []
+        self.size = 0
+        self.count = 0
@@ -0,0 +1,77 @@
+import re
+
+# Phase one of the fingerprint pipeline: technology detection only
+FINGERPRINT_TEMPLATES = ["http/technologies/"]
+
+# Phase two searches these directories for templates tagged with a detected technology
+TARGETED_DIRECTORIES = ["http/cves/", "http/exposures/", "http/misconfiguration/", "http/vulnerabilities/"]
+
+# Generic checks run when no technology was recognised
+FALLBACK_DIRECTORIES = ["http/exposures/", "http/misconfiguration/"]
+
+# Detection templates reporting many technologies, one per matcher-name
+MULTI_TECHNOLOGY_TEMPLATES = {"tech-detect", "waf-detect", "favicon-detect", "fingerprinthub-web-fingerprints"}
+
+DETECT_SUFFIX = re.compile(r"-(detect|detection|version|fingerprint|panel|login|installer)$")
+
+# Detected technology -> template tags. Technologies missing here are looked up by their own name.
+TECHNOLOGY_TEMPLATES = {
+    "wordpress": ["wordpress", "wp", "wp-plugin", "wp-theme"],
+    "joomla": ["joomla"],
+    "drupal": ["drupal"],
+    "magento": ["magento"],
+    "apache": ["apache", "httpd"],
+    "apache-httpd": ["apache", "httpd"],
+    "apache-tomcat": ["tomcat", "apache"],
+    "tomcat": ["tomcat", "apache"],
+    "nginx": ["nginx"],
+    "microsoft-iis": ["iis", "microsoft"],
+    "iis": ["iis", "microsoft"],
+    "asp.net": ["aspnet", "iis"],
+    "php": ["php"],
+    "laravel": ["laravel", "php"],
+    "symfony": ["symfony", "php"],
+    "phpmyadmin": ["phpmyadmin"],
+    "spring": ["spring", "springboot"],
+    "spring-boot": ["springboot", "spring"],
+    "django": ["django", "python"],
+    "flask": ["flask", "python"],
+    "express": ["express", "nodejs"],
+    "node.js": ["nodejs"],
+    "ruby-on-rails": ["rails", "ruby"],
+    "jenkins": ["jenkins"],
+    "gitlab": ["gitlab"],
+    "grafana": ["grafana"],
+    "kibana": ["kibana", "elasticsearch"],
+    "elasticsearch": ["elasticsearch"],
+    "jira": ["jira", "atlassian"],
+    "confluence": ["confluence", "atlassian"],
+    "jboss": ["jboss", "redhat"],
+    "weblogic": ["weblogic", "oracle"],
+    "outlook-web-app": ["exchange", "microsoft"],
+    "exchange": ["exchange", "microsoft"],
+    "citrix": ["citrix"],
+    "fortinet": ["fortinet", "fortios"],
+    "fortigate": ["fortinet", "fortios"],
+}
+
+def technology_name(finding):
+    """Return the technology a detection finding reports, e.g. "nginx" or "wordpress", or None."""
+    template_id = (finding.get("template-id") or "").lower()
+    if template_id in MULTI_TECHNOLOGY_TEMPLATES:
+        name = finding.get("matcher-name") or ""
+    else:
+        name = DETECT_SUFFIX.sub("", template_id)
+    name = re.sub(r"[\s_]+", "-", name.strip().lower())
+    return name or None
+
+def detect_technologies(findings):
+    """Collect the distinct technologies reported by the findings of a fingerprint run."""
+    return sorted({name for name in map(technology_name, findings) if name})
+
+def technology_tags(technologies):
+    """Map detected technologies through TECHNOLOGY_TEMPLATES to the template tags to scan."""
+    tags = set()
+    for technology in technologies or []:
+        tags.update(TECHNOLOGY_TEMPLATES.get(technology, [technology]))
+    return sorted(tags)
@@ -0,0 +1,200 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets in seconds, from a cache lookup up to a full Nuclei timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900)
+
+class Metric:
+    """A named metric with optional labels; values are kept per tuple of label values."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        if not self.labelnames and self.kind != "histogram":
+            # Unlabelled counters and gauges are exposed from the start, at zero
+            self.values[()] = 0
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def snapshot(self):
+        """Return the metric as plain JSON data, for render() or merging across processes."""
+        with self.lock:
+            samples = [[list(key), _copy(value)] for key, value in self.values.items()]
+        return {"kind": self.kind, "help": self.documentation, "labels": list(self.labelnames), "samples": samples}
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the enclosed block as in flight while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            sample = self.values.setdefault(key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0})
+            sample["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            sample["sum"] += value
+            sample["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the enclosed block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        return dict(super().snapshot(), buckets=list(self.buckets))
+
+class Registry:
+    """The metrics of one process, rendered in the Prometheus text exposition format.
+
+    Snapshots are plain JSON, so processes without their own HTTP endpoint (the local
+    stdio agents) can hand them to one that has, which merges them into its output.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def render(self, *snapshots):
+        """Render this registry plus other processes' snapshots; samples with the same labels are added up."""
+        merged = merge_snapshots(self.snapshot(), *snapshots)
+        lines = []
+        for name, metric in merged.items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            for label_values, value in metric["samples"]:
+                labels = list(zip(metric["labels"], label_values))
+                if metric["kind"] != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric["buckets"] + ["+Inf"], value["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value['sum'])}")
+                lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+class PhaseTimer:
+    """Wall-clock breakdown of one scan by phase, each phase also observed in a histogram."""
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+        if self.histogram is not None:
+            self.histogram.observe(seconds, phase=name)
+
+    def breakdown(self):
+        """Return {phase: seconds} plus the total time since the timer was created."""
+        timings = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+        timings["total"] = round(time.perf_counter() - self.started, 3)
+        return timings
+
+def merge_snapshots(*snapshots):
+    """Add up registry snapshots of several processes, metric by metric and label set by label set."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in (snapshot or {}).items():
+            target = merged.setdefault(name, dict(metric, samples=[]))
+            samples = {tuple(labels): value for labels, value in target["samples"]}
+            for labels, value in metric["samples"]:
+                labels = tuple(labels)
+                samples[labels] = _add(samples[labels], value) if labels in samples else _copy(value)
+            target["samples"] = [[list(labels), value] for labels, value in samples.items()]
+    return merged
+
+def _add(a, b):
+    if isinstance(a, dict):
+        return {"counts": [x + y for x, y in zip(a["counts"], b["counts"])],
+                "sum": a["sum"] + b["sum"], "count": a["count"] + b["count"]}
+    return a + b
+
+def _copy(value):
+    return dict(value, counts=list(value["counts"])) if isinstance(value, dict) else value
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
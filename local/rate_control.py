@@ -0,0 +1,188 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from suggestion_cache import normalize_host
+
+UNRESPONSIVE = re.compile(r"Skipped (\S+) from target list as found unresponsive")
+RATE_LIMITED = re.compile(r"\b429\b|too many requests", re.IGNORECASE)
+
+# A run is judged on its Nuclei stats: back off above BACKOFF_ERROR_RATIO errors per
+# request, raise below RAISE_ERROR_RATIO when Nuclei kept up with the rate limit
+BACKOFF_ERROR_RATIO = 0.2
+RAISE_ERROR_RATIO = 0.02
+RAISE_MIN_REQUESTS = 50
+RAISE_MIN_UTILISATION = 0.8
+RAISE_FACTOR = 1.5
+BACKOFF_FACTOR = 0.5
+
+def is_rate_limited(line):
+    """Return True if a Nuclei stderr line reports an HTTP 429 / Too Many Requests."""
+    return bool(RATE_LIMITED.search(line))
+
+class ScanObservation:
+    """What one scan's Nuclei runs reported: request and error counts, skipped hosts, 429s and timeouts."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.stats = {}
+        self.runs = {}
+        self.unresponsive = set()
+        self.rate_limited = 0
+        self.timed_out = False
+
+    def observe(self, kind, payload):
+        """Feed one (kind, payload) scan event, as produced by the remote agent's stream_nuclei."""
+        if kind == "progress":
+            key = (payload.get("phase"), payload.get("shard"))
+            if payload.get("status") == "started":
+                self.runs[key] = self.runs.get(key, 0) + 1
+            elif payload.get("status") == "rate_limited":
+                self.rate_limited += 1
+            elif "requests" in payload:
+                self.add_stats(payload, (*key, self.runs.get(key, 0)))
+        elif kind == "error" and isinstance(payload, str):
+            self.add_line(payload)
+
+    def add_stats(self, stats, key=None):
+        """Keep the latest cumulative Nuclei -sj stats record of one Nuclei process."""
+        self.stats[key] = stats
+
+    def add_line(self, line):
+        """Look for unresponsive hosts, 429s and timeouts in a Nuclei stderr or error line."""
+        match = UNRESPONSIVE.search(line)
+        if match:
+            self.unresponsive.add(normalize_host(match.group(1)))
+        elif is_rate_limited(line):
+            self.rate_limited += 1
+        elif "timed out" in line:
+            self.timed_out = True
+
+    def totals(self):
+        """Sum requests and errors over all Nuclei processes and return them with the achieved rate."""
+        requests = sum(_count(stats.get("requests")) for stats in self.stats.values())
+        errors = sum(_count(stats.get("errors")) for stats in self.stats.values())
+        elapsed = max(time.time() - self.started_at, 1)
+        return {"requests": requests, "errors": errors, "rps": requests / elapsed}
+
+class RateController:
+    """Per-host Nuclei rate limits learned from earlier scans, backed by SQLite.
+
+    A host's rate is raised by RAISE_FACTOR after a clean run that used most of its
+    rate limit, and halved after timeouts, 429s, unresponsive skips or many errors.
+    A scan starts every host at its learned rate, or at the requested rate_limit for
+    hosts never seen. Rates are learned once per scan, from all of its Nuclei runs
+    (both phases of a fingerprint scan), so they adapt from one scan to the next.
+    """
+
+    def __init__(self, path, min_rate=5, max_rate=500):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS host_rates (
+                    host TEXT PRIMARY KEY,
+                    rate REAL NOT NULL,
+                    scans INTEGER NOT NULL DEFAULT 0,
+                    last_outcome TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def learned(self, hosts):
+        """Return {host: learned rate} for the hosts that have one."""
+        hosts = list(hosts)
+        rates = {}
+        with self.lock:
+            for start in range(0, len(hosts), 500):
+                chunk = hosts[start:start + 500]
+                rates.update(self.conn.execute(
+                    f"SELECT host, rate FROM host_rates WHERE host IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        return rates
+
+    def settings(self, targets, rate_limit=50, max_rate=None):
+        """Choose Nuclei's -rl, -c and -bs for a scan of the targets.
+
+        Each host gets its learned rate (rate_limit if unknown). One Nuclei process
+        spreads its rate over all hosts, so a batch runs at the slowest host's rate
+        times the number of hosts, capped at max_rate (the scan's own cap, if lower).
+        When no host has a learned rate the scan keeps rate_limit, and concurrency and
+        bulk_size are None so Nuclei's own defaults apply.
+        """
+        hosts = sorted({normalize_host(target) for target in targets})
+        learned = self.learned(hosts)
+        if learned:
+            per_host = min(learned.get(host, rate_limit) for host in hosts)
+            rate = int(self._clamp(per_host * len(hosts)))
+        else:
+            rate = int(rate_limit)
+        if max_rate:
+            rate = max(1, min(rate, int(max_rate)))
+        return {
+            "rate_limit": rate,
+            "concurrency": max(5, min(rate // 5, 50)) if learned else None,
+            "bulk_size": max(1, min(len(hosts), 50)) if learned else None,
+            "learned": len(learned)
+        }
+
+    def record(self, targets, rate_limit, observation):
+        """Update the hosts' learned rates from a finished scan; return {host: outcome}.
+
+        Unresponsive skips are reported per host, but Nuclei's timeouts, 429s and error
+        counts are not, so those back off every host the scan covered.
+        """
+        hosts = sorted({normalize_host(target) for target in targets})
+        totals = observation.totals()
+        error_ratio = totals["errors"] / max(totals["requests"], 1)
+        per_host = rate_limit / len(hosts)
+        learned = self.learned(hosts)
+        now = time.time()
+        outcomes = {}
+        with self.lock, self.conn:
+            for host in hosts:
+                current = learned.get(host)
+                if (host in observation.unresponsive or observation.timed_out or observation.rate_limited
+                        or error_ratio > BACKOFF_ERROR_RATIO):
+                    outcome = "backoff"
+                    rate = min(current or per_host, per_host) * BACKOFF_FACTOR
+                elif (totals["requests"] >= RAISE_MIN_REQUESTS and error_ratio < RAISE_ERROR_RATIO
+                      and totals["rps"] >= RAISE_MIN_UTILISATION * rate_limit):
+                    outcome = "raise"
+                    rate = max(current or 0, per_host * RAISE_FACTOR)
+                else:
+                    outcome = "hold"
+                    rate = current or per_host
+                rate = self._clamp(rate)
+                self.conn.execute(
+                    "INSERT INTO host_rates (host, rate, scans, last_outcome, updated_at) VALUES (?, ?, 1, ?, ?) "
+                    "ON CONFLICT(host) DO UPDATE SET rate = excluded.rate, scans = scans + 1, "
+                    "last_outcome = excluded.last_outcome, updated_at = excluded.updated_at",
+                    (host, rate, outcome, now)
+                )
+                outcomes[host] = {"outcome": outcome, "rate": round(rate, 1)}
+        logging.info(f"Rate control at {rate_limit} req/s ({totals['requests']} requests, "
+                     f"{totals['errors']} errors, {totals['rps']:.1f} req/s): {outcomes}")
+        return outcomes
+
+    def list_rates(self, limit=100):
+        """Return the most recently updated host rates."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT host, rate, scans, last_outcome, updated_at FROM host_rates ORDER BY updated_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [dict(zip(("host", "rate", "scans", "last_outcome", "updated_at"), row)) for row in rows]
+
+    def _clamp(self, rate):
+        return max(self.min_rate, min(rate, self.max_rate))
+
+def _count(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
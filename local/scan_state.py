@@ -0,0 +1,99 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+class ScanState:
+    """Per-target record of the templates already run, for incremental rescans, backed by SQLite.
+
+    For each target it keeps the id, content hash and run time of every template that
+    was executed, and the findings each template produced. A rescan only needs the
+    templates that are new, whose hash changed, or that ran longer than stale_after
+    seconds ago; findings of the other templates are carried over from earlier runs.
+    """
+
+    def __init__(self, path, stale_after=7 * 24 * 3600):
+        self.stale_after = stale_after
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS template_runs (
+                    target TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    template_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    run_at REAL NOT NULL,
+                    PRIMARY KEY (target, path)
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS findings (
+                    target TEXT NOT NULL,
+                    template_id TEXT NOT NULL,
+                    found_at REAL NOT NULL,
+                    finding TEXT NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_findings_target ON findings (target, template_id)")
+
+    def plan(self, target, entries, stale_after=None):
+        """Return the template index entries that must run for the target: new, changed or stale."""
+        stale_after = self.stale_after if stale_after is None else stale_after
+        cutoff = time.time() - stale_after
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, hash, run_at FROM template_runs WHERE target = ?", (key(target),)
+            ).fetchall()
+        runs = {path: (hash_, run_at) for path, hash_, run_at in rows}
+        due = []
+        for entry in entries:
+            run = runs.get(entry["path"])
+            if run is None or run[0] != entry.get("hash") or run[1] < cutoff:
+                due.append(entry)
+        return due
+
+    def record(self, target, entries, findings, run_at=None):
+        """Mark the entries as run for the target, replacing the findings (any iterable) those templates reported before."""
+        run_at = time.time() if run_at is None else run_at
+        template_ids = {entry["id"] for entry in entries}
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO template_runs (target, path, template_id, hash, run_at) VALUES (?, ?, ?, ?, ?)",
+                [(key(target), entry["path"], entry["id"], entry.get("hash", ""), run_at) for entry in entries]
+            )
+            self.conn.executemany(
+                "DELETE FROM findings WHERE target = ? AND template_id = ?",
+                [(key(target), template_id) for template_id in template_ids]
+            )
+            stored = self.conn.executemany(
+                "INSERT INTO findings (target, template_id, found_at, finding) VALUES (?, ?, ?, ?)",
+                ((key(target), finding.get("template-id"), run_at, json.dumps(finding))
+                 for finding in findings if finding.get("template-id") in template_ids)
+            ).rowcount
+        logging.info(f"Recorded {len(entries)} templates and {stored} findings for {target}")
+
+    def carried_over(self, target, template_ids):
+        """Return the stored findings of the given templates for the target, marked as carried over."""
+        template_ids = list(template_ids)
+        findings = []
+        with self.lock:
+            for start in range(0, len(template_ids), 500):
+                chunk = template_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT found_at, finding FROM findings WHERE target = ? "
+                    f"AND template_id IN ({','.join('?' * len(chunk))}) ORDER BY rowid",
+                    [key(target), *chunk]
+                ).fetchall()
+                for found_at, finding in rows:
+                    finding = json.loads(finding)
+                    finding["carried_over"] = True
+                    finding["carried_over_from"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(found_at))
+                    findings.append(finding)
+        return findings
+
+def key(target):
+    """Targets are compared without surrounding whitespace or a trailing slash."""
+    return (target or "").strip().rstrip("/")
@@ -0,0 +1,318 @@
+import datetime
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+# Last status of a schedule run
+SKIPPED = "skipped"
+INTERRUPTED = "interrupted"
+
+INTERVAL = re.compile(r"^\s*(\d+)\s*([smhdw]?)\s*$")
+UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+MIN_INTERVAL = 60
+
+def parse_interval(value):
+    """Parse an interval such as 3600, "30m", "6h", "1d" or "1w" into seconds."""
+    match = INTERVAL.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid interval: {value!r} (use seconds or a number with s, m, h, d or w)")
+    seconds = int(match.group(1)) * UNITS[match.group(2)]
+    if seconds < MIN_INTERVAL:
+        raise ValueError(f"Interval must be at least {MIN_INTERVAL} seconds")
+    return seconds
+
+def parse_at(value):
+    """Parse a local time of day "HH:MM" into (hour, minute), or None when not given."""
+    if not value:
+        return None
+    try:
+        moment = datetime.datetime.strptime(value.strip(), "%H:%M")
+    except ValueError:
+        raise ValueError(f"Invalid time of day: {value!r} (use HH:MM)")
+    return moment.hour, moment.minute
+
+class ScheduleStore:
+    """Recurring scan definitions and target groups, backed by SQLite.
+
+    A target group is a named list of targets with its own concurrency and rate budget;
+    a schedule scans one group every interval seconds with a fixed scan request
+    (templates, filters, DeepSeek use...), optionally aligned to a time of day.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS target_groups (
+                    name TEXT PRIMARY KEY,
+                    targets TEXT NOT NULL,
+                    max_concurrent INTEGER,
+                    rate_budget INTEGER
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS schedules (
+                    schedule_id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    group_name TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    interval INTEGER NOT NULL,
+                    at TEXT,
+                    enabled INTEGER NOT NULL DEFAULT 1,
+                    next_run_at REAL NOT NULL,
+                    last_run_at REAL,
+                    last_status TEXT,
+                    running_since REAL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_schedules_due ON schedules (enabled, next_run_at)")
+
+    def save_group(self, name, targets, max_concurrent=None, rate_budget=None):
+        """Create or replace a target group; max_concurrent and rate_budget of None mean unlimited."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO target_groups (name, targets, max_concurrent, rate_budget) VALUES (?, ?, ?, ?)",
+                (name, json.dumps(targets), max_concurrent, rate_budget)
+            )
+
+    def delete_group(self, name):
+        """Delete a target group; returns False while schedules still use it."""
+        with self.lock, self.conn:
+            if self.conn.execute("SELECT 1 FROM schedules WHERE group_name = ?", (name,)).fetchone():
+                return False
+            self.conn.execute("DELETE FROM target_groups WHERE name = ?", (name,))
+            return True
+
+    def groups(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM target_groups ORDER BY name").fetchall()
+        return {row["name"]: dict(row, targets=json.loads(row["targets"])) for row in rows}
+
+    def create(self, name, group_name, request, interval, at=None, spread=0):
+        """Add a schedule and return it; its first run is the next slot of its interval (and time of day)."""
+        schedule = {
+            "schedule_id": str(uuid.uuid4()),
+            "name": name,
+            "group_name": group_name,
+            "request": request,
+            "interval": parse_interval(interval),
+            "at": at or None,
+            "created_at": time.time()
+        }
+        parse_at(schedule["at"])
+        schedule["next_run_at"] = next_run_after(schedule, schedule["created_at"], spread)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO schedules (schedule_id, name, group_name, request, interval, at, next_run_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (schedule["schedule_id"], name, group_name, json.dumps(request), schedule["interval"],
+                 schedule["at"], schedule["next_run_at"], schedule["created_at"])
+            )
+        return self.get(schedule["schedule_id"])
+
+    def get(self, schedule_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM schedules WHERE schedule_id = ?", (schedule_id,)).fetchone()
+        return _schedule(row) if row else None
+
+    def list(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM schedules ORDER BY next_run_at").fetchall()
+        return [_schedule(row) for row in rows]
+
+    def due(self, now):
+        """Return the enabled schedules whose next run is at or before now, most overdue first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM schedules WHERE enabled = 1 AND next_run_at <= ? ORDER BY next_run_at", (now,)
+            ).fetchall()
+        return [_schedule(row) for row in rows]
+
+    def set_enabled(self, schedule_id, enabled):
+        with self.lock, self.conn:
+            return self.conn.execute("UPDATE schedules SET enabled = ? WHERE schedule_id = ?",
+                                     (int(bool(enabled)), schedule_id)).rowcount > 0
+
+    def delete(self, schedule_id):
+        with self.lock, self.conn:
+            return self.conn.execute("DELETE FROM schedules WHERE schedule_id = ?", (schedule_id,)).rowcount > 0
+
+    def started(self, schedule_id, now, next_run_at):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE schedules SET running_since = ?, last_run_at = ?, next_run_at = ? WHERE schedule_id = ?",
+                (now, now, next_run_at, schedule_id)
+            )
+
+    def skipped(self, schedule_id, next_run_at):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE schedules SET last_status = ?, next_run_at = ? WHERE schedule_id = ?",
+                              (SKIPPED, next_run_at, schedule_id))
+
+    def finished(self, schedule_id, status):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE schedules SET running_since = NULL, last_status = ? WHERE schedule_id = ?",
+                              (status, schedule_id))
+
+    def reset_running(self):
+        """Mark runs left active by a previous process as interrupted; returns how many there were."""
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "UPDATE schedules SET running_since = NULL, last_status = ? WHERE running_since IS NOT NULL",
+                (INTERRUPTED,)
+            ).rowcount
+
+def _schedule(row):
+    return dict(row, request=json.loads(row["request"]), enabled=bool(row["enabled"]))
+
+def next_run_after(schedule, after, spread=0):
+    """Return the first run time of a schedule after a moment.
+
+    Runs fall on slots interval seconds apart, counted from the schedule's time of day
+    (today) or from its creation time, plus a fixed offset of up to spread seconds
+    derived from the schedule ID, so schedules sharing a slot do not all start at once.
+    """
+    interval = schedule["interval"]
+    at = parse_at(schedule.get("at"))
+    if at:
+        anchor = datetime.datetime.fromtimestamp(schedule["created_at"]).replace(
+            hour=at[0], minute=at[1], second=0, microsecond=0).timestamp()
+    else:
+        anchor = schedule["created_at"]
+    offset = zlib.crc32(schedule["schedule_id"].encode()) % max(1, int(min(spread, interval / 2))) if spread else 0
+    anchor += offset
+    if after < anchor:
+        return anchor
+    return anchor + (int((after - anchor) // interval) + 1) * interval
+
+class Scheduler:
+    """Dispatch due schedules to the agent within global and per-group concurrency and rate budgets.
+
+    dispatch(schedule, group, rate_limit) runs one scan of a schedule's target group at
+    the given rate (requests per second) and returns its status. Each tick starts the
+    due schedules, oldest first, while the budgets allow: at most max_concurrent
+    scheduled scans run at once (and a group's max_concurrent of its own), and the
+    rates of running scans add up to at most rate_budget (and the group's budget).
+    A scan gets its requested rate or what is left of the budgets, and waits for a
+    later tick when less than min_rate is left. A schedule whose previous run is still
+    active skips the slot.
+    """
+
+    def __init__(self, store, dispatch, max_concurrent=2, rate_budget=0, spread=600, tick=15, min_rate=5):
+        self.store = store
+        self.dispatch = dispatch
+        self.max_concurrent = max_concurrent
+        self.rate_budget = rate_budget
+        self.spread = spread
+        self.tick_interval = tick
+        self.min_rate = min_rate
+        self.lock = threading.Lock()
+        self.running = {}
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        interrupted = self.store.reset_running()
+        if interrupted:
+            logging.warning(f"{interrupted} scheduled scans were interrupted by a restart")
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        logging.info(f"Scheduler started (max {self.max_concurrent} scans, rate budget {self.rate_budget or 'unlimited'})")
+
+    def stop(self):
+        self.stopping.set()
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logging.error(f"Scheduler tick failed: {e}")
+            self.stopping.wait(self.tick_interval)
+
+    def tick(self, now=None):
+        """Start every due schedule the budgets allow; return the IDs started."""
+        now = now or time.time()
+        groups = self.store.groups()
+        started = []
+        for schedule in self.store.due(now):
+            next_run_at = next_run_after(schedule, now, self.spread)
+            if schedule["schedule_id"] in self.running:
+                logging.warning(f"Schedule {schedule['name']}: previous run still active, skipping this run")
+                self.store.skipped(schedule["schedule_id"], next_run_at)
+                continue
+            group = groups.get(schedule["group_name"])
+            if not group:
+                logging.error(f"Schedule {schedule['name']}: target group {schedule['group_name']} does not exist")
+                self.store.skipped(schedule["schedule_id"], next_run_at)
+                continue
+            rate_limit = self._allocate(schedule, group)
+            if rate_limit is None:
+                # Budgets are spent; the schedule stays due and is tried again on the next tick
+                continue
+            self.store.started(schedule["schedule_id"], now, next_run_at)
+            self._start(schedule, group, rate_limit)
+            started.append(schedule["schedule_id"])
+        return started
+
+    def run_now(self, schedule_id):
+        """Run a schedule at once, within the budgets; returns False if it is active or the budgets are spent."""
+        schedule = self.store.get(schedule_id)
+        group = self.store.groups().get(schedule["group_name"]) if schedule else None
+        if not group or schedule_id in self.running:
+            return False
+        rate_limit = self._allocate(schedule, group)
+        if rate_limit is None:
+            return False
+        self.store.started(schedule_id, time.time(), schedule["next_run_at"])
+        self._start(schedule, group, rate_limit)
+        return True
+
+    def _allocate(self, schedule, group):
+        """Reserve a concurrency slot and a rate for a scan, or return None when the budgets do not allow it."""
+        rate_limit = schedule["request"].get("rate_limit") or 50
+        with self.lock:
+            in_group = [run for run in self.running.values() if run["group"] == group["name"]]
+            if self.max_concurrent and len(self.running) >= self.max_concurrent:
+                return None
+            if group["max_concurrent"] and len(in_group) >= group["max_concurrent"]:
+                return None
+            if self.rate_budget:
+                rate_limit = min(rate_limit, self.rate_budget - sum(run["rate_limit"] for run in self.running.values()))
+            if group["rate_budget"]:
+                rate_limit = min(rate_limit, group["rate_budget"] - sum(run["rate_limit"] for run in in_group))
+            if rate_limit < self.min_rate:
+                return None
+            self.running[schedule["schedule_id"]] = {"group": group["name"], "rate_limit": rate_limit,
+                                                     "name": schedule["name"], "started_at": time.time()}
+        return rate_limit
+
+    def _start(self, schedule, group, rate_limit):
+        logging.info(f"Schedule {schedule['name']}: scanning {len(group['targets'])} targets of "
+                     f"{group['name']} at {rate_limit} requests/s")
+        threading.Thread(target=self._run, args=(schedule, group, rate_limit), daemon=True).start()
+
+    def _run(self, schedule, group, rate_limit):
+        status = "error"
+        try:
+            status = self.dispatch(schedule, group, rate_limit)
+        except Exception as e:
+            logging.error(f"Schedule {schedule['name']} failed: {e}")
+        finally:
+            with self.lock:
+                self.running.pop(schedule["schedule_id"], None)
+            self.store.finished(schedule["schedule_id"], status)
+
+    def active(self):
+        """Return the running scheduled scans: schedule ID, name, group, rate and start time."""
+        with self.lock:
+            return [dict(run, schedule_id=schedule_id) for schedule_id, run in self.running.items()]
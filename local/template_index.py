@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+# Nuclei severities, lowest first; anything else ranks below info
+SEVERITY_ORDER = ["info", "low", "medium", "high", "critical"]
+
+# Top-level template keys naming the protocol a template speaks
+PROTOCOL_KEYS = {
+    "http": "http", "requests": "http", "dns": "dns", "file": "file", "network": "network",
+    "tcp": "network", "ssl": "ssl", "headless": "headless", "code": "code", "javascript": "javascript",
+    "websocket": "websocket", "whois": "whois", "workflows": "workflow"
+}
+
+TOP_LEVEL_KEY = re.compile(r"^([A-Za-z_-]+):\s*(.*)$")
+INFO_FIELD = re.compile(r"^\s+(severity|tags):\s*(.*)$")
+
+class TemplateIndex:
+    """Index of the Nuclei templates on disk: id, path, severity, tags, protocol and content hash of every YAML file.
+
+    The index is persisted as JSON next to the agent and refreshed by comparing file
+    mtimes, so only added or changed templates are parsed again. Checking that a
+    template directory exists and filtering by tag or severity are dictionary lookups.
+    """
+
+    def __init__(self, root, path, max_age=3600):
+        self.root = root
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.templates = {}
+        self.dirs = {}
+        self.refreshed_at = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.error(f"Error loading template index {self.path}: {e}")
+            return
+        if data.get("root") == self.root:
+            self.templates = data.get("templates", {})
+
+    def _save(self):
+        # A temporary file of its own, so agent processes sharing the index never write the same one
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"root": self.root, "templates": self.templates}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Error saving template index {self.path}: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def refresh(self):
+        """Walk the templates directory, parsing only files whose mtime changed; return the number parsed."""
+        with self.lock:
+            start = time.time()
+            templates = {}
+            dirs = {}
+            parsed = 0
+            for dirpath, dirnames, filenames in os.walk(self.root):
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+                rel_dir = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+                if rel_dir != ".":
+                    dirs.setdefault(rel_dir, 0)
+                for filename in filenames:
+                    if not filename.endswith((".yaml", ".yml")):
+                        continue
+                    full_path = os.path.join(dirpath, filename)
+                    rel_path = filename if rel_dir == "." else f"{rel_dir}/{filename}"
+                    try:
+                        mtime = os.stat(full_path).st_mtime
+                    except OSError:
+                        continue
+                    entry = self.templates.get(rel_path)
+                    if entry is None or entry["mtime"] != mtime or "hash" not in entry:
+                        entry = parse_template(full_path)
+                        if entry is None:
+                            continue
+                        entry.update(path=rel_path, mtime=mtime)
+                        parsed += 1
+                    templates[rel_path] = entry
+                    parent = rel_dir
+                    while parent != ".":
+                        dirs[parent] = dirs.get(parent, 0) + 1
+                        parent = parent.rsplit("/", 1)[0] if "/" in parent else "."
+            changed = parsed or len(templates) != len(self.templates)
+            self.templates = templates
+            self.dirs = dirs
+            self.refreshed_at = time.time()
+            if changed:
+                self._save()
+        logging.info(f"Template index: {len(templates)} templates in {len(dirs)} directories, "
+                     f"{parsed} parsed in {time.time() - start:.2f}s")
+        return parsed
+
+    def refresh_if_stale(self):
+        """Refresh when the index was never built in this process or is older than max_age."""
+        if self.refreshed_at is None or time.time() - self.refreshed_at > self.max_age:
+            self.refresh()
+
+    def exists(self, template):
+        """Return True if template names an indexed directory or template file, e.g. "http/cves"."""
+        if self.refreshed_at is None:
+            self.refresh()
+        template = template.strip().strip("/")
+        return template in self.dirs or template in self.templates
+
+    def find(self, tags=None, min_severity=None, protocol=None, under=None, exclude_tags=None, technologies=None):
+        """Return the templates matching all of the given filters.
+
+        tags matches any of the given tags and exclude_tags drops templates carrying any
+        of them; technologies keeps templates tagged with one of the detected technologies;
+        min_severity keeps that severity and above; under restricts the search to
+        directories or template files (one or a list).
+        """
+        if self.refreshed_at is None:
+            self.refresh()
+        tags = _tag_set(tags)
+        exclude_tags = _tag_set(exclude_tags)
+        technologies = _tag_set(technologies)
+        floor = severity_rank(min_severity) if min_severity else None
+        if isinstance(under, str):
+            under = [under]
+        under = [d.strip().strip("/") for d in under or []]
+        prefixes = tuple(f"{d}/" for d in under)
+        matches = []
+        for entry in self.templates.values():
+            if under and entry["path"] not in under and not entry["path"].startswith(prefixes):
+                continue
+            if protocol and entry["protocol"] != protocol:
+                continue
+            if floor is not None and severity_rank(entry["severity"]) < floor:
+                continue
+            if tags and not tags.intersection(entry["tags"]):
+                continue
+            if exclude_tags and exclude_tags.intersection(entry["tags"]):
+                continue
+            if technologies and not technologies.intersection(entry["tags"]):
+                continue
+            matches.append(entry)
+        return sorted(matches, key=lambda entry: entry["path"])
+
+    def stats(self, under=None):
+        """Return template counts by severity and protocol, for the whole index or some directories."""
+        counts = {"templates": 0, "severity": {}, "protocol": {}}
+        for entry in self.find(under=under):
+            counts["templates"] += 1
+            counts["severity"][entry["severity"]] = counts["severity"].get(entry["severity"], 0) + 1
+            counts["protocol"][entry["protocol"]] = counts["protocol"].get(entry["protocol"], 0) + 1
+        return counts
+
+def _tag_set(tags):
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return {tag.strip().lower() for tag in tags or [] if tag.strip()}
+
+def severity_rank(severity):
+    """Position of a severity in SEVERITY_ORDER, -1 for unknown values."""
+    severity = (severity or "").strip().lower()
+    return SEVERITY_ORDER.index(severity) if severity in SEVERITY_ORDER else -1
+
+def parse_template(path):
+    """Read id, severity, tags and protocol from a Nuclei template without a YAML parser.
+
+    Only the top-level keys and the info block are looked at, which is all Nuclei's
+    own template listing needs. The SHA-1 of the file content is kept as "hash" so
+    incremental rescans can tell a changed template from a touched one. Returns None
+    for files without an id.
+    """
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+    except OSError as e:
+        logging.warning(f"Cannot read template {path}: {e}")
+        return None
+    lines = content.decode("utf-8", errors="replace").splitlines()
+    template_id = None
+    severity = "unknown"
+    tags = []
+    protocol = None
+    in_info = False
+    for line in lines:
+        match = TOP_LEVEL_KEY.match(line)
+        if match:
+            key, value = match.groups()
+            in_info = key == "info"
+            if key == "id":
+                template_id = _scalar(value)
+            elif protocol is None and key in PROTOCOL_KEYS:
+                protocol = PROTOCOL_KEYS[key]
+            continue
+        if in_info:
+            field = INFO_FIELD.match(line)
+            if field:
+                name, value = field.groups()
+                if name == "severity":
+                    severity = _scalar(value).lower() or "unknown"
+                elif not tags:
+                    tags = [_scalar(tag).lower() for tag in _scalar(value).strip("[]").split(",") if tag.strip()]
+    if not template_id:
+        return None
+    return {"id": template_id, "severity": severity, "tags": tags, "protocol": protocol or "unknown",
+            "hash": hashlib.sha1(content).hexdigest()}
+
+def _scalar(value):
+    value = value.split(" #", 1)[0].strip()
+    return value.strip("'\"")
@@ -3,24 +3,51 @@ import json
 import logging
 import os
 import re
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
 import asyncio
+import importlib.util
+import tempfile
+import time
+import uuid
+import zlib
 from typing import List, Optional
-import subprocess
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import httpx
+from jobs import JobStore, JobManager, JobQueueFull
+from suggestion_cache import SuggestionCache
+from batch_targets import parse_targets, write_targets_file, TargetMatcher
+from suggestion_cache import normalize_host
+from template_index import TemplateIndex
+from scan_state import ScanState
+from rate_control import RateController, ScanObservation, is_rate_limited
+from checkpoints import CheckpointStore, chunk_templates, replayed
+from metrics import Registry, PhaseTimer
+from fingerprint import (FINGERPRINT_TEMPLATES, TARGETED_DIRECTORIES, FALLBACK_DIRECTORIES,
+                         detect_technologies, technology_tags)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # DeepSeek API configuration
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "sk-e0abe1db2f0c4c1ca45a917a99a714f7")
 DEEPSEEK_MODEL = "deepseek-chat"
+DEEPSEEK_POOL_SIZE = int(os.getenv("DEEPSEEK_POOL_SIZE", "20"))
+DEEPSEEK_CONNECT_TIMEOUT = float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", "10"))
+DEEPSEEK_READ_TIMEOUT = float(os.getenv("DEEPSEEK_READ_TIMEOUT", "60"))
+# HTTP/2 is used when the h2 package is installed (pip install httpx[http2])
+DEEPSEEK_HTTP2 = os.getenv("DEEPSEEK_HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+DEEPSEEK_RETRIES = 5
+DEEPSEEK_BACKOFF_FACTOR = 2
+DEEPSEEK_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# DeepSeek suggestion cache; bump SUGGESTION_PROMPT_VERSION when the prompts change
+SUGGESTION_CACHE_DB = os.getenv("SUGGESTION_CACHE_DB", "suggestion_cache.db")
+SUGGESTION_CACHE_TTL = int(os.getenv("SUGGESTION_CACHE_TTL", str(7 * 24 * 3600)))
+SUGGESTION_PROMPT_VERSION = "1"
+suggestion_cache = SuggestionCache(SUGGESTION_CACHE_DB, ttl=SUGGESTION_CACHE_TTL, version=SUGGESTION_PROMPT_VERSION)
 
 # Default templates if DeepSeek fails or no templates specified
 DEFAULT_TEMPLATES = [
@@ -31,17 +58,95 @@ DEFAULT_TEMPLATES = [
     "http/cves/"
 ]
 
+# Nuclei process configuration
+NUCLEI_TIMEOUT = int(os.getenv("SCAN_TIMEOUT", "900"))  # 15-minute timeout
+NUCLEI_STATS_INTERVAL = 5  # seconds between progress events
+NUCLEI_LINE_LIMIT = 32 * 1024 * 1024  # findings carry full HTTP responses
+MAX_CONCURRENT_SCANS = int(os.getenv("MAX_CONCURRENT_SCANS", "32"))
+# Index of the templates on disk, persisted between restarts and refreshed by mtime
+NUCLEI_TEMPLATES_DIR = os.getenv("NUCLEI_TEMPLATES_DIR", os.path.join(os.path.expanduser("~"), "nuclei-templates"))
+TEMPLATE_INDEX_PATH = os.getenv("TEMPLATE_INDEX_PATH", "template_index.json")
+TEMPLATE_INDEX_REFRESH = int(os.getenv("TEMPLATE_INDEX_REFRESH", "3600"))
+template_index = TemplateIndex(NUCLEI_TEMPLATES_DIR, TEMPLATE_INDEX_PATH, max_age=TEMPLATE_INDEX_REFRESH)
+# Parallel Nuclei processes per scan; the scan's rate_limit is split between them
+NUCLEI_SHARDS = int(os.getenv("NUCLEI_SHARDS", "1"))
+
+# Incremental rescans: templates run per target, and how long a run stays fresh
+SCAN_STATE_DB = os.getenv("SCAN_STATE_DB", "scan_state.db")
+INCREMENTAL_STALE_AFTER = int(os.getenv("INCREMENTAL_STALE_AFTER", str(7 * 24 * 3600)))
+scan_state = ScanState(SCAN_STATE_DB, stale_after=INCREMENTAL_STALE_AFTER)
+
+# Adaptive rate control: per-host Nuclei rates learned from earlier scans
+RATE_CONTROL_DB = os.getenv("RATE_CONTROL_DB", "rate_control.db")
+ADAPTIVE_MIN_RATE = int(os.getenv("ADAPTIVE_MIN_RATE", "5"))
+ADAPTIVE_MAX_RATE = int(os.getenv("ADAPTIVE_MAX_RATE", "500"))
+rate_controller = RateController(RATE_CONTROL_DB, min_rate=ADAPTIVE_MIN_RATE, max_rate=ADAPTIVE_MAX_RATE)
+
+# Checkpointed scans: templates run in chunks sharing one SCAN_TIMEOUT budget, finished chunks are kept
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "checkpoints.db")
+CHECKPOINT_CHUNK_SIZE = int(os.getenv("CHECKPOINT_CHUNK_SIZE", "500"))
+CHECKPOINT_TTL = int(os.getenv("CHECKPOINT_TTL", str(7 * 24 * 3600)))
+checkpoints = CheckpointStore(CHECKPOINT_DB, ttl=CHECKPOINT_TTL)
+
+# Prometheus metrics, served on /metrics; every scan summary also carries its own "timings"
+metrics = Registry()
+scan_phase_seconds = metrics.histogram("nuclei_scan_phase_seconds", "Time spent in each scan phase", ["phase"])
+scans_total = metrics.counter("nuclei_scans_total", "Scans finished, by status", ["status"])
+findings_total = metrics.counter("nuclei_findings_total", "Findings reported by Nuclei, by severity", ["severity"])
+scan_timeouts_total = metrics.counter("nuclei_scan_timeouts_total", "Nuclei runs killed by SCAN_TIMEOUT")
+templates_not_found_total = metrics.counter("nuclei_templates_not_found_total",
+                                            "Requested templates missing from the templates directory")
+scans_in_flight = metrics.gauge("nuclei_scans_in_flight", "Scans currently running")
+deepseek_request_seconds = metrics.histogram("deepseek_request_seconds", "DeepSeek call latency, retries included")
+deepseek_retries_total = metrics.counter("deepseek_retries_total", "DeepSeek requests retried")
+deepseek_failures_total = metrics.counter("deepseek_failures_total", "DeepSeek calls that returned no templates")
+
+# Scan job queue configuration
+JOBS_DB = os.getenv("JOBS_DB", "jobs.db")
+NUCLEI_WORKERS = int(os.getenv("NUCLEI_WORKERS", "4"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "1000"))
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "168"))
+
+# Created lazily so they bind to the event loop uvicorn is running
+_scan_semaphore = None
+_deepseek_client = None
+deepseek_stats = {"requests": 0, "connections": 0}
+
 # FastAPI app
 app = FastAPI()
 
 # Pydantic models
 class ScanRequest(BaseModel):
     type: str = "scan_request"
-    target: str
+    target: Optional[str] = None
+    # Batch scans: a list of targets and/or the body of a target file, one target per line
+    targets: Optional[List[str]] = None
+    targets_file: Optional[str] = None
     templates: Optional[List[str]] = None
     rate_limit: int = 50
     use_deepseek: bool = True
     vulnerability_type: str = "http"
+    shards: Optional[int] = None
+    # Narrow the template directories to individual templates (see narrow_templates)
+    severity: Optional[str] = None
+    tags: Optional[List[str]] = None
+    exclude_tags: Optional[List[str]] = None
+    technologies: Optional[List[str]] = None
+    # Two-phase scan: detect technologies first, then run only the templates for them
+    fingerprint: bool = False
+    # Rescan only new, changed or stale templates and carry the other findings over
+    incremental: bool = False
+    stale_after: Optional[int] = None
+    # Start from the host's learned rate and adjust it after the scan; rate_limit is the first guess
+    adaptive: bool = True
+    # Upper bound on the adaptive rate, e.g. the share of a scheduler's rate budget given to this scan
+    max_rate: Optional[int] = None
+    concurrency: Optional[int] = None
+    bulk_size: Optional[int] = None
+    # Run the templates in checkpointed chunks, one Nuclei process after another, so a stopped scan can resume
+    checkpoint: bool = False
+    # Continue a timed-out or failed scan from its checkpoint; the checkpoint's request is used
+    resume: Optional[str] = None
 
 class SuggestRequest(BaseModel):
     type: str = "suggest_templates"
@@ -79,16 +184,43 @@ def clean_template_list(content):
             return None
         return templates
 
-def call_deepseek(prompt):
-    """Call DeepSeek API to suggest Nuclei template directories."""
+def get_deepseek_client():
+    """Return the shared DeepSeek client: keep-alive connection pool, HTTP/2 when available."""
+    global _deepseek_client
+    if _deepseek_client is None:
+        _deepseek_client = httpx.AsyncClient(
+            http2=DEEPSEEK_HTTP2,
+            limits=httpx.Limits(max_connections=DEEPSEEK_POOL_SIZE, max_keepalive_connections=DEEPSEEK_POOL_SIZE),
+            timeout=httpx.Timeout(DEEPSEEK_READ_TIMEOUT, connect=DEEPSEEK_CONNECT_TIMEOUT)
+        )
+    return _deepseek_client
+
+async def _trace_deepseek_connection(event_name, info):
+    """Count new TCP connections so reuse can be reported."""
+    if event_name == "connection.connect_tcp.complete":
+        deepseek_stats["connections"] += 1
+
+def deepseek_connection_stats():
+    """Report DeepSeek requests sent and connections opened; the difference were served by reused connections."""
+    return {
+        **deepseek_stats,
+        "reused": max(deepseek_stats["requests"] - deepseek_stats["connections"], 0),
+        "http2": DEEPSEEK_HTTP2
+    }
+
+async def call_deepseek(prompt):
+    """Call DeepSeek API to suggest Nuclei template directories, recording latency and failures."""
+    with deepseek_request_seconds.time():
+        template_list = await _call_deepseek(prompt)
+    if not template_list:
+        deepseek_failures_total.inc()
+    return template_list
+
+async def _call_deepseek(prompt):
     if not DEEPSEEK_API_KEY or len(DEEPSEEK_API_KEY) < 10:
         logging.error("Invalid or missing DEEPSEEK_API_KEY")
         return None
 
-    session = requests.Session()
-    retries = Retry(total=5, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504])
-    session.mount("https://", HTTPAdapter(max_retries=retries))
-    
     headers = {
         "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
         "Content-Type": "application/json"
@@ -98,288 +230,688 @@ def call_deepseek(prompt):
         "messages": [{"role": "user", "content": prompt}],
         "max_tokens": 500
     }
-    try:
-        response = session.post(DEEPSEEK_API_URL, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        raw_content = response.json()["choices"][0]["message"]["content"]
-        return clean_template_list(raw_content)
-    except requests.exceptions.RequestException as e:
-        logging.error(f"DeepSeek API error: {e}")
-        if isinstance(e, requests.exceptions.HTTPError):
+    client = get_deepseek_client()
+    for attempt in range(DEEPSEEK_RETRIES + 1):
+        try:
+            deepseek_stats["requests"] += 1
+            response = await client.post(DEEPSEEK_API_URL, headers=headers, json=data,
+                                         extensions={"trace": _trace_deepseek_connection})
+            if response.status_code in DEEPSEEK_RETRY_STATUSES and attempt < DEEPSEEK_RETRIES:
+                logging.warning(f"DeepSeek returned HTTP {response.status_code}, retrying")
+                deepseek_retries_total.inc()
+            else:
+                response.raise_for_status()
+                raw_content = response.json()["choices"][0]["message"]["content"]
+                return clean_template_list(raw_content)
+        except httpx.HTTPStatusError as e:
+            logging.error(f"DeepSeek API error: {e}")
             logging.error(f"HTTP status: {e.response.status_code}, response: {e.response.text}")
-        return None
+            return None
+        except httpx.TransportError as e:
+            if attempt >= DEEPSEEK_RETRIES:
+                logging.error(f"DeepSeek API error: {e}")
+                return None
+            logging.warning(f"DeepSeek connection error: {e}, retrying")
+            deepseek_retries_total.inc()
+        # Same schedule as urllib3 Retry(backoff_factor=2): 0s, 4s, 8s, ...
+        if attempt:
+            await asyncio.sleep(DEEPSEEK_BACKOFF_FACTOR * (2 ** attempt))
+    return None
+
+async def suggest_with_cache(target, vulnerability_type, prompt):
+    """Return cached template suggestions for the target host and type, asking DeepSeek on a miss."""
+    template_list = await asyncio.to_thread(suggestion_cache.get, target, vulnerability_type)
+    if template_list:
+        return template_list
+    template_list = await call_deepseek(prompt)
+    if template_list:
+        await asyncio.to_thread(suggestion_cache.put, target, vulnerability_type, template_list)
+    return template_list
 
-def run_nuclei(target, templates=None, rate_limit=50):
-    """Run Nuclei with specified parameters."""
-    # cmd = ["nuclei", "-u", target, "-rl", str(rate_limit)]
-    cmd = ["nuclei", "-u", target]
+def get_scan_semaphore():
+    """Return the semaphore limiting how many Nuclei processes run at once."""
+    global _scan_semaphore
+    if _scan_semaphore is None:
+        _scan_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SCANS)
+    return _scan_semaphore
+
+def build_nuclei_command(target, templates=None, targets_file=None, rate_limit=None, templates_file=None,
+                         concurrency=None, bulk_size=None):
+    """Build the Nuclei command line and return it with the template directories it uses.
+
+    With targets_file, Nuclei reads its targets from that list file (-l) instead of -u.
+    rate_limit, concurrency and bulk_size become -rl, -c and -bs when given. With
+    templates_file, the valid templates are written there and passed as one -t list file.
+    """
+    cmd = ["nuclei", "-l", targets_file] if targets_file else ["nuclei", "-u", target]
+    if rate_limit:
+        cmd.extend(["-rl", str(rate_limit)])
+    if concurrency:
+        cmd.extend(["-c", str(concurrency)])
+    if bulk_size:
+        cmd.extend(["-bs", str(bulk_size)])
 
-    
     valid_templates = []
-    templates_base_path = os.path.join(os.path.expanduser("~"), "nuclei-templates")
-    
+
     if templates:
         for template in templates:
             template = template.rstrip("/")
-            template_path = os.path.join(templates_base_path, template)
-            if os.path.exists(template_path):
+            if template_index.exists(template):
                 valid_templates.append(template)
             else:
-                logging.warning(f"Template directory not found: {template_path}")
-    
-    if valid_templates:
-        # Combine valid templates into a single -t argument with comma-separated paths
-        cmd.extend(["-t", ", ".join(valid_templates)])
-    else:
-        # Use specified template directories
-        default_templates = [
-            "http/technologies/",
-            "http/exposures/",
-            "http/vulnerabilities/",
-            "http/misconfiguration/",
-            "http/cves/"
-        ]
+                logging.warning(f"Template directory not found: {os.path.join(NUCLEI_TEMPLATES_DIR, template)}")
+                templates_not_found_total.inc()
+
+    if not valid_templates:
         logging.info("No valid templates provided, using default HTTP-related templates")
-        valid_default_templates = []
-        for template in default_templates:
-            template_path = os.path.join(templates_base_path, template.rstrip("/"))
-            if os.path.exists(template_path):
-                valid_default_templates.append(template)
-            else:
-                logging.warning(f"Default template directory not found: {template_path}")
-        
-        if valid_default_templates:
-            cmd.extend(["-t", ",".join(valid_default_templates)])
-        else:
-            logging.error("No valid templates available for scan")
-            return {"results": [], "errors": ["No valid templates available for scan"]}
-    
-    # Append -jsonl and -no-interactsh at the end
-    cmd.extend(["-jsonl", "-no-interactsh"])
-    
-    try:
-        logging.info(f"Executing Nuclei command: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=900  # 15-minute timeout
-        )
-        results = []
-        stderr_lines = result.stderr.splitlines()
-        errors = []
-        for line in stderr_lines:
-            logging.debug(f"Nuclei stderr: {line}")
-            if "Skipped" in line and "unresponsive" in line:
-                errors.append(f"Target skipped: {line}")
-            if "Could not find template" in line:
-                errors.append(f"Template error: {line}")
-        for line in result.stdout.splitlines():
-            if line.strip():
-                try:
-                    results.append(json.loads(line))
-                except json.JSONDecodeError:
-                    logging.error(f"Failed to parse Nuclei output line: {line}")
-                    errors.append(f"Invalid JSON output: {line}")
-        if not results and not errors:
-            logging.info(f"No vulnerabilities found for target: {target}")
-        return {"results": results, "errors": errors}
-    except subprocess.TimeoutExpired as e:
-        logging.error(f"Nuclei timed out after {e.timeout} seconds: {e}")
-        return {"results": [], "errors": ["Nuclei scan timed out"]}
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Nuclei error: {e}, stderr: {e.stderr}")
-        return {"results": [], "errors": [str(e), e.stderr]}
-    """Run Nuclei with specified parameters."""
-    cmd = ["nuclei", "-u", target, "-jsonl", "-no-interactsh"]
-    
-    valid_templates = []
-    templates_base_path = os.path.join(os.path.expanduser("~"), "nuclei-templates")
-    
-    if templates:
-        for template in templates:
-            template = template.rstrip("/")
-            template_path = os.path.join(templates_base_path, template)
-            if os.path.exists(template_path):
+        for template in DEFAULT_TEMPLATES:
+            if template_index.exists(template):
                 valid_templates.append(template)
             else:
-                logging.warning(f"Template directory not found: {template_path}")
-    
-    if valid_templates:
+                logging.warning(f"Default template directory not found: {os.path.join(NUCLEI_TEMPLATES_DIR, template)}")
+                templates_not_found_total.inc()
+
+    if not valid_templates:
+        return None, []
+
+    if templates_file:
+        with open(templates_file, "w") as f:
+            f.write("\n".join(os.path.join(NUCLEI_TEMPLATES_DIR, t) for t in valid_templates) + "\n")
+        cmd.extend(["-t", templates_file])
+    else:
         # Combine valid templates into a single -t argument with comma-separated paths
         cmd.extend(["-t", ",".join(valid_templates)])
-    else:
-        # Use specified template directories
-        default_templates = [
-            "http/technologies/",
-            "http/exposures/",
-            "http/vulnerabilities/",
-            "http/misconfiguration/",
-            "http/cves/"
-        ]
-        logging.info("No valid templates provided, using default HTTP-related templates")
-        valid_default_templates = []
-        for template in default_templates:
-            template_path = os.path.join(templates_base_path, template.rstrip("/"))
-            if os.path.exists(template_path):
-                valid_default_templates.append(template)
-            else:
-                logging.warning(f"Default template directory not found: {template_path}")
-        
-        if valid_default_templates:
-            cmd.extend(["-t", ",".join(valid_default_templates)])
-        else:
-            logging.error("No valid templates available for scan")
-            return {"results": [], "errors": ["No valid templates available for scan"]}
-    
+    # Append -jsonl and -no-interactsh at the end, with JSON stats on stderr for progress events
+    cmd.extend(["-jsonl", "-no-interactsh", "-stats", "-sj", "-si", str(NUCLEI_STATS_INTERVAL)])
+    return cmd, valid_templates
+
+def classify_stderr_line(line):
+    """Map a Nuclei stderr line to an error message, or None if it is not an error."""
+    if "Skipped" in line and "unresponsive" in line:
+        return f"Target skipped: {line}"
+    if "Could not find template" in line:
+        return f"Template error: {line}"
+    return None
+
+def parse_stats_line(line):
+    """Return the Nuclei JSON stats record on a stderr line, or None."""
+    if not line.startswith("{"):
+        return None
     try:
-        logging.info(f"Executing Nuclei command: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=900  # 15-minute timeout
-        )
-        results = []
-        stderr_lines = result.stderr.splitlines()
-        errors = []
-        for line in stderr_lines:
-            logging.debug(f"Nuclei stderr: {line}")
-            if "Skipped" in line and "unresponsive" in line:
-                errors.append(f"Target skipped: {line}")
-            if "Could not find template" in line:
-                errors.append(f"Template error: {line}")
-        for line in result.stdout.splitlines():
-            if line.strip():
-                try:
-                    results.append(json.loads(line))
-                except json.JSONDecodeError:
-                    logging.error(f"Failed to parse Nuclei output line: {line}")
-                    errors.append(f"Invalid JSON output: {line}")
-        if not results and not errors:
-            logging.info(f"No vulnerabilities found for target: {target}")
-        return {"results": results, "errors": errors}
-    except subprocess.TimeoutExpired as e:
-        logging.error(f"Nuclei timed out after {e.timeout} seconds: {e}")
-        return {"results": [], "errors": ["Nuclei scan timed out"]}
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Nuclei error: {e}, stderr: {e.stderr}")
-        return {"results": [], "errors": [str(e), e.stderr]}
-    """Run Nuclei with specified parameters."""
-    cmd = ["nuclei", "-u", target, "-rl", str(rate_limit), "-jsonl", "-no-interactsh"]
-    
-    valid_templates = []
-    templates_base_path = os.path.join(os.path.expanduser("~"), "nuclei-templates")
-    
-    if templates:
-        for template in templates:
-            template = template.rstrip("/")
-            template_path = os.path.join(templates_base_path, template)
-            if os.path.exists(template_path):
-                valid_templates.append(template)
-            else:
-                logging.warning(f"Template directory not found: {template_path}")
-    
-    if valid_templates:
-        for template in valid_templates:
-            cmd.extend(["-t", template])
+        stats = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(stats, dict) and ("percent" in stats or "requests" in stats):
+        return stats
+    return None
+
+async def _pump_lines(stream, kind, queue):
+    """Forward lines from a subprocess pipe to the queue, then signal end of stream."""
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        await queue.put((kind, line.decode("utf-8", errors="replace").strip()))
+    await queue.put((kind, None))
+
+def shard_workload(targets, templates, shards):
+    """Split a scan into at most shards (targets, templates) pieces.
+
+    Several targets are bucketed by a stable hash of their host, so every request to
+    one host stays in one Nuclei process; a single target is split by template directory.
+    """
+    if shards <= 1:
+        return [(targets, templates)]
+    if len(targets) > 1:
+        buckets = [[] for _ in range(shards)]
+        for target in targets:
+            buckets[zlib.crc32(normalize_host(target).encode()) % shards].append(target)
+        return [(bucket, templates) for bucket in buckets if bucket]
+    if templates and len(templates) > 1:
+        buckets = [templates[i::shards] for i in range(shards)]
+        return [(targets, bucket) for bucket in buckets if bucket]
+    return [(targets, templates)]
+
+async def stream_nuclei(target, templates=None, rate_limit=50, targets=None, shards=1, concurrency=None, bulk_size=None,
+                        timeout=None):
+    """Run Nuclei as an asyncio subprocess and yield finding, progress and error events as they arrive.
+
+    Each event is a (kind, payload) tuple. The last one is always ("summary", {...}).
+    When targets lists several hosts they are scanned by one Nuclei process, so the
+    templates are loaded once per batch, and each finding is tagged with its "target".
+    With shards > 1 the workload is split across that many Nuclei processes (see
+    stream_sharded). Nuclei is killed after timeout seconds (NUCLEI_TIMEOUT by default).
+    """
+    workload = shard_workload(targets or [target], templates, shards)
+    if len(workload) > 1:
+        stream = stream_sharded(workload, rate_limit, tag_targets=bool(targets and len(targets) > 1),
+                                concurrency=concurrency, bulk_size=bulk_size, timeout=timeout)
     else:
-        # Use default template directories
-        logging.info("No valid templates provided, using default HTTP-related templates")
-        for template in DEFAULT_TEMPLATES:
-            template_path = os.path.join(templates_base_path, template.rstrip("/"))
-            if os.path.exists(template_path):
-                cmd.extend(["-t", template])
-            else:
-                logging.warning(f"Default template directory not found: {template_path}")
-    
-    if "-t" not in cmd:
-        logging.error("No valid templates available for scan")
-        return {"results": [], "errors": ["No valid templates available for scan"]}
-    
+        stream = _stream_batch(target, templates, targets, rate_limit, concurrency, bulk_size, timeout)
+    async for event in stream:
+        yield event
+
+async def _stream_batch(target, templates, targets, rate_limit=None, concurrency=None, bulk_size=None, timeout=None):
+    """Run one Nuclei process over one target or a target list."""
+    matcher = None
+    targets_file = None
+    templates_file = None
+    if templates and any(t.endswith((".yaml", ".yml")) for t in templates):
+        # Explicit template files from narrow_templates can number in the thousands
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", prefix="nuclei-templates-", delete=False) as f:
+            templates_file = f.name
+    if targets and len(targets) > 1:
+        matcher = TargetMatcher(targets)
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", prefix="nuclei-targets-", delete=False) as f:
+            targets_file = f.name
+        write_targets_file(targets, targets_file)
+        target = f"{len(targets)} targets"
     try:
+        async for event in _stream_nuclei(target, templates, rate_limit, targets_file, matcher, templates_file,
+                                          concurrency, bulk_size, timeout):
+            yield event
+    finally:
+        for path in (targets_file, templates_file):
+            if path:
+                os.unlink(path)
+
+async def _stream_nuclei(target, templates, rate_limit, targets_file, matcher, templates_file=None,
+                         concurrency=None, bulk_size=None, timeout=None):
+    # Seconds spent validating templates, waiting for a Nuclei slot, running Nuclei and parsing its output
+    timings = {}
+    started = time.perf_counter()
+    # Template lookups may rebuild the index and the templates file is written to disk
+    cmd, valid_templates = await asyncio.to_thread(build_nuclei_command, target, templates, targets_file, rate_limit,
+                                                   templates_file, concurrency, bulk_size)
+    timings["template_validation"] = time.perf_counter() - started
+    if not cmd:
+        logging.error("No valid templates available for scan")
+        yield "error", "No valid templates available for scan"
+        yield "summary", {"findings": 0, "severity_counts": {}, "errors": ["No valid templates available for scan"],
+                          "templates_used": [], "return_code": None, "timings": observe_timings(timings)}
+        return
+
+    semaphore = get_scan_semaphore()
+    if semaphore.locked():
+        yield "progress", {"status": "queued", "target": target}
+    started = time.perf_counter()
+    async with semaphore:
+        timings["queued"] = time.perf_counter() - started
+        started = time.perf_counter()
+        parse_seconds = 0.0
         logging.info(f"Executing Nuclei command: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=900  # 15-minute timeout
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=NUCLEI_LINE_LIMIT
         )
-        results = []
-        stderr_lines = result.stderr.splitlines()
+        queue = asyncio.Queue()
+        pumps = [
+            asyncio.create_task(_pump_lines(proc.stdout, "stdout", queue)),
+            asyncio.create_task(_pump_lines(proc.stderr, "stderr", queue))
+        ]
+        loop = asyncio.get_running_loop()
+        timeout = timeout or NUCLEI_TIMEOUT
+        deadline = loop.time() + timeout
+        findings = 0
+        severity_counts = {}
+        target_counts = {}
         errors = []
-        for line in stderr_lines:
-            logging.debug(f"Nuclei stderr: {line}")
-            if "Skipped" in line and "unresponsive" in line:
-                errors.append(f"Target skipped: {line}")
-            if "Could not find template" in line:
-                errors.append(f"Template error: {line}")
-        for line in result.stdout.splitlines():
-            if line.strip():
+        open_streams = 2
+
+        yield "progress", {"status": "started", "target": target, "templates": valid_templates}
+        try:
+            while open_streams:
                 try:
-                    results.append(json.loads(line))
-                except json.JSONDecodeError:
-                    logging.error(f"Failed to parse Nuclei output line: {line}")
-                    errors.append(f"Invalid JSON output: {line}")
-        if not results and not errors:
-            logging.info(f"No vulnerabilities found for target: {target}")
-        return {"results": results, "errors": errors}
-    except subprocess.TimeoutExpired as e:
-        logging.error(f"Nuclei timed out after {e.timeout} seconds: {e}")
-        return {"results": [], "errors": ["Nuclei scan timed out"]}
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Nuclei error: {e}, stderr: {e.stderr}")
-        return {"results": [], "errors": [str(e), e.stderr]}
-
-def process_request(request):
-    """Process MCP scan or suggest request."""
-    if request.get("type") == "scan_request":
-        target = request.get("target")
-        templates = request.get("templates", None)
-        rate_limit = request.get("rate_limit", 50)
-        use_deepseek = request.get("use_deepseek", True)
-        vulnerability_type = request.get("vulnerability_type", "http")
+                    kind, line = await asyncio.wait_for(queue.get(), timeout=max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    logging.error(f"Nuclei timed out after {timeout:.0f} seconds")
+                    scan_timeouts_total.inc()
+                    errors.append("Nuclei scan timed out")
+                    yield "error", "Nuclei scan timed out"
+                    break
+                if line is None:
+                    open_streams -= 1
+                    continue
+                if not line:
+                    continue
+                if kind == "stdout":
+                    parse_started = time.perf_counter()
+                    try:
+                        finding = json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.error(f"Failed to parse Nuclei output line: {line}")
+                        errors.append(f"Invalid JSON output: {line}")
+                        yield "error", f"Invalid JSON output: {line}"
+                        continue
+                    finally:
+                        parse_seconds += time.perf_counter() - parse_started
+                    findings += 1
+                    severity = finding.get("info", {}).get("severity", "unknown")
+                    severity_counts[severity] = severity_counts.get(severity, 0) + 1
+                    findings_total.inc(severity=severity)
+                    if matcher:
+                        finding["target"] = matcher.match(finding)
+                        target_counts[finding["target"]] = target_counts.get(finding["target"], 0) + 1
+                    yield "finding", finding
+                else:
+                    logging.debug(f"Nuclei stderr: {line}")
+                    stats = parse_stats_line(line)
+                    if stats is not None:
+                        yield "progress", stats
+                        continue
+                    if is_rate_limited(line):
+                        yield "progress", {"status": "rate_limited", "target": target}
+                        continue
+                    error = classify_stderr_line(line)
+                    if error:
+                        if error.startswith("Template error"):
+                            templates_not_found_total.inc()
+                        errors.append(error)
+                        yield "error", error
+        finally:
+            if open_streams and proc.returncode is None:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+            for pump in pumps:
+                pump.cancel()
+            await proc.wait()
+            timings["nuclei"] = time.perf_counter() - started - parse_seconds
+            timings["parse"] = parse_seconds
 
-        if not target:
-            return {"type": "scan_response", "status": "error", "errors": ["Missing target"]}
-
-        valid_templates = []
-        if templates:
-            valid_templates = templates
-        elif use_deepseek:
-            prompt = (
-                f"For the target {target}, suggest a JSON array of Nuclei template directories "
-                f"suitable for scanning {vulnerability_type} vulnerabilities. "
-                "Examples include [\"http/technologies/\", \"http/exposures/\", \"http/vulnerabilities/\", \"http/misconfiguration/\", \"http/cves/\"]. "
-                "Ensure the response is a valid JSON array containing only directory paths ending with '/'. "
-                "Do not include explanations or additional text outside the JSON array."
-            )
-            template_list = call_deepseek(prompt)
-            if template_list:
-                valid_templates.extend(template_list)
-                logging.info(f"DeepSeek suggested templates for {vulnerability_type}: {template_list}")
-            else:
-                logging.warning("DeepSeek failed to suggest templates, using default templates")
-                valid_templates.extend(DEFAULT_TEMPLATES)
+    if proc.returncode not in (0, None) and not errors:
+        errors.append(f"Nuclei exited with status {proc.returncode}")
+    if not findings and not errors:
+        logging.info(f"No vulnerabilities found for target: {target}")
+    summary = {
+        "findings": findings,
+        "severity_counts": severity_counts,
+        "errors": errors,
+        "templates_used": valid_templates,
+        "return_code": proc.returncode,
+        "timings": observe_timings(timings)
+    }
+    if matcher:
+        summary["targets"] = target_counts
+    yield "summary", summary
+
+def observe_timings(timings):
+    """Record one Nuclei run's phase timings in the phase histogram and return them rounded for its summary."""
+    for phase, seconds in timings.items():
+        scan_phase_seconds.observe(seconds, phase=phase)
+    return {phase: round(seconds, 3) for phase, seconds in timings.items()}
+
+def add_timings(total, timings):
+    """Add one run's phase timings into total, in place."""
+    for phase, seconds in (timings or {}).items():
+        total[phase] = round(total.get(phase, 0) + seconds, 3)
+    return total
+
+async def stream_sharded(workload, rate_limit, tag_targets=False, concurrency=None, bulk_size=None, timeout=None):
+    """Run one Nuclei process per (targets, templates) shard and merge their event streams.
+
+    The rate_limit and concurrency budgets are divided evenly between the shards. Findings reported by
+    more than one shard are dropped by template-id + matched-at, and progress events
+    carry the index of the shard they came from.
+    """
+    shard_rate_limit = max(1, rate_limit // len(workload))
+    shard_concurrency = max(1, concurrency // len(workload)) if concurrency else None
+    queue = asyncio.Queue()
 
+    async def run_shard(index, shard_targets, shard_templates):
         try:
-            scan_result = run_nuclei(target, valid_templates, rate_limit)
-            response = {
-                "type": "scan_response",
-                "status": "success" if not scan_result.get("errors") else "error",
-                "results": scan_result.get("results", []),
-                "errors": scan_result.get("errors", []),
-                "templates_used": valid_templates if valid_templates else DEFAULT_TEMPLATES
-            }
-            return response
+            async for kind, payload in _stream_batch(shard_targets[0], shard_templates, shard_targets, shard_rate_limit,
+                                                     shard_concurrency, bulk_size, timeout):
+                if kind == "finding" and tag_targets and "target" not in payload:
+                    payload["target"] = shard_targets[0]
+                await queue.put((index, kind, payload))
         except Exception as e:
-            logging.error(f"Error during scan: {e}")
-            return {"type": "scan_response", "status": "error", "errors": [str(e)]}
-    
-    elif request.get("type") == "suggest_templates":
+            logging.error(f"Nuclei shard {index} failed: {e}")
+            await queue.put((index, "summary", {"findings": 0, "severity_counts": {}, "errors": [str(e)],
+                                                 "templates_used": [], "return_code": None}))
+        finally:
+            await queue.put((index, None, None))
+
+    logging.info(f"Splitting scan into {len(workload)} Nuclei shards at {shard_rate_limit} requests/s each")
+    tasks = [asyncio.create_task(run_shard(index, shard_targets, shard_templates))
+             for index, (shard_targets, shard_templates) in enumerate(workload)]
+    seen = set()
+    duplicates = 0
+    severity_counts = {}
+    target_counts = {}
+    shard_summaries = [None] * len(workload)
+    running = len(tasks)
+    try:
+        while running:
+            index, kind, payload = await queue.get()
+            if kind is None:
+                running -= 1
+            elif kind == "summary":
+                shard_summaries[index] = payload
+            elif kind == "finding":
+                key = (payload.get("template-id"), payload.get("matched-at"))
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                severity = payload.get("info", {}).get("severity", "unknown")
+                severity_counts[severity] = severity_counts.get(severity, 0) + 1
+                if tag_targets:
+                    target_counts[payload["target"]] = target_counts.get(payload["target"], 0) + 1
+                yield "finding", payload
+            elif kind == "progress":
+                yield "progress", dict(payload, shard=index)
+            else:
+                yield kind, payload
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    errors = []
+    templates_used = []
+    return_code = 0
+    timings = {}
+    for summary in shard_summaries:
+        summary = summary or {"errors": ["Nuclei shard produced no summary"], "templates_used": [], "return_code": None}
+        add_timings(timings, summary.get("timings"))
+        errors.extend(summary["errors"])
+        templates_used.extend(t for t in summary["templates_used"] if t not in templates_used)
+        if summary["return_code"] != 0 and return_code == 0:
+            return_code = summary["return_code"]
+    summary = {
+        "findings": len(seen),
+        "severity_counts": severity_counts,
+        "errors": errors,
+        "templates_used": templates_used,
+        "return_code": return_code,
+        "shards": len(workload),
+        "duplicates": duplicates,
+        "timings": timings
+    }
+    if tag_targets:
+        summary["targets"] = target_counts
+    yield "summary", summary
+
+def merge_summaries(summaries):
+    """Add up the summaries of several Nuclei runs that make up one scan."""
+    merged = {"findings": 0, "severity_counts": {}, "errors": [], "templates_used": [], "return_code": 0}
+    for summary in summaries:
+        merged["findings"] += summary["findings"]
+        for severity, count in summary["severity_counts"].items():
+            merged["severity_counts"][severity] = merged["severity_counts"].get(severity, 0) + count
+        merged["errors"].extend(summary["errors"])
+        merged["templates_used"].extend(t for t in summary["templates_used"] if t not in merged["templates_used"])
+        if summary["return_code"] != 0 and merged["return_code"] == 0:
+            merged["return_code"] = summary["return_code"]
+        if "targets" in summary:
+            target_counts = merged.setdefault("targets", {})
+            for name, count in summary["targets"].items():
+                target_counts[name] = target_counts.get(name, 0) + count
+        if "duplicates" in summary:
+            merged["duplicates"] = merged.get("duplicates", 0) + summary["duplicates"]
+        if "timings" in summary:
+            add_timings(merged.setdefault("timings", {}), summary["timings"])
+    return merged
+
+async def run_nuclei(target, templates=None, rate_limit=50, targets=None, shards=1):
+    """Run Nuclei and collect the streamed events into a single result."""
+    results = []
+    errors = []
+    templates_used = []
+    async for kind, payload in stream_nuclei(target, templates, rate_limit, targets, shards):
+        if kind == "finding":
+            results.append(payload)
+        elif kind == "summary":
+            errors = payload["errors"]
+            templates_used = payload["templates_used"]
+    return {"results": results, "errors": errors, "templates_used": templates_used}
+
+async def select_templates(target, templates=None, use_deepseek=True, vulnerability_type="http"):
+    """Choose template directories for a scan, asking DeepSeek when none are given."""
+    valid_templates = []
+    if templates:
+        valid_templates = templates
+    elif use_deepseek:
+        prompt = (
+            f"For the target {target}, suggest a JSON array of Nuclei template directories "
+            f"suitable for scanning {vulnerability_type} vulnerabilities. "
+            "Examples include [\"http/technologies/\", \"http/exposures/\", \"http/vulnerabilities/\", \"http/misconfiguration/\", \"http/cves/\"]. "
+            "Ensure the response is a valid JSON array containing only directory paths ending with '/'. "
+            "Do not include explanations or additional text outside the JSON array."
+        )
+        template_list = await suggest_with_cache(target, vulnerability_type, prompt)
+        if template_list:
+            valid_templates.extend(template_list)
+            logging.info(f"DeepSeek suggested templates for {vulnerability_type}: {template_list}")
+        else:
+            logging.warning("DeepSeek failed to suggest templates, using default templates")
+            valid_templates.extend(DEFAULT_TEMPLATES)
+    return valid_templates
+
+def narrow_templates(directories, severity=None, tags=None, exclude_tags=None, technologies=None):
+    """Resolve template directories to the individual templates passing the severity, tag and technology filters.
+
+    Returns (templates, pruned): the template files to run and how many templates in
+    the directories the filters removed.
+    """
+    under = [d for d in directories if template_index.exists(d)]
+    if not under:
+        under = [d for d in DEFAULT_TEMPLATES if template_index.exists(d)]
+    candidates = template_index.find(under=under)
+    selected = template_index.find(tags=tags, min_severity=severity, under=under,
+                                   exclude_tags=exclude_tags, technologies=technologies)
+    return [entry["path"] for entry in selected], len(candidates) - len(selected)
+
+async def stream_fingerprint(target, targets, request, shards=1):
+    """Run the two-phase pipeline: technology detection, then only the templates for what was found.
+
+    Detected technologies are mapped through fingerprint.TECHNOLOGY_TEMPLATES to template
+    tags, which select templates in TARGETED_DIRECTORIES (FALLBACK_DIRECTORIES when
+    nothing was recognised). Both phases go through stream_nuclei; the summary covers both.
+    """
+    rate_limit = request.get("rate_limit", 50)
+    detections = []
+    first = None
+    tuning = {"concurrency": request.get("concurrency"), "bulk_size": request.get("bulk_size")}
+    async for kind, payload in stream_nuclei(target, FINGERPRINT_TEMPLATES, rate_limit, targets, shards, **tuning):
+        if kind == "summary":
+            first = payload
+            continue
+        if kind == "finding":
+            detections.append(payload)
+        elif kind == "progress":
+            payload = dict(payload, phase="fingerprint")
+        yield kind, payload
+
+    technologies = detect_technologies(detections)
+    tags = technology_tags(set(technologies) | set(request.get("technologies") or []))
+    directories = TARGETED_DIRECTORIES if tags else FALLBACK_DIRECTORIES
+    templates, templates_pruned = await asyncio.to_thread(narrow_templates, directories, request.get("severity"),
+                                                          request.get("tags"), request.get("exclude_tags"), tags or None)
+    logging.info(f"Fingerprint found {technologies or 'no technologies'}, "
+                 f"selected {len(templates)} templates under {directories}")
+    yield "progress", {"status": "fingerprinted", "technologies": technologies,
+                       "templates": len(templates), "pruned": templates_pruned}
+
+    summary = dict(first, templates_used=list(FINGERPRINT_TEMPLATES), technologies=technologies,
+                   templates_selected=0, templates_pruned=templates_pruned)
+    if not templates:
+        yield "summary", summary
+        return
+    if request.get("incremental"):
+        stream = stream_incremental(target, targets, templates, request, shards)
+    else:
+        stream = stream_nuclei(target, templates, rate_limit, targets, shards, **tuning)
+    async for kind, payload in stream:
+        if kind == "summary":
+            second = payload
+            continue
+        if kind == "progress":
+            payload = dict(payload, phase="targeted")
+        yield kind, payload
+
+    summary.update(second, **merge_summaries([first, second]))
+    summary.update(templates_used=FINGERPRINT_TEMPLATES + directories, templates_selected=len(templates))
+    yield "summary", summary
+
+async def stream_incremental(target, targets, templates, request, shards=1):
+    """Rescan only the templates each target has not run before, that changed, or that ran too long ago.
+
+    Targets due for the same templates share one Nuclei run. What was run is recorded in
+    scan_state once Nuclei exits cleanly, and the stored findings of the templates that
+    were skipped are replayed with "carried_over" set and counted in the summary.
+    """
+    rate_limit = request.get("rate_limit", 50)
+    stale_after = request.get("stale_after")
+    entries = await asyncio.to_thread(template_index.find, under=templates or DEFAULT_TEMPLATES)
+    if not entries:
+        yield "error", "No valid templates available for scan"
+        yield "summary", {"findings": 0, "severity_counts": {}, "errors": ["No valid templates available for scan"],
+                          "templates_used": [], "return_code": None}
+        return
+    by_path = {entry["path"]: entry for entry in entries}
+    groups = {}
+    for name in targets:
+        due = await asyncio.to_thread(scan_state.plan, name, entries, stale_after)
+        groups.setdefault(tuple(entry["path"] for entry in due), []).append(name)
+    rerun_count = sum(len(paths) * len(names) for paths, names in groups.items())
+    yield "progress", {"status": "incremental", "templates": len(entries), "runs": sum(1 for p in groups if p),
+                       "rerun": rerun_count, "skipped": len(entries) * len(targets) - rerun_count}
+
+    tag_targets = len(targets) > 1
+    summaries = []
+    rerun = {}
+    for paths, names in groups.items():
+        if not paths:
+            continue
+        run_entries = [by_path[path] for path in paths]
+        found = {name: [] for name in names}
+        run_at = time.time()
+        summary = None
+        async for kind, payload in stream_nuclei(names[0], list(paths), rate_limit, names, shards,
+                                                 request.get("concurrency"), request.get("bulk_size")):
+            if kind == "summary":
+                summary = payload
+                continue
+            if kind == "finding":
+                if tag_targets:
+                    payload.setdefault("target", names[0])
+                found.setdefault(payload.get("target", names[0]), []).append(payload)
+            yield kind, payload
+        summaries.append(summary)
+        template_ids = {entry["id"] for entry in run_entries}
+        for name in names:
+            rerun[name] = template_ids
+            if summary["return_code"] == 0:
+                await asyncio.to_thread(scan_state.record, name, run_entries, found.get(name, []), run_at)
+
+    carried = {"findings": 0, "severity_counts": {}, "errors": [], "templates_used": [], "return_code": 0}
+    if tag_targets:
+        carried["targets"] = {}
+    all_ids = {entry["id"] for entry in entries}
+    for name in targets:
+        skipped = all_ids - rerun.get(name, set())
+        for finding in await asyncio.to_thread(scan_state.carried_over, name, skipped):
+            carried["findings"] += 1
+            severity = finding.get("info", {}).get("severity", "unknown")
+            carried["severity_counts"][severity] = carried["severity_counts"].get(severity, 0) + 1
+            if tag_targets:
+                finding["target"] = name
+                carried["targets"][name] = carried["targets"].get(name, 0) + 1
+            yield "finding", finding
+
+    summary = merge_summaries(summaries + [carried])
+    summary.update(templates_used=list(templates or DEFAULT_TEMPLATES), templates_rerun=rerun_count,
+                   templates_skipped=len(entries) * len(targets) - rerun_count, carried_over=carried["findings"])
+    yield "summary", summary
+
+def plan_checkpoint(checkpoint_id, request, templates):
+    """Split a scan's templates into chunks and start a checkpoint for them.
+
+    Returns the new checkpoint, or None when one chunk holds every template and the
+    scan runs as a single Nuclei process.
+    """
+    paths = [entry["path"] for entry in template_index.find(under=templates or DEFAULT_TEMPLATES)]
+    chunks = chunk_templates(paths, CHECKPOINT_CHUNK_SIZE)
+    if len(chunks) <= 1:
+        return None
+    checkpoints.create(checkpoint_id, request, chunks)
+    return checkpoints.get(checkpoint_id)
+
+async def stream_checkpointed(target, targets, checkpoint, request, shards=1):
+    """Run a checkpoint's unfinished template chunks one Nuclei run at a time, recording each finished chunk.
+
+    Findings of chunks finished by an earlier run are replayed first, marked as carried
+    over. All chunks share one NUCLEI_TIMEOUT budget; when it runs out, or a chunk
+    fails, the summary marks the scan resumable and a request with resume=<checkpoint id>
+    continues with the chunks left. The checkpoint is deleted once every chunk is done.
+    """
+    checkpoint_id = checkpoint["checkpoint_id"]
+    chunks = checkpoint["chunks"]
+    done = set(checkpoint["done"])
+    tag_targets = len(targets) > 1
+    yield "progress", {"status": "checkpoint", "checkpoint": checkpoint_id, "chunks": len(chunks), "done": len(done)}
+
+    carried = {"findings": 0, "severity_counts": {}, "errors": [], "templates_used": [], "return_code": 0}
+    if tag_targets:
+        carried["targets"] = {}
+    for index in sorted(done):
+        findings = await asyncio.to_thread(list, checkpoints.findings(checkpoint_id, index))
+        for finding in replayed(findings, checkpoint["done"][index]):
+            carried["findings"] += 1
+            severity = finding.get("info", {}).get("severity", "unknown")
+            carried["severity_counts"][severity] = carried["severity_counts"].get(severity, 0) + 1
+            if tag_targets:
+                carried["targets"][finding.get("target")] = carried["targets"].get(finding.get("target"), 0) + 1
+            yield "finding", finding
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + NUCLEI_TIMEOUT
+    summaries = []
+    for index, chunk in enumerate(chunks):
+        if index in done:
+            continue
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        found = []
+        summary = None
+        async for kind, payload in stream_nuclei(target, chunk, request.get("rate_limit", 50), targets, shards,
+                                                 request.get("concurrency"), request.get("bulk_size"), remaining):
+            if kind == "summary":
+                summary = payload
+                continue
+            if kind == "finding":
+                found.append(payload)
+            elif kind == "progress":
+                payload = dict(payload, chunk=index)
+            yield kind, payload
+        summaries.append(summary)
+        if summary["return_code"] == 0:
+            done.add(index)
+            await asyncio.to_thread(checkpoints.complete_chunk, checkpoint_id, index, found)
+
+    left = len(chunks) - len(done)
+    summary = merge_summaries(summaries + [carried])
+    if left:
+        logging.warning(f"Checkpoint {checkpoint_id}: {left} of {len(chunks)} template chunks left to resume")
+        if not summary["errors"]:
+            summary["errors"].append(f"Scan stopped with {left} of {len(chunks)} template chunks left")
+            yield "error", summary["errors"][-1]
+    else:
+        await asyncio.to_thread(checkpoints.delete, checkpoint_id)
+    summary.update(templates_used=list(checkpoint["request"].get("templates") or DEFAULT_TEMPLATES),
+                   carried_over=carried["findings"], resumable=bool(left),
+                   checkpoint={"id": checkpoint_id, "chunks": len(chunks), "chunks_done": len(done), "targets": targets})
+    yield "summary", summary
+
+async def process_request(request):
+    """Process MCP suggest request. Scan requests are streamed by stream_scan."""
+    if request.get("type") == "suggest_templates":
         target = request.get("target")
         vulnerability_type = request.get("vulnerability_type", "http")
         if not target:
@@ -391,7 +923,7 @@ def process_request(request):
             "Ensure the response is a valid JSON array containing only directory paths ending with '/'. "
             "Do not include explanations or additional text outside the JSON array."
         )
-        template_list = call_deepseek(prompt)
+        template_list = await suggest_with_cache(target, vulnerability_type, prompt)
         if template_list:
             return {
                 "type": "suggest_response",
@@ -407,26 +939,261 @@ def process_request(request):
     else:
         return {"type": "response", "status": "error", "errors": ["Invalid request type"]}
 
+async def stream_scan(request, job_id=None):
+    """Run a scan request and stream it as SSE events: progress, finding, error, then summary.
+
+    Scans sent with checkpoint=true and more templates than CHECKPOINT_CHUNK_SIZE are
+    checkpointed under the job ID, so a job requeued after a crash, or a request with
+    resume=<checkpoint id>, continues with the template chunks that did not finish. The summary's timings give
+    the seconds spent in each phase of the scan, and the scan is counted in /metrics.
+    """
+    timer = PhaseTimer(scan_phase_seconds)
+    with scans_in_flight.track():
+        async for event in _stream_scan(request, job_id, timer):
+            if event["event"] == "summary":
+                summary = json.loads(event["data"])
+                summary["timings"] = {**summary.get("timings", {}), **timer.breakdown()}
+                scans_total.inc(status=summary.get("status", "error"))
+                event = {"event": "summary", "data": json.dumps(summary)}
+            yield event
+
+async def _stream_scan(request, job_id, timer):
+    checkpoint = await asyncio.to_thread(checkpoints.get, request.get("resume") or job_id)
+    if request.get("resume") and not checkpoint:
+        yield {"event": "summary", "data": json.dumps(
+            {"type": "scan_response", "status": "error", "findings": 0,
+             "errors": [f"Checkpoint not found: {request['resume']}"]})}
+        return
+    if checkpoint:
+        # Continue with the request the scan was started with
+        request = dict(checkpoint["request"], resume=checkpoint["checkpoint_id"])
+    scan_request = request
+    targets = parse_targets(request.get("target"), request.get("targets"), request.get("targets_file"))
+    if not targets:
+        yield {"event": "summary", "data": json.dumps(
+            {"type": "scan_response", "status": "error", "findings": 0, "errors": ["Missing target"]})}
+        return
+    target = targets[0]
+    shards = max(1, min(request.get("shards") or NUCLEI_SHARDS, MAX_CONCURRENT_SCANS))
+    if request.get("adaptive", True):
+        tuning = await asyncio.to_thread(rate_controller.settings, targets, request.get("rate_limit") or 50,
+                                         request.get("max_rate"))
+        request = dict(request, rate_limit=tuning["rate_limit"],
+                       concurrency=request.get("concurrency") or tuning["concurrency"],
+                       bulk_size=request.get("bulk_size") or tuning["bulk_size"])
+        yield {"event": "progress", "data": json.dumps({"status": "rate_selected", **tuning})}
+
+    if checkpoint:
+        # The checkpoint holds the template chunks, so templates are not selected again
+        stream = stream_checkpointed(target, targets, checkpoint, request, shards)
+        async for event in _stream_scan_events(observe_rate(stream, targets, request)):
+            yield event
+        return
+
+    if request.get("fingerprint"):
+        # The templates come from the detected technologies, so DeepSeek is not consulted
+        stream = stream_fingerprint(target, targets, request, shards)
+        async for event in _stream_scan_events(observe_rate(stream, targets, request)):
+            yield event
+        return
+
+    # A batch shares one template set; the first target stands in for the DeepSeek prompt
+    with timer.phase("template_selection"):
+        valid_templates = await select_templates(
+            target,
+            request.get("templates", None),
+            request.get("use_deepseek", True),
+            request.get("vulnerability_type", "http")
+        )
+    directories = valid_templates
+    templates_pruned = 0
+    filters = {k: request.get(k) for k in ("severity", "tags", "exclude_tags", "technologies")}
+    if any(filters.values()):
+        with timer.phase("template_filtering"):
+            valid_templates, templates_pruned = await asyncio.to_thread(narrow_templates, directories, **filters)
+        logging.info(f"Template filters {filters} kept {len(valid_templates)} templates, pruned {templates_pruned}")
+        if not valid_templates:
+            yield {"event": "summary", "data": json.dumps(
+                {"type": "scan_response", "status": "error", "findings": 0, "templates_pruned": templates_pruned,
+                 "errors": ["No templates match the requested filters"]})}
+            return
+        yield {"event": "progress", "data": json.dumps(
+            {"status": "templates_selected", "templates": len(valid_templates), "pruned": templates_pruned})}
+
+    if request.get("checkpoint") and not request.get("incremental"):
+        # Chunks run one after another, so only scans that asked to be resumable are split
+        checkpoint = await asyncio.to_thread(plan_checkpoint, job_id or str(uuid.uuid4()),
+                                             dict(scan_request, templates=directories), valid_templates)
+    if request.get("incremental"):
+        stream = stream_incremental(target, targets, valid_templates, request, shards)
+    elif checkpoint:
+        stream = stream_checkpointed(target, targets, checkpoint, request, shards)
+    else:
+        stream = stream_nuclei(target, valid_templates, request.get("rate_limit", 50), targets, shards,
+                               request.get("concurrency"), request.get("bulk_size"))
+    if valid_templates is not directories:
+        # Report the directories rather than every selected template file
+        extra = {"templates_used": directories or DEFAULT_TEMPLATES, "templates_selected": len(valid_templates),
+                 "templates_pruned": templates_pruned}
+    else:
+        extra = {"templates_pruned": templates_pruned}
+    async for event in _stream_scan_events(observe_rate(stream, targets, request), extra):
+        yield event
+
+async def observe_rate(stream, targets, request):
+    """Pass scan events through; with adaptive on, learn the hosts' rates from them before the summary."""
+    observation = ScanObservation()
+    async for kind, payload in stream:
+        if kind == "summary":
+            payload = dict(payload, rate_limit=request.get("rate_limit", 50))
+            if request.get("adaptive", True):
+                payload["rate_control"] = await asyncio.to_thread(
+                    rate_controller.record, targets, request.get("rate_limit", 50), observation)
+        else:
+            observation.observe(kind, payload)
+        yield kind, payload
+
+async def _stream_scan_events(stream, extra=None):
+    """Turn (kind, payload) scan events into SSE events, completing the summary as a scan_response."""
+    try:
+        async for kind, payload in stream:
+            if kind == "summary":
+                payload = {
+                    "type": "scan_response",
+                    "status": "success" if not payload["errors"] else "error",
+                    **payload,
+                    "templates_used": payload["templates_used"] or DEFAULT_TEMPLATES,
+                    **(extra or {})
+                }
+            yield {"event": kind, "data": json.dumps(payload)}
+    except Exception as e:
+        logging.error(f"Error during scan: {e}")
+        yield {"event": "error", "data": json.dumps(str(e))}
+        yield {"event": "summary", "data": json.dumps(
+            {"type": "scan_response", "status": "error", "findings": 0, "errors": [str(e)]})}
+
 async def stream_response(response_data):
     """Stream response as SSE events."""
     yield {"event": "response", "data": json.dumps(response_data)}
 
 @app.post("/scan")
 async def scan(request: ScanRequest):
-    """Handle scan requests."""
+    """Handle scan requests, streaming each finding as soon as Nuclei reports it."""
     if request.type != "scan_request":
         raise HTTPException(status_code=400, detail="Invalid request type")
-    response = process_request(request.model_dump())
-    return EventSourceResponse(stream_response(response))
+    return EventSourceResponse(stream_scan(request.model_dump()))
 
 @app.post("/suggest")
 async def suggest(request: SuggestRequest):
     """Handle template suggestion requests."""
     if request.type != "suggest_templates":
         raise HTTPException(status_code=400, detail="Invalid request type")
-    response = process_request(request.model_dump())
+    response = await process_request(request.model_dump())
     return EventSourceResponse(stream_response(response))
 
+job_manager = JobManager(JobStore(JOBS_DB), stream_scan, workers=NUCLEI_WORKERS, max_queued=MAX_QUEUED_JOBS,
+                         retention=JOB_RETENTION_HOURS * 3600)
+_template_index_task = None
+
+async def refresh_template_index():
+    """Re-scan the templates directory periodically; unchanged files are not parsed again."""
+    while True:
+        await asyncio.sleep(TEMPLATE_INDEX_REFRESH)
+        try:
+            await asyncio.to_thread(template_index.refresh)
+        except Exception as e:
+            logging.error(f"Error refreshing template index: {e}")
+
+@app.on_event("startup")
+async def start_job_workers():
+    global _template_index_task
+    await asyncio.to_thread(template_index.refresh)
+    _template_index_task = asyncio.create_task(refresh_template_index())
+    await job_manager.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_manager.stop()
+    if _template_index_task is not None:
+        _template_index_task.cancel()
+    if _deepseek_client is not None:
+        await _deepseek_client.aclose()
+
+@app.get("/status")
+async def status_endpoint():
+    """Health check reporting the agent's load, which a UI spreading scans over several agents balances on."""
+    jobs = job_manager.stats()
+    return {
+        "status": "ok",
+        # Scans being run (jobs and direct /scan streams) plus jobs waiting for a worker
+        "scans_in_flight": int(scans_in_flight.get()) + jobs["queued"],
+        "jobs": jobs,
+        "max_concurrent_scans": MAX_CONCURRENT_SCANS
+    }
+
+@app.get("/stats/deepseek")
+async def deepseek_stats_endpoint():
+    """Report DeepSeek connection reuse."""
+    return deepseek_connection_stats()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Expose scan, finding, timeout and DeepSeek metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/rates")
+async def rate_stats_endpoint(limit: int = 100):
+    """Report the learned per-host Nuclei rates, most recently updated first."""
+    return {"hosts": await asyncio.to_thread(rate_controller.list_rates, limit)}
+
+@app.get("/templates")
+async def list_templates(tag: Optional[List[str]] = Query(None), severity: Optional[str] = None,
+                         protocol: Optional[str] = None, under: Optional[List[str]] = Query(None), limit: int = 100):
+    """Query the template index, e.g. /templates?tag=wordpress&severity=high&under=http/cves."""
+    matches = await asyncio.to_thread(template_index.find, tags=tag, min_severity=severity, protocol=protocol,
+                                      under=under)
+    stats = await asyncio.to_thread(template_index.stats, under=under)
+    return {
+        "type": "templates_response",
+        "status": "success",
+        "count": len(matches),
+        "stats": stats,
+        "templates": [{k: v for k, v in entry.items() if k != "mtime"} for entry in matches[:limit]]
+    }
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: ScanRequest):
+    """Queue a scan and return its job ID immediately."""
+    if request.type != "scan_request":
+        raise HTTPException(status_code=400, detail="Invalid request type")
+    try:
+        job_id = await job_manager.submit(request.model_dump())
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, results: bool = False):
+    """Return the state of a scan job, optionally with its findings."""
+    job = await asyncio.to_thread(job_manager.store.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if results:
+        events = await asyncio.to_thread(job_manager.store.events, job_id, 0, -1)
+        job["results"] = [json.loads(e["data"]) for e in events if e["event"] == "finding"]
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, after: int = 0):
+    """Stream a job's events from the start, or after the SSE Last-Event-ID on reconnect."""
+    job = await asyncio.to_thread(job_manager.store.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+    return EventSourceResponse(job_manager.follow(job_id, after))
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
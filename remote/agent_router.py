@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from suggestion_cache import normalize_host
+
+class AgentRouter:
+    """Spreads scans over several agent endpoints, by the load each agent reports on /status.
+
+    A background thread checks every agent's /status each health_interval seconds; an
+    agent that fails the check, or a request, is left out until it passes again. Scans
+    go to the healthy agent with the fewest scans in flight per job worker, counting the
+    scans sent to it since its last report. With pin_targets, a target host always goes
+    to the same healthy agent (rendezvous hashing), so its suggestion cache, learned
+    rates and incremental state stay on one agent; pinning gives way when that agent is
+    more than pin_slack scans busier than the least-loaded one.
+    """
+
+    def __init__(self, urls, health_interval=10, timeout=5, pin_targets=False, pin_slack=4):
+        self.urls = list(dict.fromkeys(url.rstrip("/") for url in urls))
+        self.health_interval = health_interval
+        self.timeout = timeout
+        self.pin_targets = pin_targets
+        self.pin_slack = pin_slack
+        self.lock = threading.Lock()
+        # Agents count as healthy until a check or a request says otherwise
+        self.agents = {url: {"url": url, "healthy": True, "scans_in_flight": 0, "workers": 1, "dispatched": 0,
+                             "checked_at": None, "error": None} for url in self.urls}
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        """Check every agent now and then every health_interval seconds in the background; runs once."""
+        with self.start_lock:
+            if self.thread is not None:
+                return
+            self.check_all()
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            self.check_all()
+
+    def check_all(self):
+        with ThreadPoolExecutor(max_workers=min(len(self.urls), 16) or 1) as executor:
+            list(executor.map(self.check, self.urls))
+
+    def check(self, url):
+        """Read one agent's /status and record its health and load."""
+        try:
+            response = requests.get(f"{url}/status", timeout=self.timeout)
+            response.raise_for_status()
+            status = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self.mark_failed(url, e)
+            return
+        with self.lock:
+            agent = self.agents[url]
+            if not agent["healthy"]:
+                logging.info(f"Agent {url} is healthy again")
+            agent.update(healthy=True, error=None, checked_at=time.time(), dispatched=0,
+                         scans_in_flight=status.get("scans_in_flight", 0),
+                         workers=max(1, (status.get("jobs") or {}).get("workers", 1)))
+
+    def mark_failed(self, url, error):
+        with self.lock:
+            agent = self.agents[url]
+            if agent["healthy"]:
+                logging.warning(f"Agent {url} marked unhealthy: {error}")
+            agent.update(healthy=False, error=str(error), checked_at=time.time())
+
+    def choose(self, target=None, exclude=(), prefer=None):
+        """Return the URL of the agent for a scan of target, or None when no healthy agent is left.
+
+        prefer (e.g. the agent holding a scan's checkpoint) wins while it is healthy.
+        The chosen agent's load is raised right away so concurrent choices spread out.
+        """
+        with self.lock:
+            candidates = [a for a in self.agents.values() if a["healthy"] and a["url"] not in exclude]
+            if not candidates:
+                return None
+            chosen = min(candidates, key=_load)
+            preferred = next((a for a in candidates if a["url"] == prefer), None)
+            if preferred:
+                chosen = preferred
+            elif self.pin_targets and target:
+                host = normalize_host(target)
+                pinned = max(candidates, key=lambda a: hashlib.sha1(f"{a['url']}|{host}".encode()).digest())
+                if _pending(pinned) - _pending(chosen) <= self.pin_slack:
+                    chosen = pinned
+            chosen["dispatched"] += 1
+            return chosen["url"]
+
+    def snapshot(self):
+        with self.lock:
+            return [dict(agent, load=round(_load(agent), 2)) for agent in self.agents.values()]
+
+def _pending(agent):
+    return agent["scans_in_flight"] + agent["dispatched"]
+
+def _load(agent):
+    return _pending(agent) / agent["workers"]
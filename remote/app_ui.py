@@ -4,9 +4,16 @@ import logging
 import uuid
 import datetime
 import os
+import time
 import requests
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response
 from sseclient import SSEClient
+from history_store import HistoryStore, PENDING
+from batch_targets import parse_targets
+from metrics import Registry
+from scheduler import ScheduleStore, Scheduler
+from agent_router import AgentRouter
+from live_scans import LiveScans, ScanDispatcher, ScanQueueFull
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -14,56 +21,318 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Agent API configuration
 AGENT_API_URL = os.getenv("AGENT_API_URL", "http://agent:8000")
 HISTORY_FILE = "scan_history.json"
+HISTORY_DB = os.getenv("HISTORY_DB", "scan_history.db")
+JOB_STREAM_RETRIES = int(os.getenv("JOB_STREAM_RETRIES", "5"))
+JOB_STREAM_RETRY_DELAY = 2
+# (connect, read) timeouts for event streams; the agent sends a keep-alive ping every 15 seconds
+STREAM_TIMEOUT = (10, 60)
+# Suggestions answer only once DeepSeek has, which may take several retries
+SUGGEST_TIMEOUT = (10, 600)
+# Several agents, comma-separated; each scan goes to the healthy agent with the fewest scans in flight
+AGENT_API_URLS = [url.strip() for url in os.getenv("AGENT_API_URLS", AGENT_API_URL).split(",") if url.strip()]
+AGENT_HEALTH_INTERVAL = int(os.getenv("AGENT_HEALTH_INTERVAL", "10"))
+# 1 sends each target host to the same agent, so its caches and learned rates stay on one agent
+AGENT_PIN_TARGETS = os.getenv("AGENT_PIN_TARGETS", "0") == "1"
 
-def load_history():
-    """Đọc lịch sử quét từ file JSON."""
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, "r") as f:
-                return json.load(f)
-        except Exception as e:
-            logging.error(f"Error loading history: {e}")
-            return []
-    return []
+agent_router = AgentRouter(AGENT_API_URLS, health_interval=AGENT_HEALTH_INTERVAL, pin_targets=AGENT_PIN_TARGETS)
+
+history_store = HistoryStore(HISTORY_DB)
+history_store.import_json(HISTORY_FILE)
+
+# Lần quét gửi từ form chạy nền trên dispatcher; trang kết quả theo dõi finding qua live_scans
+UI_SCAN_WORKERS = int(os.getenv("UI_SCAN_WORKERS", "8"))
+UI_MAX_QUEUED_SCANS = int(os.getenv("UI_MAX_QUEUED_SCANS", "100"))
+scan_dispatcher = ScanDispatcher(UI_SCAN_WORKERS, max_queued=UI_MAX_QUEUED_SCANS)
+live_scans = LiveScans()
+
+# Metrics của giao diện; metrics của agent được lấy trực tiếp từ /metrics của agent
+metrics = Registry()
+ui_phase_seconds = metrics.histogram("nuclei_ui_phase_seconds", "Time spent by the UI on each scan phase", ["phase"])
+ui_scans_total = metrics.counter("nuclei_ui_scans_total", "Scans submitted from the UI, by status", ["status"])
+ui_scans_in_flight = metrics.gauge("nuclei_ui_scans_in_flight", "UI scans waiting for the agent")
 
 def save_history(scan_data):
     """Lưu yêu cầu và phản hồi quét vào lịch sử."""
-    history = load_history()
-    history.append(scan_data)
     try:
-        with open(HISTORY_FILE, "w") as f:
-            json.dump(history, f, indent=2)
+        with ui_phase_seconds.time(phase="save_history"):
+            history_store.save_scan(scan_data)
     except Exception as e:
         logging.error(f"Error saving history: {e}")
 
-def send_request(request_data):
-    """Send request to agent via SSE."""
+def new_scans(request_data, targets):
+    """Tạo bản ghi lịch sử cho một lần quét: một bản ghi, hoặc một bản ghi cho mỗi mục tiêu của batch (chung batch_id)."""
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if len(targets) == 1:
+        return [{"scan_id": str(uuid.uuid4()), "timestamp": timestamp, "request": request_data}]
+    batch_id = str(uuid.uuid4())
+    scans = []
+    for target in targets:
+        scan_request = {k: v for k, v in request_data.items() if k not in ("targets", "targets_file")}
+        scan_request.update(target=target, batch_id=batch_id)
+        scans.append({"scan_id": str(uuid.uuid4()), "timestamp": timestamp, "request": scan_request})
+    return scans
+
+def split_results(scans, findings):
+    """Chia finding theo mục tiêu của từng bản ghi; finding không rõ mục tiêu thuộc về bản ghi đầu tiên."""
+    if len(scans) == 1:
+        return [list(findings)]
+    index = {scan_data["request"]["target"]: i for i, scan_data in enumerate(scans)}
+    results = [[] for _ in scans]
+    for finding in findings:
+        results[index.get(finding.get("target"), 0)].append(finding)
+    return results
+
+def follow_job(job_id, agent_url, on_event=None):
+    """Collect a scan job's events into a scan_response, reconnecting after dropped streams.
+
+    Finding and progress events are also passed to on_event(event, data) as they arrive,
+    and "restart" when the agent reruns the job from the start after a restart.
+    Returns (scan_response, findings), with scan_response None if the agent stays unreachable.
+    """
+    results = []
+    last_event_id = None
+    for attempt in range(JOB_STREAM_RETRIES + 1):
+        try:
+            headers = {"Last-Event-ID": last_event_id} if last_event_id else {}
+            response = requests.get(f"{agent_url}/jobs/{job_id}/events", headers=headers, stream=True,
+                                    timeout=STREAM_TIMEOUT)
+            response.raise_for_status()
+
+            client = SSEClient(response)
+            for event in client.events():
+                if event.id:
+                    last_event_id = event.id
+                if event.event == "finding":
+                    results.append(json.loads(event.data))
+                    if on_event:
+                        on_event("finding", results[-1])
+                elif event.event == "progress" and on_event:
+                    on_event("progress", json.loads(event.data))
+                elif event.event == "reset":
+                    # Agent khởi động lại và chạy lại job từ đầu, bỏ các finding đã nhận
+                    results = []
+                    if on_event:
+                        on_event("restart", json.loads(event.data))
+                elif event.event == "summary":
+                    summary = json.loads(event.data)
+                    return {
+                        "type": "scan_response",
+                        "status": summary.get("status", "error"),
+                        "results": results,
+                        "errors": summary.get("errors", []),
+                        "templates_used": summary.get("templates_used", []),
+                        "templates_pruned": summary.get("templates_pruned", 0),
+                        "templates_selected": summary.get("templates_selected"),
+                        "technologies": summary.get("technologies"),
+                        "templates_rerun": summary.get("templates_rerun"),
+                        "templates_skipped": summary.get("templates_skipped"),
+                        "carried_over": summary.get("carried_over"),
+                        "rate_limit": summary.get("rate_limit"),
+                        "rate_control": summary.get("rate_control"),
+                        "resumable": summary.get("resumable"),
+                        "checkpoint": summary.get("checkpoint"),
+                        "timings": summary.get("timings"),
+                        "job_id": job_id,
+                        "agent": agent_url
+                    }, results
+        except requests.RequestException as e:
+            logging.warning(f"Lost event stream for job {job_id} (attempt {attempt + 1}): {e}")
+        time.sleep(JOB_STREAM_RETRY_DELAY)
+    return None, results
+
+def send_request(request_data, prefer=None, on_event=None):
+    """Send request to an agent: scans are queued as jobs, suggestions are answered via SSE.
+
+    The agent is picked by agent_router (prefer names the agent to use while it is
+    healthy). When an agent cannot be reached, answers with a server error, its job
+    queue is full or it is lost while running the scan, the request is retried on
+    another agent. A scan's events go to on_event(event, data); "job" names each job
+    queued for it and "restart" means the findings so far are void.
+    """
+    if request_data["type"] not in ("scan_request", "suggest_templates"):
+        return {"type": "response", "status": "error", "errors": ["Invalid request type"]}
+    agent_router.start()
+    tried = []
+    errors = []
+    partial = None
+    while True:
+        agent_url = agent_router.choose(request_data.get("target"), exclude=tried, prefer=prefer)
+        if agent_url is None:
+            break
+        tried.append(agent_url)
+        try:
+            if request_data["type"] == "scan_request":
+                response = requests.post(f"{agent_url}/jobs", json=request_data, timeout=30)
+                if response.status_code == 503:
+                    # Hàng đợi của agent đã đầy, thử agent khác
+                    errors.append(f"{agent_url}: job queue is full")
+                    continue
+                response.raise_for_status()
+                job_id = response.json()["job_id"]
+                if on_event:
+                    on_event("job", {"job_id": job_id, "agent": agent_url})
+                if partial and on_event:
+                    # Chạy lại từ đầu trên agent khác, bỏ các finding của lần chạy bị mất
+                    on_event("restart", {"agent": agent_url})
+                result, results = follow_job(job_id, agent_url, on_event)
+                if result is not None:
+                    return result
+                agent_router.mark_failed(agent_url, f"lost while running job {job_id}")
+                errors.append(f"Lost connection to agent {agent_url} while following job {job_id}")
+                partial = {"job_id": job_id, "agent": agent_url, "results": results}
+                continue
+
+            response = requests.post(f"{agent_url}/suggest", json=request_data, stream=True, timeout=SUGGEST_TIMEOUT)
+            response.raise_for_status()
+            client = SSEClient(response)
+            for event in client.events():
+                if event.event == "response":
+                    return json.loads(event.data)
+            return {"type": "response", "status": "error", "errors": ["No response received"]}
+        except requests.HTTPError as e:
+            logging.error(f"Error sending request to agent {agent_url}: {e}")
+            if e.response is not None and e.response.status_code < 500:
+                # Lỗi 4xx là do yêu cầu, agent khác cũng sẽ từ chối
+                return {"type": "response", "status": "error", "errors": [str(e)]}
+            agent_router.mark_failed(agent_url, e)
+            errors.append(f"{agent_url}: {e}")
+        except requests.RequestException as e:
+            logging.error(f"Error sending request to agent {agent_url}: {e}")
+            agent_router.mark_failed(agent_url, e)
+            errors.append(f"{agent_url}: {e}")
+    if partial:
+        # Không còn agent nào để chạy lại: giữ các finding đã nhận được
+        return {"type": "scan_response", "status": "error", "errors": errors, **partial}
+    return {"type": "response", "status": "error", "errors": errors or ["No healthy agent available"]}
+
+def start_scan(request_data, targets):
+    """Lưu bản ghi "pending" cho lần quét và mở theo dõi trực tiếp; trả về các bản ghi."""
+    scans = new_scans(request_data, targets)
+    for scan_data in scans:
+        save_history(dict(scan_data, response={"type": "scan_response", "status": PENDING, "results": []}))
+    live_scans.open(scan_data["scan_id"] for scan_data in scans)
+    return scans
+
+def scan_listener(scans):
+    """Trả về on_event của một lần quét: chuyển finding và tiến độ đến live_scans, ghi job đang chạy vào bản ghi "pending"."""
+    scan_ids = {scan_data["request"]["target"]: scan_data["scan_id"] for scan_data in scans}
+    first_id = scans[0]["scan_id"]
+
+    def on_event(event, data):
+        if event == "finding":
+            live_scans.add(scan_ids.get(data.get("target"), first_id), data)
+        elif event == "progress":
+            for scan_id in scan_ids.values():
+                live_scans.progress(scan_id, data)
+        elif event == "restart":
+            for scan_id in scan_ids.values():
+                live_scans.restart(scan_id)
+        elif event == "job":
+            # Giao diện khởi động lại giữa chừng sẽ theo dõi tiếp job này (xem resume_pending)
+            for scan_data in scans:
+                save_history(dict(scan_data, response={"type": "scan_response", "status": PENDING, "results": [],
+                                                       **data}))
+
+    return on_event
+
+def save_results(scans, response):
+    """Lưu phản hồi vào lịch sử, thay cho các bản ghi "pending", và kết thúc theo dõi trực tiếp."""
+    ui_scans_total.inc(status=response.get("status", "error"))
+    for scan_data, findings in zip(scans, split_results(scans, response.get("results") or [])):
+        save_history(dict(scan_data, response=dict(response, results=findings)))
+        live_scans.close(scan_data["scan_id"], response.get("status", "error"))
+
+def finish_scan(request_data, scans, agent=None):
+    """Chạy lần quét đã có bản ghi "pending", chuyển finding đến trang kết quả khi nhận được, rồi lưu kết quả."""
     try:
-        if request_data["type"] == "scan_request":
-            endpoint = f"{AGENT_API_URL}/scan"
-        elif request_data["type"] == "suggest_templates":
-            endpoint = f"{AGENT_API_URL}/suggest"
+        with ui_scans_in_flight.track(), ui_phase_seconds.time(phase="agent_request"):
+            response = send_request(request_data, prefer=agent, on_event=scan_listener(scans))
+    except Exception as e:
+        logging.error(f"Error running scan: {e}")
+        response = {"type": "scan_response", "status": "error", "errors": [str(e)]}
+    logging.info("Nhận phản hồi: %s", response)
+    save_results(scans, response)
+    return response
+
+def reattach_scan(scans, job_id, agent_url):
+    """Theo dõi tiếp job của các bản ghi "pending" từ tiến trình giao diện trước đến khi xong, rồi lưu kết quả."""
+    try:
+        with ui_scans_in_flight.track():
+            response, results = follow_job(job_id, agent_url, scan_listener(scans))
+    except Exception as e:
+        logging.error(f"Error following job {job_id}: {e}")
+        response, results = None, []
+    if response is None:
+        response = {"type": "scan_response", "status": "error", "results": results, "job_id": job_id,
+                    "agent": agent_url, "errors": [f"Lost connection to agent {agent_url} while following job {job_id}"]}
+    save_results(scans, response)
+
+def resume_pending():
+    """Xử lý các lần quét còn "pending" của tiến trình giao diện trước.
+
+    Lần quét đã có job trên agent được theo dõi tiếp (job vẫn chạy trên agent khi giao
+    diện dừng); lần quét chưa kịp gửi đến agent được đánh dấu lỗi.
+    """
+    jobs = {}
+    orphans = []
+    for scan_data in history_store.pending_scans():
+        response = scan_data["response"]
+        if response.get("job_id") and response.get("agent"):
+            scan_data = {k: scan_data[k] for k in ("scan_id", "timestamp", "request")}
+            jobs.setdefault((response["job_id"], response["agent"]), []).append(scan_data)
         else:
-            return {"type": "response", "status": "error", "errors": ["Invalid request type"]}
+            orphans.append(scan_data["scan_id"])
+    for (job_id, agent_url), scans in jobs.items():
+        live_scans.open(scan_data["scan_id"] for scan_data in scans)
+        try:
+            scan_dispatcher.submit(reattach_scan, scans, job_id, agent_url)
+        except ScanQueueFull:
+            orphans.extend(scan_data["scan_id"] for scan_data in scans)
+            for scan_data in scans:
+                live_scans.close(scan_data["scan_id"], "error")
+    if orphans:
+        history_store.fail_pending("Scan interrupted: the web interface stopped while it was running", orphans)
+    if jobs:
+        logging.info(f"Theo dõi tiếp {len(jobs)} job quét còn chạy trên agent")
 
-        response = requests.post(endpoint, json=request_data, stream=True)
-        response.raise_for_status()
-        
-        client = SSEClient(response)
-        for event in client.events():
-            if event.event == "response":
-                return json.loads(event.data)
-        return {"type": "response", "status": "error", "errors": ["No response received"]}
-    except requests.RequestException as e:
-        logging.error(f"Error sending request to agent: {e}")
-        return {"type": "response", "status": "error", "errors": [str(e)]}
+def submit_scan(request_data, targets, agent=None):
+    """Quét và lưu lịch sử, chờ đến khi xong; trả về phản hồi và scan_id của bản ghi (None với batch)."""
+    scans = start_scan(request_data, targets)
+    response = finish_scan(request_data, scans, agent)
+    return response, scans[0]["scan_id"] if len(scans) == 1 else None
+
+def run_scan(request_data, targets, agent=None):
+    """Giao lần quét cho dispatcher chạy nền rồi chuyển ngay đến trang kết quả (trang lịch sử với batch)."""
+    scans = start_scan(request_data, targets)
+    try:
+        scan_dispatcher.submit(finish_scan, request_data, scans, agent)
+    except ScanQueueFull as e:
+        # Hàng đợi quét nền đã đầy: lưu lỗi cho bản ghi "pending" thay vì để nó chờ mãi
+        logging.warning(str(e))
+        ui_scans_total.inc(status="error")
+        for scan_data in scans:
+            save_history(dict(scan_data, response={"type": "scan_response", "status": "error", "errors": [str(e)],
+                                                   "results": []}))
+            live_scans.close(scan_data["scan_id"], "error")
+    if len(scans) > 1:
+        return redirect(url_for("history"))
+    return redirect(url_for("results", scan_id=scans[0]["scan_id"]))
 
 @app.route("/", methods=["GET", "POST"])
 def index():
     """Trang chủ: Form quét và lịch sử quét."""
-    history = load_history()
     if request.method == "POST":
-        target = request.form.get("target")
+        # Một mục tiêu, danh sách mục tiêu (mỗi dòng một mục tiêu) hoặc file danh sách mục tiêu
+        targets_file = request.files.get("targets_file")
+        targets = parse_targets(
+            request.form.get("target"),
+            request.form.get("targets", "").splitlines(),
+            targets_file.read().decode("utf-8", "ignore") if targets_file else None
+        )
+        if not targets:
+            return render_template("index1.html", history=history_store.list_scans(limit=5),
+                                   error="Vui lòng nhập ít nhất một mục tiêu")
+        target = targets[0]
         templates = request.form.get("templates", "").split(",") if request.form.get("templates") else []
         templates = [t.strip() for t in templates if t.strip()]
         rate_limit = int(request.form.get("rate_limit", 50))
@@ -83,31 +352,104 @@ def index():
             "use_deepseek": use_deepseek,
             "vulnerability_type": vulnerability_type
         }
+        # Tốc độ thích ứng theo từng host (mặc định bật trên form)
+        request_data["adaptive"] = request.form.get("adaptive") == "on"
+        if request.form.get("fingerprint") == "on":
+            # Quét hai pha: nhận diện công nghệ rồi chỉ chạy template tương ứng
+            request_data["fingerprint"] = True
+        if request.form.get("incremental") == "on":
+            # Chỉ chạy lại template mới hoặc đã thay đổi, giữ kết quả cũ của phần còn lại
+            request_data["incremental"] = True
+        if request.form.get("checkpoint") == "on":
+            # Chạy template theo từng phần có checkpoint để tiếp tục được khi bị dừng
+            request_data["checkpoint"] = True
+        # Bộ lọc template: mức độ tối thiểu, tags cần quét/bỏ qua và công nghệ của mục tiêu
+        if request.form.get("severity"):
+            request_data["severity"] = request.form.get("severity")
+        for field in ("tags", "exclude_tags", "technologies"):
+            values = [v.strip() for v in request.form.get(field, "").split(",") if v.strip()]
+            if values:
+                request_data[field] = values
+        if len(targets) > 1:
+            # Quét cả danh sách trong một lần chạy Nuclei thay vì từng mục tiêu một
+            request_data["targets"] = targets
 
         logging.info("Gửi yêu cầu quét: %s", request_data)
-        response = send_request(request_data)
-        logging.info("Nhận phản hồi: %s", response)
-
-        scan_data = {
-            "scan_id": str(uuid.uuid4()),
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "request": request_data,
-            "response": response
-        }
-        save_history(scan_data)
+        return run_scan(request_data, targets)
 
-        return redirect(url_for("results", scan_id=scan_data["scan_id"]))
+    return render_template("index1.html", history=history_store.list_scans(limit=5))
 
-    return render_template("index1.html", history=history)
+@app.route("/resume/<scan_id>", methods=["POST"])
+def resume(scan_id):
+    """Tiếp tục lần quét bị dừng (hết thời gian hoặc lỗi) từ checkpoint: chỉ chạy các phần template chưa xong."""
+    scan_data = history_store.get_scan(scan_id)
+    checkpoint = scan_data["response"].get("checkpoint") if scan_data else None
+    if not checkpoint or not scan_data["response"].get("resumable"):
+        return render_template("results1.html", error="Lần quét này không có checkpoint để tiếp tục")
+    # Checkpoint ghi lại toàn bộ danh sách mục tiêu của batch, kết quả được tách lại theo từng mục tiêu
+    targets = checkpoint.get("targets") or [scan_data["request"].get("target")]
+    request_data = {k: v for k, v in scan_data["request"].items() if k != "batch_id"}
+    request_data.update(target=targets[0], resume=checkpoint["id"])
+    if len(targets) > 1:
+        request_data["targets"] = targets
+
+    logging.info("Tiếp tục quét từ checkpoint %s", checkpoint["id"])
+    # Checkpoint nằm trên agent đã chạy lần quét trước, ưu tiên agent đó nếu còn hoạt động
+    return run_scan(request_data, targets, scan_data["response"].get("agent"))
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Metrics của giao diện theo định dạng văn bản của Prometheus."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/results/<scan_id>")
 def results(scan_id):
     """Trang xem chi tiết kết quả quét."""
-    history = load_history()
-    scan_data = next((item for item in history if item["scan_id"] == scan_id), None)
+    scan_data = history_store.get_scan(scan_id)
     if not scan_data:
         return render_template("results1.html", error="Không tìm thấy kết quả quét")
-    return render_template("results1.html", scan_data=scan_data)
+    if scan_data["response"].get("status") == PENDING:
+        # Lần quét đang chạy: trang tự thêm finding mới qua /api/scans/<scan_id>/live
+        return render_template("results1.html", scan_data=scan_data, live=True)
+    # So sánh với lần quét trước của cùng mục tiêu, hoặc với scan được chọn qua ?against=
+    against = request.args.get("against") or history_store.previous_scan_id(scan_id)
+    diff = history_store.diff_scans(against, scan_id) if against else None
+    # Chỉ so sánh được với lần quét đã hoàn tất, không phải lần quét đang chạy hoặc bị lỗi
+    other_scans = history_store.query_scans(limit=20, target=scan_data["request"].get("target"), status="success")[0]
+    return render_template("results1.html", scan_data=scan_data, diff=diff, against=against,
+                           other_scans=[s for s in other_scans if s["scan_id"] != scan_id])
+
+@app.route("/api/scans/<scan_id>/live")
+def scan_live(scan_id):
+    """API theo dõi lần quét đang chạy: trạng thái, tiến độ và các finding từ vị trí after trở đi."""
+    state = live_scans.get(scan_id, request.args.get("after", 0, type=int))
+    if state is None:
+        status = history_store.get_status(scan_id)
+        if status is None:
+            return jsonify({"status": "error", "errors": ["Scan not found"]}), 404
+        # Lần quét không chạy trong tiến trình này: đã xong thì trang tải lại kết quả từ lịch sử
+        state = {"status": status, "progress": None, "findings": [], "count": 0, "restarts": 0,
+                 "done": status != PENDING}
+    return jsonify(dict(state, scan_id=scan_id))
+
+@app.route("/api/scans/<scan_id>/diff")
+def scan_diff(scan_id):
+    """API so sánh hai lần quét: finding mới, đã khắc phục và không đổi."""
+    against = request.args.get("against") or history_store.previous_scan_id(scan_id)
+    if not history_store.get_scan(scan_id) or not against:
+        return jsonify({"status": "error", "errors": ["No scan to compare with"]}), 404
+    diff = history_store.diff_scans(against, scan_id)
+    return jsonify({"status": "success", "scan_id": scan_id, "against": against,
+                    **diff,
+                    "counts": {kind: len(findings) for kind, findings in diff.items()}})
+
+@app.route("/api/findings/<int:finding_id>/raw")
+def finding_raw(finding_id):
+    """API lấy request/response gốc của một finding khi người dùng mở rộng."""
+    raw = history_store.get_finding_raw(finding_id)
+    if raw is None:
+        return jsonify({"status": "error", "errors": ["Finding not found"]}), 404
+    return jsonify({"status": "success", "finding_id": finding_id, **raw})
 
 @app.route("/suggest_templates", methods=["POST"])
 def suggest_templates():
@@ -132,11 +474,138 @@ def suggest_templates():
     response = send_request(request_data)
     return jsonify(response)
 
+def run_schedule(schedule, group, rate_limit):
+    """Quét nhóm mục tiêu của một lịch quét định kỳ với tốc độ scheduler đã cấp (trả về trạng thái)."""
+    targets = group["targets"]
+    request_data = dict(schedule["request"], type="scan_request", target=targets[0], rate_limit=rate_limit,
+                        max_rate=rate_limit, schedule_id=schedule["schedule_id"])
+    if len(targets) > 1:
+        request_data["targets"] = targets
+    response, _ = submit_scan(request_data, targets)
+    return response.get("status", "error")
+
+# Lịch quét định kỳ: ngân sách đồng thời và tốc độ (request/giây) chung cho mọi lần quét theo lịch
+SCHEDULE_DB = os.getenv("SCHEDULE_DB", "schedules.db")
+SCHEDULER_MAX_CONCURRENT = int(os.getenv("SCHEDULER_MAX_CONCURRENT", "2"))
+SCHEDULER_RATE_BUDGET = int(os.getenv("SCHEDULER_RATE_BUDGET", "0"))
+# Các lịch cùng khung giờ được rải đều trong khoảng này (giây) để không khởi động cùng lúc
+SCHEDULER_SPREAD = int(os.getenv("SCHEDULER_SPREAD", "600"))
+
+schedule_store = ScheduleStore(SCHEDULE_DB)
+scheduler = Scheduler(schedule_store, run_schedule, max_concurrent=SCHEDULER_MAX_CONCURRENT,
+                      rate_budget=SCHEDULER_RATE_BUDGET, spread=SCHEDULER_SPREAD)
+
+@app.route("/api/schedules")
+def list_schedules():
+    """API danh sách lịch quét, nhóm mục tiêu và các lần quét theo lịch đang chạy."""
+    return jsonify({"schedules": schedule_store.list(), "groups": list(schedule_store.groups().values()),
+                    "running": scheduler.active()})
+
+@app.route("/api/schedules", methods=["POST"])
+def create_schedule():
+    """API tạo lịch quét: name, group, interval ("6h", "1d"...), at ("02:00", tùy chọn) và request (cấu hình quét)."""
+    data = request.get_json(silent=True) or {}
+    if not data.get("name") or not data.get("interval"):
+        return jsonify({"status": "error", "errors": ["name and interval are required"]}), 400
+    if data.get("group") not in schedule_store.groups():
+        return jsonify({"status": "error", "errors": [f"Unknown target group: {data.get('group')}"]}), 400
+    scan_request = {k: v for k, v in (data.get("request") or {}).items()
+                    if k not in ("type", "target", "targets", "targets_file", "resume")}
+    try:
+        schedule = schedule_store.create(data["name"], data["group"], scan_request, data["interval"],
+                                         data.get("at"), SCHEDULER_SPREAD)
+    except ValueError as e:
+        return jsonify({"status": "error", "errors": [str(e)]}), 400
+    return jsonify({"status": "success", "schedule": schedule}), 201
+
+@app.route("/api/schedules/<schedule_id>", methods=["POST"])
+def update_schedule(schedule_id):
+    """API bật/tắt lịch quét với {"enabled": true/false}."""
+    data = request.get_json(silent=True) or {}
+    if not schedule_store.set_enabled(schedule_id, data.get("enabled", True)):
+        return jsonify({"status": "error", "errors": ["Schedule not found"]}), 404
+    return jsonify({"status": "success", "schedule": schedule_store.get(schedule_id)})
+
+@app.route("/api/schedules/<schedule_id>", methods=["DELETE"])
+def delete_schedule(schedule_id):
+    """API xóa lịch quét."""
+    if not schedule_store.delete(schedule_id):
+        return jsonify({"status": "error", "errors": ["Schedule not found"]}), 404
+    return jsonify({"status": "success"})
+
+@app.route("/api/schedules/<schedule_id>/run", methods=["POST"])
+def run_schedule_now(schedule_id):
+    """API chạy lịch quét ngay, vẫn trong ngân sách đồng thời và tốc độ."""
+    if not schedule_store.get(schedule_id):
+        return jsonify({"status": "error", "errors": ["Schedule not found"]}), 404
+    if not scheduler.run_now(schedule_id):
+        return jsonify({"status": "error", "errors": ["Schedule is running, or the concurrency or rate budget is spent"]}), 409
+    return jsonify({"status": "success"}), 202
+
+@app.route("/api/groups", methods=["POST"])
+def save_group():
+    """API tạo hoặc thay thế nhóm mục tiêu: name, targets, max_concurrent và rate_budget (tùy chọn)."""
+    data = request.get_json(silent=True) or {}
+    targets = parse_targets(None, data.get("targets") or [], data.get("targets_file"))
+    if not data.get("name") or not targets:
+        return jsonify({"status": "error", "errors": ["name and targets are required"]}), 400
+    schedule_store.save_group(data["name"], targets, data.get("max_concurrent"), data.get("rate_budget"))
+    return jsonify({"status": "success", "name": data["name"], "targets": len(targets)})
+
+@app.route("/api/groups/<name>", methods=["DELETE"])
+def delete_group(name):
+    """API xóa nhóm mục tiêu không còn lịch quét nào dùng."""
+    if not schedule_store.delete_group(name):
+        return jsonify({"status": "error", "errors": ["Target group is used by a schedule"]}), 409
+    return jsonify({"status": "success"})
+
+@app.route("/api/agents")
+def list_agents():
+    """API xem trạng thái và tải của từng agent mà giao diện phân phối quét đến."""
+    agent_router.start()
+    return jsonify({"agents": agent_router.snapshot()})
+
+def history_filters():
+    """Đọc bộ lọc lịch sử từ query string."""
+    return {
+        key: request.args.get(key) or None
+        for key in ("target", "status", "vulnerability_type", "date_from", "date_to")
+    }
+
 @app.route("/history")
 def history():
-    """Hiển thị toàn bộ lịch sử quét."""
-    history = load_history()
-    return render_template("history.html", history=history)
+    """Hiển thị lịch sử quét theo từng trang, có bộ lọc."""
+    filters = history_filters()
+    scans, next_cursor = history_store.query_scans(
+        limit=request.args.get("limit", type=int),
+        cursor=request.args.get("cursor"),
+        **filters
+    )
+    return render_template("history.html", history=scans, next_cursor=next_cursor,
+                           filters=filters, cursor=request.args.get("cursor"))
+
+@app.route("/api/history")
+def api_history():
+    """API lịch sử quét: phân trang bằng cursor, mỗi scan kèm số lượng findings."""
+    scans, next_cursor = history_store.query_scans(
+        limit=request.args.get("limit", type=int),
+        cursor=request.args.get("cursor"),
+        **history_filters()
+    )
+    return jsonify({"scans": scans, "next_cursor": next_cursor})
+
+_background_started = False
+
+def start_background():
+    """Khởi động các tác vụ nền của giao diện (theo dõi tiếp lần quét dở, scheduler) đúng một lần trong tiến trình phục vụ web."""
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+    resume_pending()
+    scheduler.start()
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
+    # Tắt reloader: reloader chạy app trong một tiến trình con, khi đó hai tiến trình cùng chạy tác vụ nền
+    start_background()
+    app.run(debug=True, use_reloader=False, host="0.0.0.0", port=5000)
\ No newline at end of file
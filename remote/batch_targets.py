@@ -0,0 +1,48 @@
+from suggestion_cache import normalize_host
+
+def parse_targets(target=None, targets=None, targets_file=None):
+    """Collect unique targets from a single target, a list and a target-file body (one per line, # comments)."""
+    collected = []
+    if target:
+        collected.append(target)
+    collected.extend(targets or [])
+    for line in (targets_file or "").splitlines():
+        line = line.split("#", 1)[0]
+        collected.append(line)
+    seen = set()
+    unique = []
+    for item in collected:
+        item = item.strip()
+        if item and item not in seen:
+            seen.add(item)
+            unique.append(item)
+    return unique
+
+def write_targets_file(targets, path):
+    """Write targets one per line for Nuclei's -l option."""
+    with open(path, "w") as f:
+        f.write("\n".join(targets) + "\n")
+
+class TargetMatcher:
+    """Maps Nuclei findings from a multi-target run back to the input target they belong to."""
+
+    def __init__(self, targets):
+        self.urls = {}
+        self.hosts = {}
+        for target in targets:
+            self.urls.setdefault(target.rstrip("/").lower(), target)
+            self.hosts.setdefault(normalize_host(target), target)
+
+    def match(self, finding):
+        """Return the input target for a finding, falling back to the finding's own host."""
+        candidates = [finding.get("url"), finding.get("matched-at")]
+        for value in candidates:
+            if value and value.rstrip("/").lower() in self.urls:
+                return self.urls[value.rstrip("/").lower()]
+        candidates.append(finding.get("host"))
+        for value in candidates:
+            if value:
+                host = normalize_host(value)
+                if host in self.hosts:
+                    return self.hosts[host]
+        return finding.get("host") or finding.get("matched-at") or "unknown"
@@ -0,0 +1,423 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from urllib.parse import urlsplit, urlunsplit
+
+# Bulky per-finding fields kept out of the findings table
+RAW_FIELDS = ("request", "response", "curl-command")
+
+# Fields describing one scan's sighting of a finding rather than the finding itself
+SIGHTING_FIELDS = ("carried_over", "carried_over_from")
+
+# zlib-compress raw request/response blobs on disk (HTTP bodies compress ~5-10x)
+COMPRESS_RAW = os.getenv("HISTORY_COMPRESS_RAW", "1") != "0"
+
+# Status of a scan recorded at submission, replaced by the final response when it finishes
+PENDING = "pending"
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    scan_id TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    target TEXT,
+    vulnerability_type TEXT,
+    status TEXT,
+    request TEXT NOT NULL,
+    response_meta TEXT NOT NULL,
+    findings_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_scans_timestamp ON scans (timestamp, scan_id);
+CREATE INDEX IF NOT EXISTS idx_scans_target ON scans (target, timestamp);
+CREATE INDEX IF NOT EXISTS idx_scans_status ON scans (status, timestamp);
+CREATE INDEX IF NOT EXISTS idx_scans_vuln_type ON scans (vulnerability_type, timestamp);
+
+CREATE TABLE IF NOT EXISTS findings (
+    finding_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fingerprint TEXT NOT NULL UNIQUE,
+    template_id TEXT,
+    matcher_name TEXT,
+    severity TEXT,
+    host TEXT,
+    matched_at TEXT,
+    data TEXT NOT NULL,
+    first_seen TEXT,
+    last_seen TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_findings_severity ON findings (severity);
+CREATE INDEX IF NOT EXISTS idx_findings_template ON findings (template_id);
+CREATE INDEX IF NOT EXISTS idx_findings_host ON findings (host);
+
+CREATE TABLE IF NOT EXISTS scan_findings (
+    scan_id TEXT NOT NULL REFERENCES scans (scan_id),
+    seq INTEGER NOT NULL,
+    finding_id INTEGER NOT NULL REFERENCES findings (finding_id),
+    carried_over_from TEXT,
+    PRIMARY KEY (scan_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_scan_findings_finding ON scan_findings (finding_id);
+
+CREATE TABLE IF NOT EXISTS finding_raw (
+    finding_id INTEGER PRIMARY KEY REFERENCES findings (finding_id),
+    data BLOB NOT NULL,
+    encoding TEXT NOT NULL DEFAULT 'json'
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class HistoryStore:
+    """Scan history in SQLite (WAL mode): scans, finding summaries and raw HTTP blobs in separate tables.
+
+    Findings are deduplicated by finding_fingerprint: each distinct finding is stored
+    once and every scan that reports it only adds a row to scan_findings, so repeated
+    scans of a host do not grow the findings tables and two scans diff by finding_id.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self._conn() as conn:
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(finding_raw)")]
+            if columns and "encoding" not in columns:
+                conn.execute("ALTER TABLE finding_raw ADD COLUMN encoding TEXT NOT NULL DEFAULT 'json'")
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(findings)")]
+            if "scan_id" in columns:
+                self._migrate_findings(conn)
+            conn.executescript(SCHEMA)
+
+    def _migrate_findings(self, conn):
+        """Move findings stored once per scan into the deduplicated layout."""
+        for index in ("idx_findings_scan", "idx_findings_severity", "idx_findings_template", "idx_findings_host"):
+            conn.execute(f"DROP INDEX IF EXISTS {index}")
+        conn.execute("ALTER TABLE findings RENAME TO findings_v1")
+        conn.execute("ALTER TABLE finding_raw RENAME TO finding_raw_v1")
+        conn.executescript(SCHEMA)
+        migrated = 0
+        rows = conn.execute(
+            "SELECT f.scan_id, f.seq, f.data, r.data AS raw, r.encoding, s.timestamp FROM findings_v1 f "
+            "JOIN scans s ON s.scan_id = f.scan_id "
+            "LEFT JOIN finding_raw_v1 r ON r.finding_id = f.finding_id ORDER BY s.timestamp, f.scan_id, f.seq"
+        ).fetchall()
+        for row in rows:
+            finding = json.loads(row["data"])
+            if row["raw"] is not None:
+                finding.update(decode_raw(row["raw"], row["encoding"]))
+            self._link_finding(conn, row["scan_id"], row["seq"], row["timestamp"], finding)
+            migrated += 1
+        conn.execute("DROP TABLE finding_raw_v1")
+        conn.execute("DROP TABLE findings_v1")
+        logging.info(f"Deduplicated {migrated} stored findings into "
+                     f"{conn.execute('SELECT COUNT(*) FROM findings').fetchone()[0]}")
+
+    def _conn(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def save_scan(self, scan_data):
+        """Insert one scan, or replace its pending record, and link its findings.
+
+        Cost depends only on this scan's size.
+        """
+        request = scan_data.get("request", {})
+        response = dict(scan_data.get("response") or {})
+        results = response.pop("results", None) or []
+        with self._conn() as conn:
+            conn.execute("DELETE FROM scan_findings WHERE scan_id = ?", (scan_data["scan_id"],))
+            conn.execute(
+                "INSERT OR REPLACE INTO scans (scan_id, timestamp, target, vulnerability_type, status, request, response_meta, findings_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (scan_data["scan_id"], scan_data["timestamp"], request.get("target"),
+                 request.get("vulnerability_type"), response.get("status"),
+                 json.dumps(request), json.dumps(response), len(results))
+            )
+            for seq, finding in enumerate(results):
+                self._link_finding(conn, scan_data["scan_id"], seq, scan_data["timestamp"], finding)
+
+    def pending_scans(self):
+        """Return the headers of the scans still pending, oldest first."""
+        rows = self._conn().execute("SELECT * FROM scans WHERE status = ? ORDER BY timestamp, scan_id",
+                                    (PENDING,)).fetchall()
+        return [self._scan_from_row(row) for row in rows]
+
+    def fail_pending(self, error, scan_ids=None):
+        """Mark the scans still pending, left by a process that stopped mid-scan, as failed with error.
+
+        With scan_ids, only those of the pending scans are marked.
+        """
+        with self._conn() as conn:
+            rows = conn.execute("SELECT scan_id, response_meta FROM scans WHERE status = ?", (PENDING,)).fetchall()
+            if scan_ids is not None:
+                wanted = set(scan_ids)
+                rows = [row for row in rows if row["scan_id"] in wanted]
+            for row in rows:
+                response = json.loads(row["response_meta"])
+                response.update(status="error", errors=(response.get("errors") or []) + [error])
+                conn.execute("UPDATE scans SET status = 'error', response_meta = ? WHERE scan_id = ?",
+                             (json.dumps(response), row["scan_id"]))
+        if rows:
+            logging.warning(f"Marked {len(rows)} interrupted scans as failed")
+        return len(rows)
+
+    def get_status(self, scan_id):
+        """Return a scan's status without loading its findings, or None if there is no such scan."""
+        row = self._conn().execute("SELECT status FROM scans WHERE scan_id = ?", (scan_id,)).fetchone()
+        return row["status"] if row else None
+
+    def _link_finding(self, conn, scan_id, seq, timestamp, finding):
+        """Store a finding unless its fingerprint is known, and link it to the scan.
+
+        A fresh sighting replaces the stored summary and raw HTTP fields with the latest
+        ones; a finding carried over from an earlier scan only adds the link.
+        """
+        fingerprint = finding_fingerprint(finding)
+        carried_over_from = finding.get("carried_over_from") if finding.get("carried_over") else None
+        summary = {k: v for k, v in finding.items() if k not in RAW_FIELDS and k not in SIGHTING_FIELDS}
+        raw = {k: finding[k] for k in RAW_FIELDS if k in finding}
+        row = conn.execute("SELECT finding_id FROM findings WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if row is None:
+            finding_id = conn.execute(
+                "INSERT INTO findings (fingerprint, template_id, matcher_name, severity, host, matched_at, data, "
+                "first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (fingerprint, finding.get("template-id"), finding.get("matcher-name"),
+                 finding.get("info", {}).get("severity"), finding.get("host"),
+                 finding.get("matched-at"), json.dumps(summary), timestamp, timestamp)
+            ).lastrowid
+        else:
+            finding_id = row["finding_id"]
+            if carried_over_from is None:
+                conn.execute(
+                    "UPDATE findings SET severity = ?, data = ?, last_seen = MAX(COALESCE(last_seen, ''), ?) "
+                    "WHERE finding_id = ?",
+                    (finding.get("info", {}).get("severity"), json.dumps(summary), timestamp, finding_id)
+                )
+        if raw and (row is None or carried_over_from is None):
+            conn.execute("INSERT OR REPLACE INTO finding_raw (finding_id, data, encoding) VALUES (?, ?, ?)",
+                         (finding_id, *encode_raw(raw)))
+        conn.execute("INSERT INTO scan_findings (scan_id, seq, finding_id, carried_over_from) VALUES (?, ?, ?, ?)",
+                     (scan_id, seq, finding_id, carried_over_from))
+        return finding_id
+
+    def get_scan(self, scan_id, include_raw=False):
+        """Return a scan in the scan_history.json shape, or None.
+
+        Findings are compact summaries carrying a finding_id; raw request/response
+        fields are only loaded with include_raw, otherwise use get_finding_raw.
+        """
+        conn = self._conn()
+        row = conn.execute("SELECT * FROM scans WHERE scan_id = ?", (scan_id,)).fetchone()
+        if not row:
+            return None
+        scan = self._scan_from_row(row)
+        results = []
+        for finding in conn.execute(
+            "SELECT f.finding_id, f.data, sf.carried_over_from FROM scan_findings sf "
+            "JOIN findings f ON f.finding_id = sf.finding_id WHERE sf.scan_id = ? ORDER BY sf.seq", (scan_id,)
+        ):
+            result = self._finding_from_row(finding)
+            if include_raw:
+                result.update(self.get_finding_raw(finding["finding_id"]) or {})
+            results.append(result)
+        scan["response"]["results"] = results
+        return scan
+
+    def _finding_from_row(self, row):
+        result = json.loads(row["data"])
+        result["finding_id"] = row["finding_id"]
+        if row["carried_over_from"]:
+            result.update(carried_over=True, carried_over_from=row["carried_over_from"])
+        return result
+
+    def previous_scan_id(self, scan_id):
+        """Return the finished scan of the same target just before scan_id, or None."""
+        conn = self._conn()
+        row = conn.execute("SELECT target, timestamp FROM scans WHERE scan_id = ?", (scan_id,)).fetchone()
+        if not row:
+            return None
+        previous = conn.execute(
+            "SELECT scan_id FROM scans WHERE target = ? AND status IS NOT ? AND (timestamp, scan_id) < (?, ?) "
+            "ORDER BY timestamp DESC, scan_id DESC LIMIT 1",
+            (row["target"], PENDING, row["timestamp"], scan_id)
+        ).fetchone()
+        return previous["scan_id"] if previous else None
+
+    def diff_scans(self, old_scan_id, new_scan_id):
+        """Compare two scans by finding fingerprint.
+
+        Returns {"new": [...], "fixed": [...], "unchanged": [...]} finding summaries:
+        reported only by the newer scan, only by the older one, and by both.
+        """
+        conn = self._conn()
+        old_ids = {row[0] for row in conn.execute(
+            "SELECT finding_id FROM scan_findings WHERE scan_id = ?", (old_scan_id,))}
+        new_ids = {row[0] for row in conn.execute(
+            "SELECT finding_id FROM scan_findings WHERE scan_id = ?", (new_scan_id,))}
+        findings = {}
+        ids = list(old_ids | new_ids)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            for row in conn.execute(
+                f"SELECT finding_id, data, NULL AS carried_over_from FROM findings "
+                f"WHERE finding_id IN ({','.join('?' * len(chunk))})", chunk
+            ):
+                findings[row["finding_id"]] = self._finding_from_row(row)
+
+        def ordered(finding_ids):
+            return sorted((findings[i] for i in finding_ids),
+                          key=lambda f: (f.get("template-id") or "", f.get("matched-at") or ""))
+
+        return {
+            "new": ordered(new_ids - old_ids),
+            "fixed": ordered(old_ids - new_ids),
+            "unchanged": ordered(new_ids & old_ids)
+        }
+
+    def get_finding_raw(self, finding_id):
+        """Return the raw request/response/curl-command fields of one finding, or None."""
+        row = self._conn().execute(
+            "SELECT data, encoding FROM finding_raw WHERE finding_id = ?", (finding_id,)
+        ).fetchone()
+        if not row:
+            return None
+        return decode_raw(row["data"], row["encoding"])
+
+    def list_scans(self, limit=DEFAULT_PAGE_SIZE):
+        """Return the newest scan headers, without their findings."""
+        return self.query_scans(limit=limit)[0]
+
+    def query_scans(self, limit=DEFAULT_PAGE_SIZE, cursor=None, target=None, status=None,
+                    vulnerability_type=None, date_from=None, date_to=None):
+        """Return one page of scan headers, newest first, and the cursor for the next page.
+
+        Pages are keyset-paginated on (timestamp, scan_id), so every page costs the same
+        regardless of how deep into the history it is. Dates are YYYY-MM-DD, inclusive.
+        """
+        limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        clauses = []
+        params = []
+        if target:
+            clauses.append("target = ?")
+            params.append(target)
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if vulnerability_type:
+            clauses.append("vulnerability_type = ?")
+            params.append(vulnerability_type)
+        if date_from:
+            clauses.append("timestamp >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("timestamp <= ?")
+            params.append(f"{date_to} 23:59:59")
+        if cursor:
+            after = decode_cursor(cursor)
+            if after:
+                clauses.append("(timestamp, scan_id) < (?, ?)")
+                params.extend(after)
+        sql = "SELECT * FROM scans"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp DESC, scan_id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = self._conn().execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["timestamp"], rows[-1]["scan_id"])
+        return [self._scan_from_row(row) for row in rows], next_cursor
+
+    def _scan_from_row(self, row):
+        return {
+            "scan_id": row["scan_id"],
+            "timestamp": row["timestamp"],
+            "request": json.loads(row["request"]),
+            "response": json.loads(row["response_meta"]),
+            "findings_count": row["findings_count"]
+        }
+
+    def import_json(self, json_path):
+        """Import a legacy scan_history.json once; later calls are no-ops."""
+        key = f"imported:{os.path.abspath(json_path)}"
+        conn = self._conn()
+        if not os.path.exists(json_path) or conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+            return 0
+        try:
+            with open(json_path, "r") as f:
+                history = json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading history for import: {e}")
+            return 0
+        imported = 0
+        for scan_data in history:
+            if conn.execute("SELECT 1 FROM scans WHERE scan_id = ?", (scan_data.get("scan_id"),)).fetchone():
+                continue
+            self.save_scan(scan_data)
+            imported += 1
+        with conn:
+            conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (key, str(imported)))
+        logging.info(f"Imported {imported} scans from {json_path}")
+        return imported
+
+def finding_fingerprint(finding):
+    """Identify a finding across scans by template-id, matcher-name, host and normalized matched-at."""
+    parts = [
+        finding.get("template-id") or "",
+        finding.get("matcher-name") or "",
+        (finding.get("host") or "").strip().lower(),
+        normalize_matched_at(finding.get("matched-at"))
+    ]
+    return hashlib.sha1("\x1f".join(parts).encode()).hexdigest()
+
+def normalize_matched_at(matched_at):
+    """Lowercase scheme and host, drop default ports, fragments and trailing slashes of a matched-at URL."""
+    matched_at = (matched_at or "").strip()
+    if "://" not in matched_at:
+        return matched_at.lower().rstrip("/")
+    parts = urlsplit(matched_at)
+    netloc = parts.netloc.lower()
+    if (parts.scheme.lower(), netloc.rsplit(":", 1)[-1]) in (("http", "80"), ("https", "443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path.rstrip("/"), parts.query, ""))
+
+def encode_cursor(timestamp, scan_id):
+    """Encode a (timestamp, scan_id) position as an opaque URL-safe cursor."""
+    return base64.urlsafe_b64encode(f"{timestamp}|{scan_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor, or return None if it is malformed."""
+    try:
+        timestamp, scan_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return timestamp, scan_id
+
+def encode_raw(raw):
+    """Serialize raw finding fields for storage, returning (data, encoding)."""
+    data = json.dumps(raw)
+    if COMPRESS_RAW:
+        return zlib.compress(data.encode(), 6), "zlib"
+    return data, "json"
+
+def decode_raw(data, encoding):
+    """Inverse of encode_raw."""
+    if encoding == "zlib":
+        data = zlib.decompress(data).decode()
+    return json.loads(data)
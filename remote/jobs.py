@@ -0,0 +1,321 @@
+import asyncio
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Events kept once a job has finished; progress events only matter while it runs
+KEPT_EVENTS = ("finding", "error", "summary", "reset")
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+class JobStore:
+    """SQLite-backed storage for scan jobs and the events they produce."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    summary TEXT,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)")
+
+    def create(self, request):
+        """Insert a new queued job and return its ID."""
+        job_id = str(uuid.uuid4())
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (job_id, status, request, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(request), _now())
+            )
+        return job_id
+
+    def get(self, job_id):
+        """Return a job as a dict, or None if it does not exist."""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if not row:
+                return None
+            findings = self.conn.execute(
+                "SELECT COUNT(*) FROM job_events WHERE job_id = ? AND event = 'finding'", (job_id,)
+            ).fetchone()[0]
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        job["summary"] = json.loads(job["summary"]) if job["summary"] else None
+        job["findings"] = findings
+        return job
+
+    def set_status(self, job_id, status, summary=None):
+        """Move a job to a new state, recording start/finish times."""
+        with self.lock, self.conn:
+            if status == RUNNING:
+                self.conn.execute("UPDATE jobs SET status = ?, started_at = ? WHERE job_id = ?",
+                                  (status, _now(), job_id))
+            elif status in (COMPLETED, FAILED):
+                self.conn.execute("UPDATE jobs SET status = ?, summary = ?, finished_at = ? WHERE job_id = ?",
+                                  (status, json.dumps(summary) if summary is not None else None, _now(), job_id))
+            else:
+                self.conn.execute("UPDATE jobs SET status = ? WHERE job_id = ?", (status, job_id))
+
+    def append_events(self, job_id, events):
+        """Store a batch of (seq, event, data) SSE events emitted by a job in one transaction."""
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT INTO job_events (job_id, seq, event, data) VALUES (?, ?, ?, ?)",
+                                  [(job_id, seq, event, data) for seq, event, data in events])
+
+    def compact(self, job_id):
+        """Drop a finished job's progress events, keeping its findings, errors and summary."""
+        with self.lock, self.conn:
+            placeholders = ",".join("?" * len(KEPT_EVENTS))
+            self.conn.execute(f"DELETE FROM job_events WHERE job_id = ? AND event NOT IN ({placeholders})",
+                              (job_id, *KEPT_EVENTS))
+
+    def purge(self, before):
+        """Delete jobs finished before the given time, with their events, and return how many went."""
+        with self.lock, self.conn:
+            expired = [row[0] for row in self.conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (COMPLETED, FAILED, before))]
+            for job_id in expired:
+                self.conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                self.conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return len(expired)
+
+    def events(self, job_id, after=0, limit=500):
+        """Return up to limit events with seq greater than after, in order."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (job_id, after, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def last_seq(self, job_id):
+        """Return the seq of a job's last stored event, 0 if it has none."""
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?",
+                                     (job_id,)).fetchone()[0]
+
+    def requeue_interrupted(self):
+        """Reset jobs left running by a previous process and return all queued job IDs, oldest first.
+
+        An interrupted job's events are replaced by a "reset" event numbered after the last
+        of them, so clients resuming from a Last-Event-ID learn that the job starts over.
+        """
+        with self.lock, self.conn:
+            interrupted = [row[0] for row in self.conn.execute(
+                "SELECT job_id FROM jobs WHERE status = ?", (RUNNING,))]
+            for job_id in interrupted:
+                last = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?",
+                                         (job_id,)).fetchone()[0]
+                self.conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                if last:
+                    self.conn.execute("INSERT INTO job_events (job_id, seq, event, data) VALUES (?, ?, ?, ?)",
+                                      (job_id, last + 1, "reset", json.dumps({"reason": "agent restarted"})))
+                self.conn.execute("UPDATE jobs SET status = ?, started_at = NULL WHERE job_id = ?",
+                                  (QUEUED, job_id))
+            return [row[0] for row in self.conn.execute(
+                "SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,))]
+
+class JobManager:
+    """Queue of scan jobs drained by a fixed pool of asyncio workers.
+
+    runner is an async generator function taking the job request and its job_id and
+    yielding SSE-style {"event": ..., "data": ...} dicts; the last one must be "summary".
+    A job whose runner raises or ends without one fails with an error summary of its own,
+    so followers always see where it ended.
+    A job rerun after a restart numbers its events on from those of the interrupted run.
+    Events are written in batches every flush_interval seconds. Jobs finished more than
+    retention seconds ago are deleted with their events (0 keeps them forever).
+    """
+
+    def __init__(self, store, runner, workers=4, max_queued=1000, poll_interval=0.5, flush_interval=0.5,
+                 retention=7 * 24 * 3600, purge_interval=3600):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.max_queued = max_queued
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self.last_purge = 0
+        self.queue = None
+        self.tasks = []
+        self.running = 0
+
+    async def start(self):
+        """Start the worker pool and re-enqueue jobs that were pending at shutdown."""
+        self.queue = asyncio.Queue()
+        await self._purge()
+        pending = await asyncio.to_thread(self.store.requeue_interrupted)
+        for job_id in pending:
+            self.queue.put_nowait(job_id)
+        if pending:
+            logging.info(f"Resumed {len(pending)} pending scan jobs")
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Cancel the workers; running jobs are picked up again on next start."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(self, request):
+        """Persist a job and enqueue it, returning its ID."""
+        if self.queue.qsize() >= self.max_queued:
+            raise JobQueueFull(f"Job queue is full ({self.max_queued} jobs waiting)")
+        job_id = await asyncio.to_thread(self.store.create, request)
+        self.queue.put_nowait(job_id)
+        return job_id
+
+    async def _worker(self):
+        """Run queued jobs one at a time until cancelled."""
+        while True:
+            job_id = await self.queue.get()
+            self.running += 1
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logging.error(f"Job {job_id} failed: {e}")
+                await asyncio.to_thread(self._fail, job_id, str(e))
+            finally:
+                self.running -= 1
+                self.queue.task_done()
+            if time.time() - self.last_purge >= self.purge_interval:
+                await self._purge()
+
+    async def _run(self, job_id):
+        """Execute one job, persisting its events in batches as they are produced."""
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if not job or job["status"] != QUEUED:
+            return
+        logging.info(f"Worker starting job {job_id} for {job['request'].get('target')}")
+        await asyncio.to_thread(self.store.set_status, job_id, RUNNING)
+        seq = await asyncio.to_thread(self.store.last_seq, job_id)
+        summary = None
+        pending = []
+        done = asyncio.Event()
+        flusher = asyncio.create_task(self._flush_loop(job_id, pending, done))
+        status = COMPLETED
+        try:
+            try:
+                async for event in self.runner(job["request"], job_id=job_id):
+                    seq += 1
+                    pending.append((seq, event["event"], event["data"]))
+                    if event["event"] == "summary":
+                        summary = json.loads(event["data"])
+            except Exception as e:
+                logging.error(f"Job {job_id} failed: {e}")
+                errors = [str(e)]
+            else:
+                errors = ["Scan ended without a summary"]
+            if summary is None:
+                status = FAILED
+                summary = _error_summary(errors)
+                seq += 1
+                pending.append((seq, "summary", json.dumps(summary)))
+        finally:
+            # The flusher writes what is left before it returns, so the job's events are all
+            # stored before its status says it has finished
+            done.set()
+            await flusher
+        await asyncio.to_thread(self.store.set_status, job_id, status, summary)
+        await asyncio.to_thread(self.store.compact, job_id)
+
+    def _fail(self, job_id, error):
+        """Fail a job outside its runner, ending its events with an error summary unless they have one."""
+        seq = self.store.last_seq(job_id)
+        last = self.store.events(job_id, seq - 1)
+        summary = _error_summary([error])
+        if not last or last[-1]["event"] != "summary":
+            self.store.append_events(job_id, [(seq + 1, "summary", json.dumps(summary))])
+        self.store.set_status(job_id, FAILED, summary)
+
+    async def _flush_loop(self, job_id, pending, done):
+        """Write a running job's buffered events every flush_interval seconds until done is set."""
+        while True:
+            try:
+                await asyncio.wait_for(done.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if pending:
+                batch = pending[:]
+                del pending[:]
+                await asyncio.to_thread(self.store.append_events, job_id, batch)
+            if done.is_set():
+                return
+
+    async def _purge(self):
+        """Delete the jobs that finished more than retention seconds ago."""
+        self.last_purge = time.time()
+        if not self.retention:
+            return
+        before = (datetime.datetime.now() - datetime.timedelta(seconds=self.retention)).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            purged = await asyncio.to_thread(self.store.purge, before)
+        except Exception as e:
+            logging.error(f"Error purging finished jobs: {e}")
+            return
+        if purged:
+            logging.info(f"Purged {purged} scan jobs finished before {before}")
+
+    def stats(self):
+        """Return the jobs running and waiting, and the worker count."""
+        return {"running": self.running, "queued": self.queue.qsize() if self.queue else 0,
+                "workers": self.workers, "max_queued": self.max_queued}
+
+    async def follow(self, job_id, after=0):
+        """Yield stored events for a job from seq after onwards, waiting for new ones until it finishes."""
+        while True:
+            # Read the status first so a finished job's events are all visible below
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if not job:
+                return
+            events = await asyncio.to_thread(self.store.events, job_id, after)
+            for event in events:
+                after = event["seq"]
+                yield {"id": str(event["seq"]), "event": event["event"], "data": event["data"]}
+            if events:
+                continue
+            if job["status"] in (COMPLETED, FAILED):
+                return
+            await asyncio.sleep(self.poll_interval)
+
+def _error_summary(errors):
+    return {"type": "scan_response", "status": "error", "findings": 0, "errors": errors}
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
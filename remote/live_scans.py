@@ -0,0 +1,118 @@
+import logging
+import queue
+import threading
+import time
+
+# Bulky per-finding fields left out of the live view; the saved scan keeps them
+RAW_FIELDS = ("request", "response", "curl-command")
+
+class LiveScans:
+    """Progress and findings of the scans this process is running, for results pages to poll.
+
+    A scan is opened when its pending history record is written and closed once its
+    final response is saved. Closed scans are kept for keep seconds, so a page polling
+    at that moment still sees the end, then dropped; the history has them from then on.
+    """
+
+    def __init__(self, keep=120):
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.scans = {}
+
+    def open(self, scan_ids):
+        with self.lock:
+            self._expire()
+            for scan_id in scan_ids:
+                self.scans[scan_id] = {"status": "pending", "progress": None, "findings": [], "restarts": 0,
+                                       "closed_at": None}
+
+    def add(self, scan_id, finding):
+        summary = {k: v for k, v in finding.items() if k not in RAW_FIELDS}
+        with self.lock:
+            scan = self.scans.get(scan_id)
+            if scan is not None:
+                scan["status"] = "running"
+                scan["findings"].append(summary)
+
+    def progress(self, scan_id, progress):
+        with self.lock:
+            scan = self.scans.get(scan_id)
+            if scan is not None:
+                scan["status"] = "running"
+                scan["progress"] = progress
+
+    def restart(self, scan_id):
+        """Drop the findings shown so far, for a scan that starts over (e.g. on another agent)."""
+        with self.lock:
+            scan = self.scans.get(scan_id)
+            if scan is not None:
+                scan["findings"] = []
+                scan["restarts"] += 1
+
+    def close(self, scan_id, status):
+        with self.lock:
+            scan = self.scans.get(scan_id)
+            if scan is not None:
+                scan["status"] = status
+                scan["closed_at"] = time.time()
+
+    def get(self, scan_id, after=0):
+        """Return a scan's status and the findings from index after on, or None if it is not running here.
+
+        count is the index to poll from next; restarts changes when the findings start over.
+        """
+        with self.lock:
+            scan = self.scans.get(scan_id)
+            if scan is None:
+                return None
+            return {"status": scan["status"], "progress": scan["progress"], "findings": scan["findings"][after:],
+                    "count": len(scan["findings"]), "restarts": scan["restarts"],
+                    "done": scan["closed_at"] is not None}
+
+    def _expire(self):
+        cutoff = time.time() - self.keep
+        for scan_id in [s for s, scan in self.scans.items() if scan["closed_at"] and scan["closed_at"] < cutoff]:
+            del self.scans[scan_id]
+
+class ScanQueueFull(Exception):
+    """Raised when a scan is submitted while max_queued scans are already waiting for a worker."""
+
+class ScanDispatcher:
+    """Runs submitted scans in the background on a fixed number of worker threads, in order.
+
+    The workers are daemon threads started on first use, so they neither hold up the
+    interpreter's exit nor start in a process that never submits. At most max_queued
+    scans wait for a worker; submit raises ScanQueueFull beyond that.
+    A scan cut off by an exit stays pending in the history until HistoryStore.fail_pending.
+    """
+
+    def __init__(self, workers=8, max_queued=100):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        with self.lock:
+            if not self.threads:
+                self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+                for thread in self.threads:
+                    thread.start()
+        try:
+            self.queue.put_nowait((fn, args))
+        except queue.Full:
+            raise ScanQueueFull(f"Scan queue is full ({self.max_queued} scans waiting)")
+
+    def queued(self):
+        return self.queue.qsize()
+
+    def _work(self):
+        while True:
+            fn, args = self.queue.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"Background scan failed: {e}")
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,93 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+class SuggestionCache:
+    """DeepSeek template suggestions cached in an in-memory LRU backed by SQLite, with a TTL.
+
+    Entries are keyed by prompt version, target host and vulnerability type, so
+    http://host/ and https://HOST/path share an entry and bumping the version
+    invalidates answers produced by an older prompt.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=1024, version="1"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = version
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS suggestions (
+                    key TEXT PRIMARY KEY,
+                    templates TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    def key(self, target, vulnerability_type):
+        return f"{self.version}|{normalize_host(target)}|{(vulnerability_type or 'http').strip().lower()}"
+
+    def get(self, target, vulnerability_type):
+        """Return cached templates for the target and type, or None if missing or expired."""
+        key = self.key(target, vulnerability_type)
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                row = self.conn.execute(
+                    "SELECT templates, created_at FROM suggestions WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    entry = (json.loads(row[0]), row[1])
+                    self._remember(key, entry)
+            if entry is None:
+                return None
+            templates, created_at = entry
+            if now - created_at > self.ttl:
+                self.memory.pop(key, None)
+                with self.conn:
+                    self.conn.execute("DELETE FROM suggestions WHERE key = ?", (key,))
+                return None
+            self.memory.move_to_end(key)
+        logging.info(f"Suggestion cache hit for {key}")
+        return list(templates)
+
+    def put(self, target, vulnerability_type, templates):
+        """Store a suggestion in memory and on disk."""
+        key = self.key(target, vulnerability_type)
+        entry = (list(templates), time.time())
+        with self.lock:
+            self._remember(key, entry)
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO suggestions (key, templates, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(entry[0]), entry[1])
+                )
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+def normalize_host(target):
+    """Reduce a target URL or bare host to lowercase host[:port], dropping default ports."""
+    target = (target or "").strip()
+    if "://" not in target:
+        target = f"http://{target}"
+    parts = urlsplit(target)
+    host = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port not in (80, 443):
+        return f"{host}:{port}"
+    return host
@@ -0,0 +1,32 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules are flat scripts importing each other by name. remote/ comes first (the helper
+# modules mirrored in local/ are identical); local/ adds the local-only ones such as finding_spool
+for directory in ("bench", "local", "remote"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+@pytest.fixture
+def local_agent(tmp_path, monkeypatch):
+    """local/agent3.py loaded with its state files, templates and chunk size in tmp_path."""
+    pytest.importorskip("requests")
+    templates_dir = tmp_path / "nuclei-templates"
+    (templates_dir / "http" / "exposures").mkdir(parents=True)
+    for name in ("a", "b", "c", "d", "e"):
+        (templates_dir / "http" / "exposures" / f"{name}.yaml").write_text(
+            f"id: {name}\ninfo:\n  severity: info\nhttp:\n  - method: GET\n")
+    for name in ("SUGGESTION_CACHE_DB", "SCAN_STATE_DB", "RATE_CONTROL_DB", "CHECKPOINT_DB"):
+        monkeypatch.setenv(name, str(tmp_path / f"{name.lower()}.sqlite"))
+    monkeypatch.setenv("TEMPLATE_INDEX_PATH", str(tmp_path / "template_index.json"))
+    monkeypatch.setenv("NUCLEI_TEMPLATES_DIR", str(templates_dir))
+    monkeypatch.setenv("CHECKPOINT_CHUNK_SIZE", "2")
+    spec = importlib.util.spec_from_file_location("local_agent3", os.path.join(ROOT, "local", "agent3.py"))
+    agent = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(agent)
+    yield agent
+    sys.modules.pop("local_agent3", None)
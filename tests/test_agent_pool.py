@@ -0,0 +1,86 @@
+import sys
+import threading
+import time
+
+import agent_pool
+from agent_pool import AgentPool, request_timeout
+
+# Answers each request line in order, echoing its request_id; "events" asks for that many
+# 200 KB scan_event lines first, more than a pipe buffer holds
+FAKE_AGENT = r'''
+import json, sys
+for line in sys.stdin:
+    request = json.loads(line)
+    for i in range(request.get("events", 0)):
+        print(json.dumps({"type": "scan_event", "request_id": request["request_id"], "event": "finding",
+                          "data": "x" * 200000}), flush=True)
+    print(json.dumps({"type": "response", "status": "success", "request_id": request["request_id"],
+                      "size": len(line)}), flush=True)
+'''
+
+def fake_pool(tmp_path, script=FAKE_AGENT, **kwargs):
+    path = tmp_path / "fake_agent.py"
+    path.write_text(script)
+    return AgentPool([sys.executable, str(path)], **dict(dict(size=1), **kwargs))
+
+def test_large_requests_do_not_block_streamed_events(tmp_path):
+    with fake_pool(tmp_path) as pool:
+        events = []
+        first_event = threading.Event()
+
+        def on_event(event, data):
+            events.append(event)
+            first_event.set()
+        streamed = threading.Thread(target=lambda: events.append(
+            pool.request({"type": "scan_request", "events": 5}, timeout=10, on_event=on_event)))
+        streamed.start()
+        assert first_event.wait(10)
+        # Sent while the agent is busy printing events, and larger than the stdin pipe buffer
+        response = pool.request({"type": "scan_request", "padding": "y" * 2_000_000}, timeout=10)
+        streamed.join(10)
+        assert response["status"] == "success" and response["size"] > 2_000_000
+        assert events[:5] == ["finding"] * 5 and events[5]["status"] == "success"
+
+def test_crashing_workers_are_restarted_with_backoff_then_given_up(tmp_path):
+    pool = fake_pool(tmp_path, "import sys; sys.exit(3)", max_restarts=2, restart_delay=0.05)
+    try:
+        deadline = time.monotonic() + 10
+        while pool.error is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert pool.failures == [3]
+        response = pool.request({"type": "scan_request"}, timeout=1)
+        assert response["status"] == "error"
+        assert response["errors"] == ["Agent worker exited with status 3 3 times in a row, not restarting it"]
+    finally:
+        pool.close()
+
+def test_request_timeout_scales_with_nuclei_runs(monkeypatch):
+    monkeypatch.setattr(agent_pool, "SCAN_TIMEOUT", 100)
+    monkeypatch.setattr(agent_pool, "REQUEST_SLACK", 10)
+    monkeypatch.setattr(agent_pool, "REQUEST_TIMEOUT", None)
+    scan = {"type": "scan_request", "target": "http://a", "targets_file": "http://b\nhttp://c\n# comment\n"}
+    assert request_timeout({"type": "suggest_templates"}) == 110
+    assert request_timeout(scan) == 110
+    assert request_timeout(dict(scan, fingerprint=True)) == 210
+    assert request_timeout(dict(scan, incremental=True)) == 310
+    assert request_timeout(dict(scan, incremental=True, fingerprint=True)) == 410
+    # A resumed checkpoint shares one Nuclei timeout across its chunks
+    assert request_timeout(dict(scan, incremental=True, resume="c1")) == 110
+    monkeypatch.setattr(agent_pool, "REQUEST_TIMEOUT", 50)
+    assert request_timeout(dict(scan, fingerprint=True)) == 50
+
+def test_timed_out_request_restarts_its_worker(tmp_path):
+    script = "import time\n" + FAKE_AGENT.replace("for line in sys.stdin:\n",
+                                                  "for line in sys.stdin:\n    if 'hang' in line: time.sleep(60)\n")
+    with fake_pool(tmp_path, script, restart_delay=0.05) as pool:
+        hung = pool.workers[0]
+        response = pool.request({"type": "scan_request", "hang": True}, timeout=0.2)
+        assert response["errors"] == ["Agent did not answer within 0.2 seconds"]
+        hung.reader.join(5)
+        assert hung.dead and hung.proc.returncode is not None
+        deadline = time.monotonic() + 5
+        while pool.workers[0] is hung:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert pool.request({"type": "scan_request"}, timeout=5)["status"] == "success"
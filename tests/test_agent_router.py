@@ -0,0 +1,78 @@
+import pytest
+
+pytest.importorskip("requests")
+
+import agent_router
+from agent_router import AgentRouter
+
+URLS = ["http://agent-1:8000", "http://agent-2:8000/", "http://agent-3:8000"]
+
+class Response:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        if self.body is None:
+            raise ValueError("not JSON")
+        return self.body
+
+@pytest.fixture
+def statuses(monkeypatch):
+    """Map of agent URL to the /status body it answers with; None answers with a broken body."""
+    statuses = {}
+    monkeypatch.setattr(agent_router.requests, "get",
+                        lambda url, timeout: Response(statuses[url[:-len("/status")]]), raising=False)
+    return statuses
+
+def test_urls_are_normalised():
+    router = AgentRouter(URLS + ["http://agent-1:8000/"])
+    assert router.urls == ["http://agent-1:8000", "http://agent-2:8000", "http://agent-3:8000"]
+
+def test_choose_spreads_by_reported_load(statuses):
+    router = AgentRouter(URLS)
+    statuses.update({
+        "http://agent-1:8000": {"scans_in_flight": 4, "jobs": {"workers": 2}},
+        "http://agent-2:8000": {"scans_in_flight": 1, "jobs": {"workers": 1}},
+        "http://agent-3:8000": {"scans_in_flight": 0, "jobs": {"workers": 4}},
+    })
+    router.check_all()
+    # Scans sent since the last report count towards an agent's load
+    chosen = [router.choose() for _ in range(4)]
+    assert chosen == ["http://agent-3:8000"] * 4
+    assert router.choose() == "http://agent-2:8000"
+    # A new report replaces the dispatched count
+    router.check("http://agent-3:8000")
+    assert {a["url"]: a["dispatched"] for a in router.snapshot()}["http://agent-3:8000"] == 0
+
+def test_failed_agents_are_left_out_until_they_recover(statuses):
+    router = AgentRouter(URLS[:2])
+    statuses.update({"http://agent-1:8000": None, "http://agent-2:8000": {"scans_in_flight": 9}})
+    router.check_all()
+    assert router.choose() == "http://agent-2:8000"
+    router.mark_failed("http://agent-2:8000", "connection refused")
+    assert router.choose() is None
+    statuses["http://agent-1:8000"] = {"scans_in_flight": 0}
+    router.check("http://agent-1:8000")
+    assert router.choose() == "http://agent-1:8000"
+    snapshot = {a["url"]: a for a in router.snapshot()}
+    assert snapshot["http://agent-2:8000"]["error"] == "connection refused"
+
+def test_exclude_and_prefer():
+    router = AgentRouter(URLS)
+    assert router.choose(exclude=URLS[:1]) != "http://agent-1:8000"
+    assert router.choose(prefer="http://agent-3:8000") == "http://agent-3:8000"
+    # An excluded or unhealthy preference gives way to the least-loaded agent
+    router.mark_failed("http://agent-3:8000", "down")
+    assert router.choose(prefer="http://agent-3:8000") in ("http://agent-1:8000", "http://agent-2:8000")
+
+def test_pinned_targets_stay_on_one_agent_within_the_slack():
+    router = AgentRouter(URLS, pin_targets=True, pin_slack=2)
+    pinned = router.choose("https://Example.com/login")
+    assert all(router.choose("http://example.com") == pinned for _ in range(2))
+    # Three more scans than the idle agents: the pin gives way
+    assert router.choose("example.com") != pinned
+    router.mark_failed(pinned, "down")
+    assert router.choose("example.com") != pinned
@@ -0,0 +1,97 @@
+import os
+
+from checkpoints import CheckpointStore, chunk_templates, replayed
+
+def test_chunk_templates():
+    assert chunk_templates(["a", "b", "c", "d", "e"], 2) == [["a", "b"], ["c", "d"], ["e"]]
+    assert chunk_templates(["a"], 0) == [["a"]]
+    assert chunk_templates([], 500) == []
+
+def test_checkpoint_records_finished_chunks_and_their_findings(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"))
+    store.create("c1", {"target": "http://example.com"}, [["a.yaml"], ["b.yaml"], ["c.yaml"]])
+    store.complete_chunk("c1", 1, iter([{"template-id": "b", "n": i} for i in range(5)]))
+
+    checkpoint = store.get("c1")
+    assert checkpoint["request"] == {"target": "http://example.com"}
+    assert checkpoint["chunks"] == [["a.yaml"], ["b.yaml"], ["c.yaml"]]
+    assert list(checkpoint["done"]) == [1]
+    assert [f["n"] for f in store.findings("c1", 1, page_size=2)] == [0, 1, 2, 3, 4]
+    assert list(store.findings("c1", 0)) == []
+
+    # A chunk run again replaces its findings
+    store.complete_chunk("c1", 1, [{"template-id": "b", "n": 9}])
+    assert [f["n"] for f in store.findings("c1", 1)] == [9]
+
+    store.delete("c1")
+    assert store.get("c1") is None
+    assert store.get(None) is None
+
+def test_create_drops_expired_checkpoints(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"), ttl=60)
+    store.create("old", {}, [["a.yaml"]])
+    store.conn.execute("UPDATE checkpoints SET updated_at = 0")
+    store.conn.commit()
+    store.create("new", {}, [["a.yaml"]])
+    assert store.get("old") is None
+    assert store.get("new") is not None
+
+def test_replayed_findings_are_marked_carried_over():
+    [finding] = replayed([{"template-id": "a"}], 0)
+    assert finding["carried_over"] is True
+    assert finding["carried_over_from"]
+
+def fake_nuclei(runs, failing):
+    """Stand-in for run_nuclei: one finding per template; chunks holding a template in failing exit with an error."""
+    def run_nuclei(target, templates=None, rate_limit=50, targets=None, **options):
+        from finding_spool import FindingSpool
+        runs.append(list(templates))
+        results = FindingSpool()
+        results.extend({"template-id": os.path.basename(path)[:-5], "host": target} for path in templates)
+        if failing & set(templates):
+            return {"results": results, "errors": ["Nuclei scan timed out"], "return_code": -9}
+        return {"results": results, "errors": [], "return_code": 0}
+    return run_nuclei
+
+def test_checkpointed_scan_resumes_only_the_unfinished_chunks(local_agent, monkeypatch):
+    runs = []
+    monkeypatch.setattr(local_agent, "run_nuclei", fake_nuclei(runs, {"http/exposures/c.yaml"}))
+    request = {"type": "scan_request", "target": "http://example.com", "templates": ["http/exposures/"],
+               "use_deepseek": False, "adaptive": False, "checkpoint": True}
+
+    first = local_agent.process_request(request)
+    assert first["status"] == "error"
+    assert first["resumable"] is True
+    assert first["checkpoint"]["chunks"] == 3
+    assert first["checkpoint"]["chunks_done"] == 2
+    assert runs == [["http/exposures/a.yaml", "http/exposures/b.yaml"],
+                    ["http/exposures/c.yaml", "http/exposures/d.yaml"],
+                    ["http/exposures/e.yaml"]]
+
+    runs.clear()
+    monkeypatch.setattr(local_agent, "run_nuclei", fake_nuclei(runs, set()))
+    resumed = local_agent.process_request({"type": "scan_request", "resume": first["checkpoint"]["id"]})
+    assert resumed["status"] == "success"
+    assert resumed["resumable"] is False
+    assert runs == [["http/exposures/c.yaml", "http/exposures/d.yaml"]]
+    results = list(resumed["results"])
+    assert sorted(f["template-id"] for f in results) == ["a", "b", "c", "d", "e"]
+    assert resumed["carried_over"] == 3
+    assert sum(1 for f in results if f.get("carried_over")) == 3
+    # Every chunk is done, so the checkpoint is gone
+    assert local_agent.checkpoints.get(first["checkpoint"]["id"]) is None
+
+def test_scan_without_checkpoint_runs_one_nuclei_process(local_agent, monkeypatch):
+    runs = []
+    monkeypatch.setattr(local_agent, "run_nuclei", fake_nuclei(runs, set()))
+    response = local_agent.process_request({"type": "scan_request", "target": "http://example.com",
+                                            "templates": ["http/exposures/"], "use_deepseek": False,
+                                            "adaptive": False})
+    assert response["status"] == "success"
+    assert runs == [["http/exposures/"]]
+    assert "checkpoint" not in response
+
+def test_resume_of_an_unknown_checkpoint_fails(local_agent):
+    response = local_agent.process_request({"type": "scan_request", "resume": "missing"})
+    assert response["status"] == "error"
+    assert response["errors"] == ["Checkpoint not found: missing"]
@@ -0,0 +1,39 @@
+import json
+
+from finding_spool import FindingSpool
+
+def findings(count):
+    return [{"template-id": f"t{i}", "matched-at": f"http://example.com/{i}"} for i in range(count)]
+
+def test_small_outputs_stay_in_memory():
+    spool = FindingSpool(max_bytes=10_000)
+    spool.extend(findings(3))
+    assert not spool.spilled
+    assert len(spool) == 3 and spool
+    assert list(spool) == findings(3)
+
+def test_large_outputs_spill_to_disk_in_order():
+    spool = FindingSpool(max_bytes=200)
+    spool.extend(findings(10))
+    assert spool.spilled
+    assert spool.items == []
+    assert len(spool) == 10
+    assert list(spool) == findings(10)
+    # Appending after iterating keeps writing at the end of the file
+    spool.append({"template-id": "last"}, size=len(json.dumps({"template-id": "last"})))
+    assert [f["template-id"] for f in spool][-2:] == ["t9", "last"]
+
+def test_close_drops_the_findings():
+    spool = FindingSpool(max_bytes=0)
+    spool.append({"template-id": "a"})
+    assert spool.spilled
+    spool.close()
+    assert not spool.spilled
+    assert list(spool) == []
+    assert len(spool) == 0 and not spool
+    # A closed spool can be filled again from scratch
+    spool.append({"template-id": "b"})
+    assert list(spool) == [{"template-id": "b"}] and spool.spilled
+
+def test_empty_spool_is_falsy():
+    assert not FindingSpool()
@@ -0,0 +1,26 @@
+from fingerprint import detect_technologies, technology_name, technology_tags
+
+def test_technology_name_from_template_id():
+    assert technology_name({"template-id": "wordpress-detect"}) == "wordpress"
+    assert technology_name({"template-id": "Apache-Tomcat-Version"}) == "apache-tomcat"
+    assert technology_name({"template-id": "phpmyadmin-panel"}) == "phpmyadmin"
+
+def test_technology_name_from_matcher_of_multi_technology_templates():
+    assert technology_name({"template-id": "tech-detect", "matcher-name": "Microsoft IIS"}) == "microsoft-iis"
+    assert technology_name({"template-id": "waf-detect", "matcher-name": "cloudflare"}) == "cloudflare"
+    assert technology_name({"template-id": "tech-detect"}) is None
+
+def test_detect_technologies_is_sorted_and_distinct():
+    findings = [
+        {"template-id": "tech-detect", "matcher-name": "nginx"},
+        {"template-id": "nginx-version"},
+        {"template-id": "wordpress-detect"},
+        {"template-id": "tech-detect", "matcher-name": ""}
+    ]
+    assert detect_technologies(findings) == ["nginx", "wordpress"]
+
+def test_technology_tags_maps_known_and_passes_unknown_technologies():
+    assert technology_tags(["wordpress", "nginx"]) == ["nginx", "wordpress", "wp", "wp-plugin", "wp-theme"]
+    assert technology_tags(["laravel", "php"]) == ["laravel", "php"]
+    assert technology_tags(["strapi"]) == ["strapi"]
+    assert technology_tags(None) == []
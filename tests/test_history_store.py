@@ -0,0 +1,163 @@
+import json
+import sqlite3
+
+from history_store import HistoryStore
+
+def finding(template_id="tech-detect", host="example.com", matched_at="http://example.com/", **extra):
+    return dict({"template-id": template_id, "host": host, "matched-at": matched_at,
+                 "info": {"name": template_id, "severity": "info"}}, **extra)
+
+def scan(scan_id, timestamp="2026-01-01 10:00:00", target="http://example.com", results=(), status="success",
+         **request):
+    return {
+        "scan_id": scan_id,
+        "timestamp": timestamp,
+        "request": dict({"type": "scan_request", "target": target, "vulnerability_type": "http"}, **request),
+        "response": {"type": "scan_response", "status": status, "results": list(results), "errors": []}
+    }
+
+def test_save_and_get_scan_round_trip(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    raw = {"request": "GET / HTTP/1.1", "response": "HTTP/1.1 200 OK\r\n\r\n" + "x" * 2000, "curl-command": "curl"}
+    store.save_scan(scan("s1", results=[finding(), finding("exposed-git", **raw)]))
+
+    saved = store.get_scan("s1")
+    assert saved["request"]["target"] == "http://example.com"
+    assert saved["response"]["status"] == "success"
+    assert saved["findings_count"] == 2
+    assert [f["template-id"] for f in saved["response"]["results"]] == ["tech-detect", "exposed-git"]
+    # Raw HTTP fields are only loaded on demand
+    assert "response" not in saved["response"]["results"][1]
+    assert store.get_finding_raw(saved["response"]["results"][1]["finding_id"]) == raw
+    assert store.get_scan("s1", include_raw=True)["response"]["results"][1]["response"] == raw["response"]
+    assert store.get_scan("missing") is None
+
+def test_import_json_runs_once(tmp_path):
+    history_file = tmp_path / "scan_history.json"
+    history_file.write_text(json.dumps([scan("s1", results=[finding()]), scan("s2", "2026-01-02 10:00:00")]))
+    store = HistoryStore(str(tmp_path / "history.db"))
+
+    assert store.import_json(str(history_file)) == 2
+    assert store.import_json(str(history_file)) == 0
+    assert [s["scan_id"] for s in store.list_scans()] == ["s2", "s1"]
+    assert store.get_scan("s1")["response"]["results"][0]["template-id"] == "tech-detect"
+
+def test_import_json_without_file_is_a_no_op(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    assert store.import_json(str(tmp_path / "missing.json")) == 0
+    assert store.list_scans() == []
+
+def test_query_scans_pages_through_the_history_newest_first(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    for i in range(7):
+        store.save_scan(scan(f"s{i}", f"2026-01-0{i + 1} 10:00:00"))
+
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = store.query_scans(limit=3, cursor=cursor)
+        pages.append([s["scan_id"] for s in page])
+        if not cursor:
+            break
+    assert pages == [["s6", "s5", "s4"], ["s3", "s2", "s1"], ["s0"]]
+
+def test_query_scans_pages_scans_sharing_a_timestamp(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    for scan_id in ("a", "b", "c", "d"):
+        store.save_scan(scan(scan_id))
+
+    first, cursor = store.query_scans(limit=2)
+    second, cursor = store.query_scans(limit=2, cursor=cursor)
+    assert [s["scan_id"] for s in first + second] == ["d", "c", "b", "a"]
+    assert cursor is None
+
+def test_query_scans_filters(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.save_scan(scan("s1", "2026-01-01 10:00:00", target="http://a"))
+    store.save_scan(scan("s2", "2026-01-02 23:30:00", target="http://b", status="error"))
+    store.save_scan(scan("s3", "2026-01-03 10:00:00", target="http://a", vulnerability_type="cves"))
+
+    def ids(**filters):
+        return [s["scan_id"] for s in store.query_scans(**filters)[0]]
+
+    assert ids(target="http://a") == ["s3", "s1"]
+    assert ids(status="error") == ["s2"]
+    assert ids(vulnerability_type="cves") == ["s3"]
+    # date_to includes the whole day
+    assert ids(date_from="2026-01-02", date_to="2026-01-02") == ["s2"]
+
+def test_query_scans_ignores_a_malformed_cursor_and_clamps_the_limit(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    for i in range(3):
+        store.save_scan(scan(f"s{i}", f"2026-01-0{i + 1} 10:00:00"))
+
+    page, _ = store.query_scans(cursor="not a cursor")
+    assert len(page) == 3
+    page, cursor = store.query_scans(limit=-5)
+    assert len(page) == 1 and cursor
+
+def test_findings_are_stored_once_and_diffed_across_scans(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    fixed = finding("exposed-git", matched_at="http://example.com/.git/config")
+    kept = finding("tech-detect", matched_at="http://example.com/")
+    new = finding("open-redirect", matched_at="http://example.com/?next=//evil")
+    store.save_scan(scan("old", "2026-01-01 10:00:00", results=[fixed, kept]))
+    # Same finding reported at an equivalent URL: default port, case and trailing slash differ
+    store.save_scan(scan("new", "2026-01-02 10:00:00", results=[
+        finding("tech-detect", matched_at="HTTP://Example.com:80"), new]))
+
+    assert store._conn().execute("SELECT COUNT(*) FROM findings").fetchone()[0] == 3
+    diff = store.diff_scans("old", "new")
+    assert [f["template-id"] for f in diff["new"]] == ["open-redirect"]
+    assert [f["template-id"] for f in diff["fixed"]] == ["exposed-git"]
+    assert [f["template-id"] for f in diff["unchanged"]] == ["tech-detect"]
+
+def test_previous_scan_id_skips_other_targets_and_pending_scans(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.save_scan(scan("first", "2026-01-01 10:00:00"))
+    store.save_scan(scan("other", "2026-01-02 10:00:00", target="http://other.com"))
+    store.save_scan(scan("running", "2026-01-03 10:00:00", status="pending"))
+    store.save_scan(scan("latest", "2026-01-04 10:00:00"))
+
+    assert store.previous_scan_id("latest") == "first"
+    assert store.previous_scan_id("first") is None
+    assert store.previous_scan_id("missing") is None
+
+def test_carried_over_findings_keep_their_origin(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.save_scan(scan("s1", results=[finding(carried_over=True, carried_over_from="2025-12-31 09:00:00")]))
+    result = store.get_scan("s1")["response"]["results"][0]
+    assert result["carried_over"] is True
+    assert result["carried_over_from"] == "2025-12-31 09:00:00"
+
+def test_per_scan_findings_are_migrated_to_the_deduplicated_layout(tmp_path):
+    # The first SQLite layout stored every finding once per scan, raw fields as plain JSON
+    path = str(tmp_path / "history.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE scans (scan_id TEXT PRIMARY KEY, timestamp TEXT NOT NULL, target TEXT, vulnerability_type TEXT,
+                            status TEXT, request TEXT NOT NULL, response_meta TEXT NOT NULL,
+                            findings_count INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE findings (finding_id INTEGER PRIMARY KEY AUTOINCREMENT, scan_id TEXT NOT NULL, seq INTEGER NOT NULL,
+                               template_id TEXT, severity TEXT, host TEXT, matched_at TEXT, data TEXT NOT NULL);
+        CREATE INDEX idx_findings_scan ON findings (scan_id, seq);
+        CREATE TABLE finding_raw (finding_id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+    for scan_id, timestamp in (("s1", "2026-01-01 10:00:00"), ("s2", "2026-01-02 10:00:00")):
+        conn.execute("INSERT INTO scans VALUES (?, ?, 'http://example.com', 'http', 'success', '{}', '{}', 1)",
+                     (scan_id, timestamp))
+        finding_id = conn.execute("INSERT INTO findings (scan_id, seq, template_id, data) VALUES (?, 0, ?, ?)",
+                                  (scan_id, "tech-detect", json.dumps(finding()))).lastrowid
+        conn.execute("INSERT INTO finding_raw VALUES (?, ?)", (finding_id, json.dumps({"request": scan_id})))
+    conn.commit()
+    conn.close()
+
+    store = HistoryStore(path)
+    assert store._conn().execute("SELECT COUNT(*) FROM findings").fetchone()[0] == 1
+    first = store.get_scan("s1", include_raw=True)["response"]["results"]
+    second = store.get_scan("s2", include_raw=True)["response"]["results"]
+    assert first[0]["finding_id"] == second[0]["finding_id"]
+    # The latest sighting's raw fields win
+    assert second[0]["request"] == "s2"
+    assert store.diff_scans("s1", "s2")["unchanged"][0]["template-id"] == "tech-detect"
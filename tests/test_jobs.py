@@ -0,0 +1,157 @@
+import asyncio
+import json
+
+import pytest
+
+from jobs import COMPLETED, FAILED, QUEUED, RUNNING, JobManager, JobQueueFull, JobStore
+
+def scan_runner(findings=3, delay=0.01):
+    async def runner(request, job_id=None):
+        for i in range(findings):
+            yield {"event": "progress", "data": json.dumps({"done": i})}
+            yield {"event": "finding", "data": json.dumps({"template-id": f"t{i}", "target": request["target"]})}
+            await asyncio.sleep(delay)
+        yield {"event": "summary", "data": json.dumps({"status": "success", "findings": findings})}
+    return runner
+
+def manager(store, runner, **kwargs):
+    kwargs = dict(dict(workers=1, poll_interval=0.01, flush_interval=0.01), **kwargs)
+    return JobManager(store, runner, **kwargs)
+
+async def run_job(jobs, request):
+    await jobs.start()
+    try:
+        job_id = await jobs.submit(request)
+        events = [event async for event in jobs.follow(job_id)]
+    finally:
+        await jobs.stop()
+    return job_id, events
+
+def test_job_runs_to_completion_and_keeps_findings(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id, events = asyncio.run(run_job(manager(store, scan_runner()), {"target": "http://a"}))
+
+    ids = [int(event["id"]) for event in events]
+    assert ids == sorted(set(ids)) and ids[-1] == 7
+    # A progress event can be compacted away before a slow follower reads it, never a finding
+    assert [event["event"] for event in events if event["event"] != "progress"] == ["finding"] * 3 + ["summary"]
+    job = store.get(job_id)
+    assert job["status"] == COMPLETED
+    assert job["summary"] == {"status": "success", "findings": 3}
+    assert job["findings"] == 3
+    # Progress events are dropped once the job has finished
+    assert [event["event"] for event in store.events(job_id, 0, -1)] == ["finding"] * 3 + ["summary"]
+
+def test_job_without_summary_fails(tmp_path):
+    async def runner(request, job_id=None):
+        yield {"event": "finding", "data": "{}"}
+
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id, events = asyncio.run(run_job(manager(store, runner), {"target": "http://a"}))
+    assert store.get(job_id)["status"] == FAILED
+    assert [event["event"] for event in events] == ["finding", "summary"]
+    assert json.loads(events[-1]["data"])["errors"] == ["Scan ended without a summary"]
+
+def test_job_whose_runner_raises_ends_with_an_error_summary(tmp_path):
+    async def runner(request, job_id=None):
+        raise RuntimeError("checkpoint store is locked")
+        yield
+
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id, events = asyncio.run(run_job(manager(store, runner), {"target": "http://a"}))
+    # Followers get a summary instead of a stream that just stops
+    assert [event["event"] for event in events] == ["summary"]
+    summary = json.loads(events[0]["data"])
+    assert summary["status"] == "error" and summary["errors"] == ["checkpoint store is locked"]
+    job = store.get(job_id)
+    assert job["status"] == FAILED and job["summary"] == summary
+
+def test_job_failing_outside_its_runner_ends_with_an_error_summary(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    jobs = manager(store, scan_runner(findings=1))
+
+    async def broken_run(job_id):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(jobs, "_run", broken_run)
+    job_id, events = asyncio.run(run_job(jobs, {"target": "http://a"}))
+    assert [event["event"] for event in events] == ["summary"]
+    assert store.get(job_id)["status"] == FAILED
+    assert store.get(job_id)["summary"]["errors"] == ["database is locked"]
+
+def test_follow_resumes_after_last_event_id(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    jobs = manager(store, scan_runner())
+
+    async def scenario():
+        job_id, _ = await run_job(jobs, {"target": "http://a"})
+        return [event async for event in jobs.follow(job_id, after=2)]
+
+    assert [event["event"] for event in asyncio.run(scenario())] == ["finding", "finding", "summary"]
+
+def test_append_events_stores_a_batch(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.create({"target": "http://a"})
+    store.append_events(job_id, [(1, "finding", "{}"), (2, "progress", "{}")])
+    assert [event["seq"] for event in store.events(job_id)] == [1, 2]
+    assert store.last_seq(job_id) == 2
+    assert store.last_seq("missing") == 0
+
+def test_interrupted_job_is_rerun_with_events_numbered_after_the_old_ones(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    store = JobStore(path)
+    job_id = store.create({"target": "http://a"})
+    store.set_status(job_id, RUNNING)
+    store.append_events(job_id, [(1, "finding", json.dumps({"template-id": "old"})), (2, "progress", "{}")])
+
+    # A new process finds the job still marked running
+    restarted = JobStore(path)
+    assert restarted.requeue_interrupted() == [job_id]
+    assert restarted.get(job_id)["status"] == QUEUED
+    assert [(e["seq"], e["event"]) for e in restarted.events(job_id)] == [(3, "reset")]
+
+    jobs = manager(restarted, scan_runner(findings=1))
+
+    async def scenario():
+        await jobs.start()
+        try:
+            # A client that saw the first two events reconnects with Last-Event-ID 2
+            return [event async for event in jobs.follow(job_id, after=2)]
+        finally:
+            await jobs.stop()
+
+    # The progress event (4) may already be compacted away when the job finishes first
+    events = [event for event in asyncio.run(scenario()) if event["event"] != "progress"]
+    assert [(event["id"], event["event"]) for event in events] == [("3", "reset"), ("5", "finding"), ("6", "summary")]
+    assert restarted.get(job_id)["status"] == COMPLETED
+    assert restarted.get(job_id)["findings"] == 1
+
+def test_purge_deletes_jobs_finished_before_the_cutoff(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    old = store.create({"target": "http://old"})
+    store.append_events(old, [(1, "finding", "{}")])
+    store.set_status(old, COMPLETED, {"status": "success"})
+    store.conn.execute("UPDATE jobs SET finished_at = '2000-01-01 00:00:00' WHERE job_id = ?", (old,))
+    store.conn.commit()
+    running = store.create({"target": "http://running"})
+    store.set_status(running, RUNNING)
+
+    assert store.purge("2001-01-01 00:00:00") == 1
+    assert store.get(old) is None
+    assert store.events(old) == []
+    assert store.get(running)["status"] == RUNNING
+
+def test_submit_rejects_jobs_past_max_queued(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    jobs = manager(store, scan_runner(), workers=0, max_queued=1)
+
+    async def scenario():
+        await jobs.start()
+        await jobs.submit({"target": "http://a"})
+        try:
+            await jobs.submit({"target": "http://b"})
+        finally:
+            await jobs.stop()
+
+    with pytest.raises(JobQueueFull):
+        asyncio.run(scenario())
+    assert jobs.stats()["queued"] == 1
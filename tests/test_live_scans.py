@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from history_store import HistoryStore
+from live_scans import LiveScans, ScanDispatcher, ScanQueueFull
+
+def test_live_scan_lifecycle():
+    live = LiveScans()
+    live.open(["s1"])
+    assert live.get("s1") == {"status": "pending", "progress": None, "findings": [], "count": 0, "restarts": 0,
+                              "done": False}
+    live.add("s1", {"template-id": "a", "request": "GET / HTTP/1.1", "response": "HTTP/1.1 200 OK"})
+    live.progress("s1", {"percent": 50})
+    live.add("s1", {"template-id": "b"})
+    scan = live.get("s1", after=1)
+    assert scan["status"] == "running" and scan["progress"] == {"percent": 50}
+    assert scan["findings"] == [{"template-id": "b"}] and scan["count"] == 2
+    # Raw HTTP fields stay out of the live view
+    assert live.get("s1")["findings"][0] == {"template-id": "a"}
+    live.close("s1", "success")
+    assert live.get("s1")["done"] and live.get("s1")["status"] == "success"
+    # Updates to scans that are not open here are ignored
+    live.add("other", {"template-id": "c"})
+    assert live.get("other") is None
+
+def test_restart_drops_the_findings_shown():
+    live = LiveScans()
+    live.open(["s1"])
+    live.add("s1", {"template-id": "a"})
+    live.restart("s1")
+    scan = live.get("s1")
+    assert scan["findings"] == [] and scan["count"] == 0 and scan["restarts"] == 1
+
+def test_closed_scans_expire_after_keep(monkeypatch):
+    live = LiveScans(keep=60)
+    live.open(["old", "running"])
+    live.close("old", "success")
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+    live.open(["new"])
+    assert live.get("old") is None
+    assert live.get("running") is not None and live.get("new") is not None
+
+def test_dispatcher_runs_scans_in_order():
+    dispatcher = ScanDispatcher(workers=1)
+    done = []
+    for i in range(5):
+        dispatcher.submit(done.append, i)
+    # A failing scan does not stop the worker
+    dispatcher.submit(lambda: 1 / 0)
+    dispatcher.submit(done.append, "last")
+    dispatcher.queue.join()
+    assert done == [0, 1, 2, 3, 4, "last"]
+
+def test_dispatcher_refuses_scans_beyond_max_queued():
+    dispatcher = ScanDispatcher(workers=1, max_queued=2)
+    started, release = threading.Event(), threading.Event()
+    dispatcher.submit(lambda: (started.set(), release.wait(5)))
+    assert started.wait(5)
+    dispatcher.submit(lambda: None)
+    dispatcher.submit(lambda: None)
+    assert dispatcher.queued() == 2
+    with pytest.raises(ScanQueueFull):
+        dispatcher.submit(lambda: None)
+    release.set()
+    dispatcher.queue.join()
+    assert dispatcher.queued() == 0
+
+def pending(scan_id, timestamp):
+    return {"scan_id": scan_id, "timestamp": timestamp,
+            "request": {"type": "scan_request", "target": "http://example.com", "vulnerability_type": "http"},
+            "response": {"type": "scan_response", "status": "pending", "results": [], "errors": []}}
+
+def test_pending_scans_can_be_failed_selectively(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.save_scan(pending("s2", "2026-01-01 11:00:00"))
+    store.save_scan(pending("s1", "2026-01-01 10:00:00"))
+    assert [s["scan_id"] for s in store.pending_scans()] == ["s1", "s2"]
+    assert store.get_status("s1") == "pending" and store.get_status("missing") is None
+
+    assert store.fail_pending("Agent lost the job", scan_ids=["s1", "missing"]) == 1
+    assert store.get_status("s1") == "error"
+    assert store.get_scan("s1")["response"]["errors"] == ["Agent lost the job"]
+    assert [s["scan_id"] for s in store.pending_scans()] == ["s2"]
+
+    assert store.fail_pending("Interrupted by a restart") == 1
+    assert store.pending_scans() == []
+    assert store.fail_pending("Interrupted by a restart") == 0
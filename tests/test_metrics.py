@@ -0,0 +1,63 @@
+from metrics import PhaseTimer, Registry, merge_snapshots
+
+def test_counter_and_gauge_render():
+    registry = Registry()
+    scans = registry.counter("scans_total", "Scans run", ["status"])
+    running = registry.gauge("scans_running", "Scans in flight")
+    scans.inc(status="success")
+    scans.inc(2, status="error")
+    with running.track():
+        assert running.get() == 1
+    assert running.get() == 0
+    text = registry.render()
+    assert "# TYPE scans_total counter" in text
+    assert 'scans_total{status="success"} 1' in text
+    assert 'scans_total{status="error"} 2' in text
+    # Unlabelled metrics are exposed at zero before they are used
+    assert "scans_running 0" in text
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    duration = registry.histogram("duration_seconds", "Duration", buckets=(1, 5))
+    for value in (0.5, 1, 3, 10):
+        duration.observe(value)
+    text = registry.render()
+    assert 'duration_seconds_bucket{le="1"} 2' in text
+    assert 'duration_seconds_bucket{le="5"} 3' in text
+    assert 'duration_seconds_bucket{le="+Inf"} 4' in text
+    assert "duration_seconds_sum 14.5" in text
+    assert "duration_seconds_count 4" in text
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("errors_total", "Errors", ["reason"]).inc(reason='bad "quote"\n')
+    assert 'errors_total{reason="bad \\"quote\\"\\n"} 1' in registry.render()
+
+def test_snapshots_of_other_processes_are_added_up():
+    def process(amount):
+        registry = Registry()
+        registry.counter("scans_total", "Scans run", ["status"]).inc(amount, status="success")
+        registry.histogram("duration_seconds", "Duration", buckets=(1,)).observe(amount)
+        return registry
+    ours, theirs = process(1), process(2)
+    text = ours.render(theirs.snapshot(), None)
+    assert 'scans_total{status="success"} 3' in text
+    assert 'duration_seconds_bucket{le="1"} 1' in text
+    assert "duration_seconds_count 2" in text
+    # Merging copies samples, so the source snapshot is left alone
+    snapshot = theirs.snapshot()
+    merge_snapshots(snapshot, snapshot)
+    assert snapshot["duration_seconds"]["samples"][0][1]["count"] == 1
+
+def test_phase_timer_breakdown():
+    registry = Registry()
+    phases = registry.histogram("phase_seconds", "Phases", ["phase"])
+    timer = PhaseTimer(phases)
+    with timer.phase("nuclei"):
+        pass
+    timer.add("save", 0.25)
+    timer.add("save", 0.25)
+    breakdown = timer.breakdown()
+    assert set(breakdown) == {"nuclei", "save", "total"}
+    assert breakdown["save"] == 0.5
+    assert 'phase_seconds_count{phase="save"} 2' in registry.render()
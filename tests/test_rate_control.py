@@ -0,0 +1,71 @@
+import time
+
+from rate_control import RateController, ScanObservation, is_rate_limited
+
+def clean_run(requests=100, errors=0):
+    observation = ScanObservation()
+    observation.started_at = time.time() - 1
+    observation.observe("progress", {"status": "started"})
+    observation.observe("progress", {"requests": str(requests), "errors": str(errors)})
+    return observation
+
+def test_settings_keep_nuclei_defaults_for_unknown_hosts(tmp_path):
+    controller = RateController(str(tmp_path / "rates.db"))
+    settings = controller.settings(["http://a.com", "http://b.com"], rate_limit=50)
+    assert settings == {"rate_limit": 50, "concurrency": None, "bulk_size": None, "learned": 0}
+    assert controller.settings(["http://a.com"], rate_limit=50, max_rate=20)["rate_limit"] == 20
+
+def test_clean_run_raises_the_rate(tmp_path):
+    controller = RateController(str(tmp_path / "rates.db"))
+    outcomes = controller.record(["http://a.com/"], 50, clean_run())
+    assert outcomes == {"a.com": {"outcome": "raise", "rate": 75.0}}
+
+    settings = controller.settings(["https://a.com/login"], rate_limit=50)
+    assert settings["rate_limit"] == 75
+    assert settings["concurrency"] == 15
+    assert settings["bulk_size"] == 1
+    assert settings["learned"] == 1
+
+def test_errors_and_429s_back_off(tmp_path):
+    controller = RateController(str(tmp_path / "rates.db"))
+    assert controller.record(["a.com"], 50, clean_run(errors=30))["a.com"]["outcome"] == "backoff"
+
+    observation = clean_run()
+    observation.add_line("[WRN] got 429 Too Many Requests")
+    assert controller.record(["b.com"], 50, observation) == {"b.com": {"outcome": "backoff", "rate": 25.0}}
+
+def test_only_the_unresponsive_host_of_a_batch_backs_off(tmp_path):
+    controller = RateController(str(tmp_path / "rates.db"))
+    observation = ScanObservation()
+    observation.add_line("[WRN] Skipped b.com:80 from target list as found unresponsive 30 times")
+    outcomes = controller.record(["a.com", "b.com"], 100, observation)
+    assert outcomes["a.com"] == {"outcome": "hold", "rate": 50.0}
+    assert outcomes["b.com"] == {"outcome": "backoff", "rate": 25.0}
+
+    # The batch runs at the slowest host's rate for each host
+    assert controller.settings(["a.com", "b.com"], rate_limit=100)["rate_limit"] == 50
+
+def test_rates_stay_within_bounds(tmp_path):
+    controller = RateController(str(tmp_path / "rates.db"), min_rate=10, max_rate=60)
+    assert controller.record(["a.com"], 50, clean_run())["a.com"]["rate"] == 60
+    observation = ScanObservation()
+    observation.timed_out = True
+    for _ in range(4):
+        controller.record(["a.com"], 50, observation)
+    assert controller.learned(["a.com"]) == {"a.com": 10}
+    assert controller.list_rates()[0]["scans"] == 5
+
+def test_observation_totals_sum_the_latest_stats_of_each_run():
+    observation = ScanObservation()
+    observation.observe("progress", {"status": "started", "shard": 0})
+    observation.observe("progress", {"shard": 0, "requests": "10", "errors": "1"})
+    observation.observe("progress", {"shard": 0, "requests": "40", "errors": "2"})
+    observation.observe("progress", {"status": "started", "shard": 1})
+    observation.observe("progress", {"shard": 1, "requests": "20", "errors": None})
+    totals = observation.totals()
+    assert (totals["requests"], totals["errors"]) == (60, 2)
+
+def test_is_rate_limited():
+    assert is_rate_limited("HTTP/1.1 429")
+    assert is_rate_limited("too many requests")
+    assert not is_rate_limited("status 4290")
@@ -0,0 +1,66 @@
+from scan_state import ScanState
+
+def entry(template_id, digest="h1"):
+    return {"id": template_id, "path": f"http/{template_id}.yaml", "hash": digest}
+
+def test_plan_runs_everything_for_a_new_target(tmp_path):
+    state = ScanState(str(tmp_path / "state.db"))
+    entries = [entry("a"), entry("b")]
+    assert state.plan("http://example.com", entries) == entries
+
+def test_plan_skips_templates_already_run(tmp_path):
+    state = ScanState(str(tmp_path / "state.db"))
+    state.record("http://example.com/", [entry("a"), entry("b")], [])
+
+    # Changed, new and unchanged templates; the target matches without its trailing slash
+    due = state.plan("http://example.com", [entry("a", "h2"), entry("b"), entry("c")])
+    assert [e["id"] for e in due] == ["a", "c"]
+
+def test_plan_reruns_stale_templates(tmp_path):
+    state = ScanState(str(tmp_path / "state.db"), stale_after=3600)
+    state.record("http://example.com", [entry("a")], [], run_at=0)
+    assert state.plan("http://example.com", [entry("a")]) == [entry("a")]
+    assert state.plan("http://example.com", [entry("a")], stale_after=10 ** 12) == []
+
+def test_findings_are_carried_over_and_replaced_by_a_rerun(tmp_path):
+    state = ScanState(str(tmp_path / "state.db"))
+    findings = [{"template-id": "a", "matched-at": "http://example.com/1"},
+                {"template-id": "b", "matched-at": "http://example.com/2"},
+                {"template-id": "other", "matched-at": "http://example.com/3"}]
+    state.record("http://example.com", [entry("a"), entry("b")], iter(findings))
+
+    carried = state.carried_over("http://example.com", ["a", "b"])
+    assert [f["matched-at"] for f in carried] == ["http://example.com/1", "http://example.com/2"]
+    assert all(f["carried_over"] and f["carried_over_from"] for f in carried)
+
+    # Template a runs again and finds nothing: its old finding goes, b's stays
+    state.record("http://example.com", [entry("a")], [])
+    assert [f["template-id"] for f in state.carried_over("http://example.com", ["a", "b"])] == ["b"]
+    assert state.carried_over("http://other.com", ["a", "b"]) == []
+
+def recording_nuclei(runs):
+    """Stand-in for the local agent's run_nuclei recording the templates of each run."""
+    def run_nuclei(target, templates=None, rate_limit=50, targets=None, **options):
+        from finding_spool import FindingSpool
+        runs.append(templates)
+        return {"results": FindingSpool(), "errors": [], "return_code": 0}
+    return run_nuclei
+
+def test_incremental_rescan_runs_only_new_templates(local_agent, monkeypatch):
+    runs = []
+    monkeypatch.setattr(local_agent, "run_nuclei", recording_nuclei(runs))
+    first = local_agent.run_incremental("http://example.com", ["http/exposures/"])
+    assert len(runs[0]) == 5 and first["templates_rerun"] == 5
+    second = local_agent.run_incremental("http://example.com", ["http/exposures/"])
+    assert len(runs) == 1
+    assert second["templates_rerun"] == 0 and second["templates_skipped"] == 5
+
+def test_incremental_scan_without_templates_is_a_full_scan(local_agent, monkeypatch):
+    runs = []
+    monkeypatch.setattr(local_agent, "run_nuclei", recording_nuclei(runs))
+    response = local_agent.process_request({"type": "scan_request", "target": "http://example.com",
+                                            "use_deepseek": False, "adaptive": False, "incremental": True})
+    # Nuclei picks its default templates rather than getting every template in the repository listed
+    assert response["status"] == "success"
+    assert runs == [[]]
+    assert "templates_rerun" not in response
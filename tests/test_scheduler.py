@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import INTERRUPTED, SKIPPED, ScheduleStore, Scheduler, next_run_after, parse_at, parse_interval
+
+class Dispatch:
+    """Records dispatched scans and holds them running until released."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def __call__(self, schedule, group, rate_limit):
+        self.calls.append((schedule["name"], group["name"], rate_limit))
+        self.release.wait(5)
+        return "success"
+
+@pytest.fixture
+def store(tmp_path):
+    store = ScheduleStore(str(tmp_path / "schedules.db"))
+    store.save_group("web", ["http://a.example", "http://b.example"])
+    return store
+
+def wait_idle(scheduler):
+    deadline = time.time() + 5
+    while scheduler.active() or any(s["running_since"] for s in scheduler.store.list()):
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+def test_parse_interval_and_at():
+    assert parse_interval(3600) == 3600
+    assert parse_interval("30m") == 1800
+    assert parse_interval(" 1w ") == 7 * 86400
+    with pytest.raises(ValueError):
+        parse_interval("10s")
+    with pytest.raises(ValueError):
+        parse_interval("soon")
+    assert parse_at("07:30") == (7, 30)
+    assert parse_at("") is None
+    with pytest.raises(ValueError):
+        parse_at("25:00")
+
+def test_next_run_follows_interval_slots():
+    schedule = {"schedule_id": "s", "interval": 3600, "at": None, "created_at": 1000.0}
+    assert next_run_after(schedule, 500) == 1000.0
+    assert next_run_after(schedule, 1000) == 4600.0
+    assert next_run_after(schedule, 8000) == 8200.0
+    offset = next_run_after(schedule, 500, spread=600) - 1000.0
+    assert 0 <= offset < 600
+    assert next_run_after(schedule, 500, spread=600) == next_run_after(schedule, 500, spread=600)
+
+def test_groups_in_use_cannot_be_deleted(store):
+    schedule = store.create("nightly", "web", {"templates": ["cves"]}, "1h")
+    assert store.groups()["web"]["targets"] == ["http://a.example", "http://b.example"]
+    assert not store.delete_group("web")
+    assert store.delete(schedule["schedule_id"])
+    assert store.delete_group("web")
+    assert store.groups() == {}
+
+def test_tick_runs_due_schedules_and_skips_active_ones(store):
+    schedule = store.create("nightly", "web", {"rate_limit": 20}, "1h")
+    dispatch = Dispatch()
+    scheduler = Scheduler(store, dispatch, spread=0)
+    due = schedule["next_run_at"]
+    assert scheduler.tick(now=due - 1) == []
+    assert scheduler.tick(now=due) == [schedule["schedule_id"]]
+    assert store.get(schedule["schedule_id"])["next_run_at"] == due + 3600
+    # The next slot comes while the first run is still going
+    assert scheduler.tick(now=due + 3600) == []
+    assert store.get(schedule["schedule_id"])["last_status"] == SKIPPED
+    dispatch.release.set()
+    wait_idle(scheduler)
+    assert dispatch.calls == [("nightly", "web", 20)]
+    saved = store.get(schedule["schedule_id"])
+    assert saved["last_status"] == "success" and saved["running_since"] is None
+
+def test_budgets_limit_concurrency_and_rate(store):
+    store.save_group("api", ["http://c.example"], max_concurrent=1, rate_budget=30)
+    first = store.create("api-1", "api", {"rate_limit": 20}, "1h")
+    second = store.create("api-2", "api", {"rate_limit": 20}, "1h")
+    third = store.create("web", "web", {"rate_limit": 50}, "1h")
+    dispatch = Dispatch()
+    scheduler = Scheduler(store, dispatch, max_concurrent=2, rate_budget=60, spread=0)
+    now = max(s["next_run_at"] for s in (first, second, third))
+    started = scheduler.tick(now=now)
+    # One api scan fits the group; the web scan gets what is left of the global budget
+    assert len(started) == 2 and third["schedule_id"] in started
+    assert sorted(run["rate_limit"] for run in scheduler.active()) == [20, 40]
+    waiting = ({first["schedule_id"], second["schedule_id"]} - set(started)).pop()
+    assert not scheduler.run_now(waiting)
+    dispatch.release.set()
+    wait_idle(scheduler)
+    # The schedule left waiting is still due
+    assert [s["schedule_id"] for s in store.due(now)] == [waiting]
+
+def test_scans_below_min_rate_wait(store):
+    store.create("web", "web", {"rate_limit": 50}, "1h")
+    scheduler = Scheduler(store, Dispatch(), rate_budget=3, spread=0, min_rate=5)
+    assert scheduler.tick(now=store.list()[0]["next_run_at"]) == []
+
+def test_missing_group_is_skipped(store):
+    schedule = store.create("orphan", "gone", {}, "1h")
+    scheduler = Scheduler(store, Dispatch(), spread=0)
+    assert scheduler.tick(now=schedule["next_run_at"]) == []
+    assert store.get(schedule["schedule_id"])["last_status"] == SKIPPED
+
+def test_run_now_and_reset_running(store):
+    schedule = store.create("nightly", "web", {}, "1h")
+    dispatch = Dispatch()
+    scheduler = Scheduler(store, dispatch, spread=0)
+    assert scheduler.run_now(schedule["schedule_id"])
+    assert not scheduler.run_now(schedule["schedule_id"])
+    assert not scheduler.run_now("missing")
+    # A new process finds the run it did not finish and marks it interrupted
+    assert store.reset_running() == 1
+    assert store.get(schedule["schedule_id"])["last_status"] == INTERRUPTED
+    dispatch.release.set()
+    wait_idle(scheduler)
+    assert dispatch.calls == [("nightly", "web", 50)]
+
+def test_disabled_schedules_are_not_due(store):
+    schedule = store.create("nightly", "web", {}, "1h")
+    assert store.set_enabled(schedule["schedule_id"], False)
+    assert store.due(schedule["next_run_at"] + 1) == []
+    assert not store.get(schedule["schedule_id"])["enabled"]
@@ -0,0 +1,45 @@
+import suggestion_cache
+from suggestion_cache import SuggestionCache, normalize_host
+
+TEMPLATES = ["http/cves/", "http/exposures/"]
+
+def test_entries_are_shared_by_urls_of_the_same_host(tmp_path):
+    cache = SuggestionCache(str(tmp_path / "cache.db"))
+    cache.put("http://Example.com/", "HTTP", TEMPLATES)
+
+    assert cache.get("https://example.com/login", "http") == TEMPLATES
+    assert cache.get("example.com", " http ") == TEMPLATES
+    assert cache.get("http://example.com:8080", "http") is None
+    assert cache.get("http://example.com", "cves") is None
+
+def test_entries_survive_a_restart(tmp_path):
+    SuggestionCache(str(tmp_path / "cache.db")).put("http://example.com", "http", TEMPLATES)
+    assert SuggestionCache(str(tmp_path / "cache.db")).get("http://example.com", "http") == TEMPLATES
+
+def test_expired_entries_are_dropped(tmp_path, monkeypatch):
+    cache = SuggestionCache(str(tmp_path / "cache.db"), ttl=60)
+    now = 1000.0
+    monkeypatch.setattr(suggestion_cache.time, "time", lambda: now)
+    cache.put("http://example.com", "http", TEMPLATES)
+
+    now += 61
+    assert cache.get("http://example.com", "http") is None
+    # The expired row is deleted, not just hidden from memory
+    assert SuggestionCache(str(tmp_path / "cache.db"), ttl=10 ** 9).get("http://example.com", "http") is None
+
+def test_memory_is_bounded_but_disk_keeps_evicted_entries(tmp_path):
+    cache = SuggestionCache(str(tmp_path / "cache.db"), max_entries=2)
+    for host in ("a.com", "b.com", "c.com"):
+        cache.put(host, "http", [host])
+
+    assert len(cache.memory) == 2
+    assert cache.get("a.com", "http") == ["a.com"]
+
+def test_version_bump_invalidates_entries(tmp_path):
+    SuggestionCache(str(tmp_path / "cache.db"), version="1").put("example.com", "http", TEMPLATES)
+    assert SuggestionCache(str(tmp_path / "cache.db"), version="2").get("example.com", "http") is None
+
+def test_normalize_host():
+    assert normalize_host("HTTPS://Example.com:443/path") == "example.com"
+    assert normalize_host("example.com:8443") == "example.com:8443"
+    assert normalize_host(" example.com ") == "example.com"
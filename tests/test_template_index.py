@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+from template_index import TemplateIndex, parse_template, severity_rank
+
+TEMPLATE = """id: {id}
+
+info:
+  name: {id}
+  author: test
+  severity: {severity}
+  tags: {tags}
+
+{protocol}:
+  - method: GET
+    path:
+      - "{{{{BaseURL}}}}/"
+"""
+
+def write_template(root, path, template_id, severity="info", tags="tech", protocol="http"):
+    full_path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w") as f:
+        f.write(TEMPLATE.format(id=template_id, severity=severity, tags=tags, protocol=protocol))
+    return full_path
+
+@pytest.fixture
+def templates_dir(tmp_path):
+    root = str(tmp_path / "nuclei-templates")
+    write_template(root, "http/cves/2024/CVE-2024-0001.yaml", "CVE-2024-0001", "critical", "cve,wordpress")
+    write_template(root, "http/exposures/git-config.yaml", "git-config", "medium", "exposure,git")
+    write_template(root, "http/technologies/nginx.yaml", "nginx-detect", "info", "tech,nginx")
+    write_template(root, "dns/caa.yaml", "caa-fingerprint", "info", "dns", protocol="dns")
+    return root
+
+def test_parse_template_reads_the_info_block(templates_dir):
+    entry = parse_template(os.path.join(templates_dir, "http/cves/2024/CVE-2024-0001.yaml"))
+    assert entry["id"] == "CVE-2024-0001"
+    assert entry["severity"] == "critical"
+    assert entry["tags"] == ["cve", "wordpress"]
+    assert entry["protocol"] == "http"
+    assert len(entry["hash"]) == 40
+
+def test_parse_template_without_id(tmp_path):
+    path = tmp_path / "broken.yaml"
+    path.write_text("info:\n  name: no id\n")
+    assert parse_template(str(path)) is None
+
+def test_exists_knows_directories_and_files(templates_dir, tmp_path):
+    index = TemplateIndex(templates_dir, str(tmp_path / "index.json"))
+    assert index.exists("http/cves/")
+    assert index.exists("http")
+    assert index.exists("http/exposures/git-config.yaml")
+    assert not index.exists("http/missing/")
+
+def test_find_filters(templates_dir, tmp_path):
+    index = TemplateIndex(templates_dir, str(tmp_path / "index.json"))
+
+    def ids(**filters):
+        return [entry["id"] for entry in index.find(**filters)]
+
+    assert ids(under="http/cves") == ["CVE-2024-0001"]
+    assert ids(min_severity="medium") == ["CVE-2024-0001", "git-config"]
+    assert ids(tags="nginx,git") == ["git-config", "nginx-detect"]
+    assert ids(under=["http/"], exclude_tags=["cve"]) == ["git-config", "nginx-detect"]
+    assert ids(technologies=["wordpress"]) == ["CVE-2024-0001"]
+    assert ids(protocol="dns") == ["caa-fingerprint"]
+    assert index.stats(under="http")["severity"] == {"critical": 1, "medium": 1, "info": 1}
+
+def test_refresh_parses_only_changed_files(templates_dir, tmp_path):
+    path = str(tmp_path / "index.json")
+    index = TemplateIndex(templates_dir, path)
+    assert index.refresh() == 4
+    assert index.refresh() == 0
+
+    changed = write_template(templates_dir, "http/exposures/git-config.yaml", "git-config", "high", "exposure")
+    os.utime(changed, (1, 1))
+    os.remove(os.path.join(templates_dir, "dns/caa.yaml"))
+    assert index.refresh() == 1
+    assert index.find(under="http/exposures")[0]["severity"] == "high"
+    assert not index.exists("dns/caa.yaml")
+
+def test_index_is_reloaded_from_disk(templates_dir, tmp_path):
+    path = str(tmp_path / "index.json")
+    TemplateIndex(templates_dir, path).refresh()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    # A new process parses nothing it has already indexed, but not an index built for another root
+    assert TemplateIndex(templates_dir, path).refresh() == 0
+    assert TemplateIndex(str(tmp_path), path).refresh() == 4
+
+def test_severity_rank():
+    assert severity_rank("Critical") > severity_rank("high") > severity_rank("info") > severity_rank("unknown")